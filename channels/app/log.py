@@ -0,0 +1,132 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# JSON lines go to stdout (picked up by Cloud Logging) unless a file is configured
+LOG_FILE = os.getenv("LOG_FILE")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of records kept per level, e.g. LOG_SAMPLE_DEBUG=0.1 keeps one debug line in ten
+LOG_SAMPLE_RATES = {
+    level: float(os.getenv(f"LOG_SAMPLE_{level}", "1.0"))
+    for level in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+}
+
+_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+_STANDARD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "context"}
+
+
+@contextmanager
+def log_context(**fields):
+    """Adds fields such as request_id or conversation_id to every line logged inside the block."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind_log_context(**fields):
+    """Adds fields to the log context of the current task for the rest of its life."""
+    _context.set({**_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = _context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelname, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        line.update(getattr(record, "context", {}))
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS:
+                line[key] = value
+        return json.dumps(line, default=str, ensure_ascii=False)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[BoundedQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging():
+    """
+    Routes the `app` logger through a bounded in-memory queue. Formatting to
+    JSON and the actual write happen on a background thread, so logging from
+    a request never blocks the event loop on I/O.
+    """
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    if LOG_FILE:
+        target = logging.FileHandler(LOG_FILE, encoding="utf-8")
+    else:
+        target = logging.StreamHandler(sys.stdout)
+    target.setFormatter(JsonFormatter())
+
+    _handler = BoundedQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    _handler.addFilter(ContextFilter())
+    _listener = logging.handlers.QueueListener(_handler.queue, target, respect_handler_level=False)
+    _listener.start()
+
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.addHandler(_handler)
+    app_logger.propagate = False
+
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _handler, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger("app").removeHandler(_handler)
+    _listener = None
+
+
+def logging_stats() -> dict:
+    if _handler is None:
+        return {}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
@@ -1,9 +1,17 @@
 from dotenv import load_dotenv
 load_dotenv(override=True)
 
+from app.log import setup_logging, shutdown_logging, logging_stats
+setup_logging()
+
 from app.whatsapp.utils import remove_extra_one
 
-from fastapi import BackgroundTasks, FastAPI, Request, Response, Depends
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from app.whatsapp import Subscription, process_request, verify_subscription, send_whatsapp_text_message
@@ -12,20 +20,48 @@ from fastapi import UploadFile, File
 from app.whatsapp.profile import get_profile, update_profile_picture
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import HTTPException
-from app.whatsapp.supabase_client import supabase
-
-app = FastAPI()
+from app.whatsapp.supabase_client import close_supabase
+from app.whatsapp.auth import token_verifier
+from app.whatsapp.id_token import id_token_provider
+from app.whatsapp.business_cache import business_directory
+from app.whatsapp.webhook_queue import webhook_queue
+from app.whatsapp.dedup import message_dedup
+from app.whatsapp.processor import message_coalescer, notify_failed_request
+from app.whatsapp.quota import ai_quota
+from app.whatsapp.orderbot_client import close_orderbot_client
+from app.whatsapp.config import close_graph_client
+from app.whatsapp.outbound import outbound_dispatcher
+from app.whatsapp.credentials import credential_registry
+from app.whatsapp.media import media_store
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers drain webhooks persisted by handle_message, including any left over from a previous run
+    await webhook_queue.start(process_request, on_failed=notify_failed_request)
+    ai_quota.start()
+    media_store.start()
+    yield
+    # Queued webhooks finish once their turns have run, so flush the coalescer while the queue drains
+    await asyncio.gather(webhook_queue.stop(timeout=8.0), message_coalescer.stop(timeout=8.0))
+    await ai_quota.stop()
+    await outbound_dispatcher.stop(timeout=10.0)
+    await media_store.stop()
+    await close_orderbot_client()
+    await close_graph_client()
+    await close_supabase()
+    shutdown_logging()
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(lifespan=lifespan)
 
 security = HTTPBearer()
 
-def verify_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def verify_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
-        # Pass the JWT token explicitly to verify it against Supabase
-        user_resp = supabase.auth.get_user(token)
-        if not user_resp or not user_resp.user:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return user_resp.user
+        # Verified locally and cached until exp; Supabase auth is only asked when that isn't possible
+        return await token_verifier.verify(token)
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
 
@@ -43,8 +79,6 @@ async def root():
     return {"message": "Hello WhatsApp Webhook UPDATED"}
 
 
-from fastapi import BackgroundTasks, FastAPI, Request, Response, Depends
-
 from fastapi import Query
 
 @app.get("/webhook")
@@ -59,11 +93,36 @@ async def verify_webhook(
 
 
 @app.post("/webhook")
-async def handle_message(request: Request, background_tasks: BackgroundTasks):
-    """Receives incoming messages and sends a reply."""
-    await process_request(request, background_tasks)
+async def handle_message(request: Request):
+    """Receives incoming messages and queues them; replies are sent by the queue workers."""
+    body = await request.body()
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return Response(status_code=400, content="Invalid JSON payload")
+    if not isinstance(data, dict) or not data.get("entry"):
+        return {"status": "no entry"}
+    webhook_queue.enqueue(body.decode("utf-8"))
     return {"status": "success"}
 
+
+@app.get("/metrics")
+async def metrics(user=Depends(verify_user)):
+    """Internal counters; they name tenants' phone numbers, so only signed-in users may read them."""
+    return {
+        "webhook_queue": webhook_queue.stats(),
+        "business_cache": business_directory.stats(),
+        "message_dedup": message_dedup.stats(),
+        "coalescer": message_coalescer.stats(),
+        "ai_quota": ai_quota.stats(),
+        "outbound": outbound_dispatcher.stats(),
+        "credentials": credential_registry.stats(),
+        "media": media_store.stats(),
+        "auth": token_verifier.stats(),
+        "id_tokens": id_token_provider.stats(),
+        "logging": logging_stats(),
+    }
+
 class OnboardStartRequest(BaseModel):
     phone_number: str
     display_name: str
@@ -107,8 +166,10 @@ class MessageRequest(BaseModel):
 
 @app.post("/send-message")
 async def send_message(payload: MessageRequest, user=Depends(verify_user)):
-    with open("debug_log.txt", "a") as f:
-        f.write(f"\n--- Manual Send Request ---\nPhone: {payload.phone_number}, Content: {payload.content}, ID: {payload.business_phone_number_id}\n")
+    logger.info(
+        "Manual send request to %s", payload.phone_number,
+        extra={"content": payload.content, "phone_number_id": payload.business_phone_number_id},
+    )
     from_number = remove_extra_one(payload.phone_number)
     await send_whatsapp_text_message(from_number, payload.content, phone_number_id=payload.business_phone_number_id)
     return {"status": "success"}
@@ -129,3 +190,10 @@ async def upload_whatsapp_profile_photo(phone_number_id: str, file: UploadFile =
         return result
     except Exception as e:
         return Response(status_code=400, content=str(e))
+
+@app.post("/cache/businesses/invalidate")
+async def invalidate_business_cache(business_id: str = None, user=Depends(verify_user)):
+    """Drops cached business rows after the CRM changes a business (all of them if no ID is given)."""
+    business_directory.invalidate(business_id)
+    credential_registry.invalidate(business_id=business_id)
+    return {"status": "success", "cache": business_directory.stats()}
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
+
+import jwt
+
+from .supabase_client import SUPABASE_TIMEOUT, http_client, supabase, url
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Legacy projects sign access tokens with HS256 and this secret; newer ones use asymmetric keys from JWKS
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL", f"{url.rstrip('/')}/auth/v1/.well-known/jwks.json")
+SUPABASE_JWKS_TTL = float(os.getenv("SUPABASE_JWKS_TTL", "600"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "1024"))
+
+# A token's kid missing from the cached JWKS triggers a refetch, but not more often than this
+JWKS_MIN_REFRESH_INTERVAL = 30.0
+
+
+class TokenVerifier:
+    """
+    Verifies Supabase access tokens for the CRM endpoints.
+
+    Tokens are checked locally, against the project JWT secret (HS256 only)
+    or the public keys of the project JWKS (each with its own algorithm),
+    which are fetched once and kept for `jwks_ttl` seconds. The token header
+    only picks the key; a header naming another algorithm is rejected.
+    Verified tokens are remembered by SHA-256 hash until their `exp`, so a
+    manager sending a burst of replies is verified once.
+    `supabase.auth.get_user` is only called when no local key can check the
+    token, e.g. the JWKS endpoint is unreachable.
+    """
+
+    def __init__(self, secret: Optional[str] = SUPABASE_JWT_SECRET, audience: str = SUPABASE_JWT_AUDIENCE, jwks_ttl: float = SUPABASE_JWKS_TTL, max_size: int = AUTH_CACHE_MAX_SIZE):
+        self.secret = secret
+        self.audience = audience
+        self.jwks_ttl = jwks_ttl
+        self._verified = TTLCache(ttl=0, max_size=max_size)
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._keys_fetched_at = 0.0
+        self._keys_lock = asyncio.Lock()
+        self.local_verifications = 0
+        self.remote_verifications = 0
+        self.rejected = 0
+
+    async def _refresh_keys(self):
+        async with self._keys_lock:
+            if time.monotonic() - self._keys_fetched_at < JWKS_MIN_REFRESH_INTERVAL:
+                return
+            try:
+                resp = await http_client.get(SUPABASE_JWKS_URL, timeout=SUPABASE_TIMEOUT)
+                resp.raise_for_status()
+                jwk_set = jwt.PyJWKSet.from_dict(resp.json())
+                self._keys = {key.key_id: key for key in jwk_set.keys if key.key_id}
+            except Exception as e:
+                logger.warning("Could not fetch Supabase JWKS: %s", e)
+            self._keys_fetched_at = time.monotonic()
+
+    async def _signing_key(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        if not kid:
+            return None
+        if kid not in self._keys or time.monotonic() - self._keys_fetched_at > self.jwks_ttl:
+            await self._refresh_keys()
+        return self._keys.get(kid)
+
+    async def _verify_locally(self, token: str) -> Optional[dict]:
+        """Returns the claims, None if there is no key to check the token with, or raises jwt.InvalidTokenError."""
+        header = jwt.get_unverified_header(token)
+        alg = header.get("alg")
+        if alg == "HS256":
+            if not self.secret:
+                return None
+            return jwt.decode(token, self.secret, algorithms=["HS256"], audience=self.audience)
+        jwk = await self._signing_key(header.get("kid"))
+        if jwk is None:
+            return None
+        if alg != jwk.algorithm_name:
+            raise jwt.InvalidAlgorithmError(f"Token signed with {alg}, key {jwk.key_id} is {jwk.algorithm_name}")
+        return jwt.decode(token, jwk.key, algorithms=[jwk.algorithm_name], audience=self.audience)
+
+    async def _verify_remotely(self, token: str) -> dict:
+        user_resp = await asyncio.wait_for(supabase.auth.get_user(token), SUPABASE_TIMEOUT)
+        if not user_resp or not user_resp.user:
+            raise jwt.InvalidTokenError("Invalid token")
+        # The auth server vouched for the token, so its claims can be read as-is
+        return jwt.decode(token, options={"verify_signature": False})
+
+    async def verify(self, token: str) -> dict:
+        """Returns the token claims or raises jwt.InvalidTokenError."""
+        cache_key = hashlib.sha256(token.encode()).digest()
+        claims = self._verified.get(cache_key)
+        if claims is not None:
+            return claims
+
+        try:
+            claims = await self._verify_locally(token)
+            if claims is None:
+                claims = await self._verify_remotely(token)
+                self.remote_verifications += 1
+            else:
+                self.local_verifications += 1
+        except jwt.InvalidTokenError:
+            self.rejected += 1
+            raise
+
+        ttl = claims.get("exp", 0) - time.time()
+        if ttl > 0:
+            self._verified.set(cache_key, claims, ttl=ttl)
+        return claims
+
+    def stats(self) -> dict:
+        return {
+            **self._verified.stats(),
+            "jwks_keys": len(self._keys),
+            "local_verifications": self.local_verifications,
+            "remote_verifications": self.remote_verifications,
+            "rejected": self.rejected,
+        }
+
+
+token_verifier = TokenVerifier()
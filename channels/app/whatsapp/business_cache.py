@@ -0,0 +1,151 @@
+import asyncio
+import os
+from typing import Optional
+
+from .supabase_client import execute, supabase
+from .ttl_cache import TTLCache
+
+BUSINESS_CACHE_TTL = float(os.getenv("BUSINESS_CACHE_TTL", "300"))
+BUSINESS_CACHE_MAX_SIZE = int(os.getenv("BUSINESS_CACHE_MAX_SIZE", "1024"))
+# Numbers with no business behind them are remembered this long, so their messages don't query the database
+BUSINESS_CACHE_NOT_FOUND_TTL = float(os.getenv("BUSINESS_CACHE_NOT_FOUND_TTL", "60"))
+
+BUSINESS_COLUMNS = "business_id, whatsapp_phone_number, whatsapp_phone_number_id, ai_message_count, subscription_tier"
+
+
+class BusinessDirectory:
+    """
+    In-process cache of business rows used on the webhook path.
+    Rows live in a `TTLCache` keyed by business_id, so they expire after
+    `ttl` seconds and are evicted least-recently-used beyond `max_size`;
+    the display phone number and phone_number_id indexes point into it.
+    Lookups that found no business are remembered for `not_found_ttl`
+    seconds, and concurrent misses for the same numbers share one load.
+    """
+
+    def __init__(self, ttl: float = BUSINESS_CACHE_TTL, max_size: int = BUSINESS_CACHE_MAX_SIZE, not_found_ttl: float = BUSINESS_CACHE_NOT_FOUND_TTL):
+        self._rows = TTLCache(ttl=ttl, max_size=max_size)
+        self._by_phone: dict[str, str] = {}
+        self._by_phone_number_id: dict[str, str] = {}
+        # (phone, phone_number_id) of lookups that found nothing
+        self._not_found = TTLCache(ttl=not_found_ttl, max_size=max_size)
+        self._loading: dict[tuple, asyncio.Future] = {}
+        self.not_found_hits = 0
+        self.shared_loads = 0
+
+    def _lookup(self, index: dict, key: Optional[str]) -> Optional[dict]:
+        if not key:
+            return None
+        business_id = index.get(key)
+        if business_id is None:
+            return None
+        if business_id not in self._rows:
+            # Expired or evicted since it was indexed
+            del index[key]
+            return None
+        return self._rows.get(business_id)
+
+    def _unindex(self, business_id: str, record: dict):
+        if self._by_phone.get(record.get("whatsapp_phone_number")) == business_id:
+            del self._by_phone[record["whatsapp_phone_number"]]
+        if self._by_phone_number_id.get(record.get("whatsapp_phone_number_id")) == business_id:
+            del self._by_phone_number_id[record["whatsapp_phone_number_id"]]
+
+    def _reindex(self):
+        """Rebuilds both indexes from the live rows, dropping keys of evicted businesses."""
+        self._by_phone.clear()
+        self._by_phone_number_id.clear()
+        for business_id, record in self._rows.items():
+            if record.get("whatsapp_phone_number"):
+                self._by_phone[record["whatsapp_phone_number"]] = business_id
+            if record.get("whatsapp_phone_number_id"):
+                self._by_phone_number_id[record["whatsapp_phone_number_id"]] = business_id
+
+    def _store(self, record: dict):
+        business_id = record["business_id"]
+        previous = self._rows.pop(business_id)
+        if previous is not None:
+            self._unindex(business_id, previous)
+        self._rows.set(business_id, record)
+        if record.get("whatsapp_phone_number"):
+            self._by_phone[record["whatsapp_phone_number"]] = business_id
+        if record.get("whatsapp_phone_number_id"):
+            self._by_phone_number_id[record["whatsapp_phone_number_id"]] = business_id
+        # Evictions leave index keys behind until they are looked up again
+        if len(self._by_phone) + len(self._by_phone_number_id) > 4 * self._rows.max_size:
+            self._reindex()
+
+    async def _fetch(self, column: str, value: str) -> Optional[dict]:
+        b_query = await execute(supabase.table("businesses").select(BUSINESS_COLUMNS).eq(column, value).limit(1))
+        if not b_query.data:
+            return None
+        record = b_query.data[0]
+        self._store(record)
+        return record
+
+    async def _load(self, key: tuple) -> Optional[dict]:
+        phone, phone_number_id = key
+        record = None
+        if phone:
+            record = await self._fetch("whatsapp_phone_number", phone)
+        if record is None and phone_number_id:
+            record = await self._fetch("whatsapp_phone_number_id", phone_number_id)
+        if record is None:
+            self._not_found.set(key, True)
+        return record
+
+    async def resolve(self, phone: Optional[str] = None, phone_number_id: Optional[str] = None) -> Optional[dict]:
+        """Return the business row for a webhook, hitting Supabase only on a cache miss."""
+        record = self._lookup(self._by_phone_number_id, phone_number_id) or self._lookup(self._by_phone, phone)
+        if record is not None:
+            return record
+
+        key = (phone, phone_number_id)
+        if key in self._not_found:
+            self.not_found_hits += 1
+            return None
+        loading = self._loading.get(key)
+        if loading is None:
+            self._rows.misses += 1
+            loading = self._loading[key] = asyncio.ensure_future(self._load(key))
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        else:
+            self.shared_loads += 1
+        # Shielded, so a caller that gives up doesn't cancel the load for the others
+        return await asyncio.shield(loading)
+
+    async def get_by_phone(self, phone: str) -> Optional[dict]:
+        return await self.resolve(phone=phone)
+
+    async def get_by_phone_number_id(self, phone_number_id: str) -> Optional[dict]:
+        return await self.resolve(phone_number_id=phone_number_id)
+
+    def set_ai_message_count(self, business_id: str, count: int):
+        """Write a new AI message count through to the cached row, if present."""
+        record = self._rows.peek(business_id)
+        if record is not None:
+            record["ai_message_count"] = count
+
+    def invalidate(self, business_id: Optional[str] = None):
+        """Drop one business (or every business when no ID is given), and every not-found result."""
+        # A business whose numbers changed may now answer a lookup that found nothing
+        self._not_found.clear()
+        if business_id is None:
+            self._rows.clear()
+            self._by_phone.clear()
+            self._by_phone_number_id.clear()
+            return
+        record = self._rows.pop(business_id)
+        if record is not None:
+            self._unindex(business_id, record)
+
+    def stats(self) -> dict:
+        return {
+            **self._rows.stats(),
+            "not_found": len(self._not_found),
+            "not_found_hits": self.not_found_hits,
+            "shared_loads": self.shared_loads,
+        }
+
+
+business_directory = BusinessDirectory()
@@ -1,12 +1,17 @@
-import os
-from .config import client, BASE_URL, HEADERS, WHATSAPP_ACCESS_TOKEN, MIME_TYPE, GRAPH_API_VERSION
+import logging
+from .config import client, GRAPH_URL
+from .credentials import credential_registry
+from .outbound import outbound_dispatcher
+from .media import media_store
+
+logger = logging.getLogger(__name__)
 
 async def mark_message_as_read(message_id: str, phone_number_id: str = None):
     # Construct URL dynamically if ID is provided, else use default from config (if any)
     # Ideally should always provide ID.
     from .config import PHONE_NUMBER_ID
     pid = phone_number_id or PHONE_NUMBER_ID
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{pid}/messages"
+    url = f"{GRAPH_URL}/{pid}/messages"
     
     payload = {
         "messaging_product": "whatsapp",
@@ -14,21 +19,19 @@ async def mark_message_as_read(message_id: str, phone_number_id: str = None):
         "message_id": message_id,
         "typing_indicator": {"type": "text"},
     }
-    response = await client.post(url, json=payload, headers=HEADERS)
+    credentials = await credential_registry.get(pid)
+    response = await client.post(url, json=payload, headers=credentials.headers)
     try:
         response.raise_for_status()
     except Exception as e:
-        print(f"Error marking message as read: {e}")
-        print(f"Response: {response.text}")
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Error marking message as read: {e}\nResponse: {response.text}\n")
+        logger.error("Error marking message as read: %s", e, extra={"response": response.text})
 
 async def send_whatsapp_text_message(to_number: str, text: str, phone_number_id: str = None):
     from .config import PHONE_NUMBER_ID
     pid = phone_number_id or PHONE_NUMBER_ID
-    print(f"Sending text message to: {to_number} from {pid}")
+    logger.debug("Sending text message to %s from %s", to_number, pid)
     
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{pid}/messages"
+    url = f"{GRAPH_URL}/{pid}/messages"
     
     payload = {
         "messaging_product": "whatsapp",
@@ -36,45 +39,25 @@ async def send_whatsapp_text_message(to_number: str, text: str, phone_number_id:
         "type": "text",
         "text": {"body": text},
     }
-    response = await client.post(url, json=payload, headers=HEADERS)
-    try:
-        response.raise_for_status()
-        print(f"Message sent successfully to {to_number}")
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Message sent successfully to {to_number}: {response.text}\n")
-    except Exception as e:
-        print(f"Error sending text message: {e}")
-        print(f"Response: {response.text}")
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Error sending text message to {to_number}: {e}\nResponse: {response.text}\n")
+    # Rate limited, retried and dead-lettered by the outbound dispatcher
+    credentials = await credential_registry.get(pid)
+    outbound_dispatcher.enqueue(pid, to_number, url, payload, credentials.headers)
 
 async def upload_media(file_path: str, phone_number_id: str = None):
+    """Uploads a local file or an http(s) URL, reusing the media_id of identical content uploaded before."""
     from .config import PHONE_NUMBER_ID
     pid = phone_number_id or PHONE_NUMBER_ID
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{pid}/media"
-    
-    upload_headers = {
-        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-    }
-    with open(file_path, "rb") as f:
-        files = {"file": (os.path.basename(file_path), f, MIME_TYPE)}
-        data = {
-            "messaging_product": "whatsapp",
-            "type": MIME_TYPE,
-        }
-        response = await client.post(
-            url,
-            headers=upload_headers,
-            data=data,
-            files=files,
-        )
-    response.raise_for_status()
-    return response.json()
+    mime_type = None
+    if file_path.startswith(("http://", "https://")):
+        # The agent may run on another machine and link to the image instead of sharing a disk
+        cached = await media_store.fetch_url(file_path)
+        file_path, mime_type = cached.path, cached.mime_type
+    return await media_store.upload(file_path, pid, mime_type)
 
 async def send_whatsapp_image_message(to_number: str, caption: str, media_id: str, phone_number_id: str = None):
     from .config import PHONE_NUMBER_ID
     pid = phone_number_id or PHONE_NUMBER_ID
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{pid}/messages"
+    url = f"{GRAPH_URL}/{pid}/messages"
 
     payload = {
         "messaging_product": "whatsapp",
@@ -86,14 +69,5 @@ async def send_whatsapp_image_message(to_number: str, caption: str, media_id: st
             "caption": caption,
         },
     }
-    response = await client.post(url, json=payload, headers=HEADERS)
-    try:
-        response.raise_for_status()
-        print(f"Image message sent successfully to {to_number}")
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Image message sent successfully to {to_number}: {response.text}\n")
-    except Exception as e:
-        print(f"Error sending image message: {e}")
-        print(f"Response: {response.text}")
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Error sending image message to {to_number}: {e}\nResponse: {response.text}\n")
+    credentials = await credential_registry.get(pid)
+    outbound_dispatcher.enqueue(pid, to_number, url, payload, credentials.headers)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Messages of a conversation arriving less than this many seconds apart become one agent turn
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.5"))
+# A turn is never delayed longer than this after its first message, even if messages keep coming
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", "5.0"))
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "32"))
+
+
+class _PendingTurn:
+    def __init__(self, now: float):
+        self.parts: list[str] = []
+        self.context: dict = {}
+        # One per message, settled when the turn has run
+        self.waiters: list[asyncio.Future] = []
+        self.first_at = now
+        self.last_at = now
+
+
+class MessageCoalescer:
+    """
+    Debounces inbound messages per conversation before calling the agent.
+
+    Customers often send "hi", "2 pizzas", "large", "delivery" as separate
+    messages. Every conversation gets one drain task that waits until
+    `window` seconds pass without a new message (capped at `max_wait`), then
+    calls `handler` once with the merged text. Turns of a conversation run
+    strictly one after another; messages arriving during a turn are buffered
+    into the next one. Agent calls across conversations are capped by
+    `max_concurrency`. Every message gets a future that resolves once its
+    turn has run, or raises what `handler` raised.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable],
+        window: float = COALESCE_WINDOW,
+        max_wait: float = COALESCE_MAX_WAIT,
+        max_concurrency: int = AGENT_MAX_CONCURRENCY,
+    ):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self._limiter = asyncio.Semaphore(max_concurrency)
+        self._pending: dict[Hashable, _PendingTurn] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+        self._flush_now = False
+        self.messages_received = 0
+        self.agent_calls = 0
+        self.failed_calls = 0
+
+    def submit(self, key: Hashable, content: str, **context) -> asyncio.Future:
+        """
+        Adds a message to the conversation's next agent turn. `context` of the
+        latest message wins. The returned future resolves once that turn has run.
+        """
+        now = time.monotonic()
+        turn = self._pending.get(key)
+        if turn is None:
+            turn = self._pending[key] = _PendingTurn(now)
+        turn.parts.append(content)
+        turn.context = context
+        turn.last_at = now
+        waiter = asyncio.get_running_loop().create_future()
+        turn.waiters.append(waiter)
+        self.messages_received += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._drain(key))
+        return waiter
+
+    def _delay(self, turn: _PendingTurn) -> float:
+        if self._flush_now:
+            return 0.0
+        deadline = min(turn.last_at + self.window, turn.first_at + self.max_wait)
+        return deadline - time.monotonic()
+
+    async def _drain(self, key: Hashable):
+        try:
+            while key in self._pending:
+                delay = self._delay(self._pending[key])
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                turn = self._pending.pop(key)
+                self.agent_calls += 1
+                async with self._limiter:
+                    try:
+                        await self.handler("\n".join(turn.parts), **turn.context)
+                    except asyncio.CancelledError:
+                        for waiter in turn.waiters:
+                            waiter.cancel()
+                        raise
+                    except Exception as e:
+                        self.failed_calls += 1
+                        logger.warning("Coalesced agent turn for %s failed: %s", key, e)
+                        for waiter in turn.waiters:
+                            if not waiter.done():
+                                waiter.set_exception(e)
+                    else:
+                        for waiter in turn.waiters:
+                            if not waiter.done():
+                                waiter.set_result(None)
+        finally:
+            del self._tasks[key]
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Flushes every pending turn immediately and waits for running turns to finish."""
+        self._flush_now = True
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()), timeout=timeout)
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "pending_conversations": len(self._pending),
+            "active_conversations": len(self._tasks),
+            "messages_received": self.messages_received,
+            "agent_calls": self.agent_calls,
+            "failed_calls": self.failed_calls,
+            "agent_calls_saved": self.messages_received - self.agent_calls - sum(len(t.parts) for t in self._pending.values()),
+        }
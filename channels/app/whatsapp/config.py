@@ -8,13 +8,29 @@ WHATSAPP_BUSINESS_ACCOUNT_ID = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID")
 GRAPH_API_VERSION = os.getenv("GRAPH_API_VERSION")
 MIME_TYPE = "image/png"
 
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "100"))
+GRAPH_MAX_KEEPALIVE = int(os.getenv("GRAPH_MAX_KEEPALIVE", "20"))
+
+# Single pooled client shared by every Graph API call (messages, media, onboarding, profile).
+# Closed by the FastAPI lifespan via close_graph_client().
 timeout_config = httpx.Timeout(60.0, connect=10.0)
-client = httpx.AsyncClient(timeout=timeout_config)
+client = httpx.AsyncClient(
+    timeout=timeout_config,
+    http2=True,
+    limits=httpx.Limits(max_connections=GRAPH_MAX_CONNECTIONS, max_keepalive_connections=GRAPH_MAX_KEEPALIVE),
+)
+
+async def close_graph_client():
+    await client.aclose()
 
 if GRAPH_API_VERSION and not GRAPH_API_VERSION.startswith("v"):
     GRAPH_API_VERSION = f"v{GRAPH_API_VERSION}"
 
-BASE_URL = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{PHONE_NUMBER_ID}"
+# Point at a local stand-in (see benchmarks/stubs.py) to load test without Meta
+GRAPH_API_BASE_URL = os.getenv("GRAPH_API_BASE_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_URL = f"{GRAPH_API_BASE_URL}/{GRAPH_API_VERSION}"
+
+BASE_URL = f"{GRAPH_URL}/{PHONE_NUMBER_ID}"
 MESSAGES_URL = f"{BASE_URL}/messages"
 MEDIA_URL = f"{BASE_URL}/media"
 
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from .config import WHATSAPP_ACCESS_TOKEN
+from .supabase_client import execute, supabase
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Rotated tokens are picked up at most this many seconds after the row changes
+WHATSAPP_CREDENTIALS_TTL = float(os.getenv("WHATSAPP_CREDENTIALS_TTL", "300"))
+WHATSAPP_CREDENTIALS_MAX_SIZE = int(os.getenv("WHATSAPP_CREDENTIALS_MAX_SIZE", "1024"))
+
+
+class TenantCredentials:
+    """Access token of one business phone number, with its Graph API headers built once."""
+
+    def __init__(self, phone_number_id: Optional[str], access_token: str, business_id: Optional[str] = None):
+        self.phone_number_id = phone_number_id
+        self.access_token = access_token
+        self.business_id = business_id
+        self.auth_headers = {"Authorization": f"Bearer {access_token}"}
+        self.headers = {**self.auth_headers, "Content-Type": "application/json"}
+
+
+class CredentialRegistry:
+    """
+    Per-tenant WhatsApp credentials keyed by phone_number_id.
+
+    Tokens are read lazily from `businesses.whatsapp_access_token` and
+    cached for `ttl` seconds, so a rotated token is used without a restart;
+    `invalidate` (or a 401 from Graph, see outbound.py) drops an entry
+    right away. Numbers without a stored token use the global
+    WHATSAPP_ACCESS_TOKEN. Concurrent misses for the same number share one
+    lookup.
+    """
+
+    def __init__(self, ttl: float = WHATSAPP_CREDENTIALS_TTL, max_size: int = WHATSAPP_CREDENTIALS_MAX_SIZE):
+        self._cache = TTLCache(ttl=ttl, max_size=max_size)
+        self._loading: dict[str, asyncio.Task] = {}
+        self._default = TenantCredentials(None, WHATSAPP_ACCESS_TOKEN)
+        self.loads = 0
+        self.fallbacks = 0
+
+    async def get(self, phone_number_id: Optional[str]) -> TenantCredentials:
+        if not phone_number_id:
+            return self._default
+        credentials = self._cache.get(phone_number_id)
+        if credentials is not None:
+            return credentials
+        task = self._loading.get(phone_number_id)
+        if task is None:
+            task = self._loading[phone_number_id] = asyncio.create_task(self._load(phone_number_id))
+            task.add_done_callback(lambda _: self._loading.pop(phone_number_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, phone_number_id: str) -> TenantCredentials:
+        self.loads += 1
+        try:
+            result = await execute(
+                supabase.table("businesses")
+                .select("business_id, whatsapp_access_token")
+                .eq("whatsapp_phone_number_id", phone_number_id)
+                .limit(1)
+            )
+        except Exception as e:
+            # Don't cache the fallback, the next call retries the lookup
+            logger.error("Error loading WhatsApp credentials for %s: %s", phone_number_id, e)
+            self.fallbacks += 1
+            return self._default
+
+        row = result.data[0] if result.data else {}
+        access_token = row.get("whatsapp_access_token")
+        if not access_token:
+            self.fallbacks += 1
+            access_token = WHATSAPP_ACCESS_TOKEN
+        credentials = TenantCredentials(phone_number_id, access_token, row.get("business_id"))
+        self._cache.set(phone_number_id, credentials)
+        return credentials
+
+    def invalidate(self, phone_number_id: Optional[str] = None, business_id: Optional[str] = None):
+        """Drops one number, every number of a business, or everything when neither is given."""
+        if phone_number_id:
+            self._cache.pop(phone_number_id)
+        elif business_id:
+            for key, credentials in self._cache.items():
+                if credentials.business_id == business_id:
+                    self._cache.pop(key)
+        else:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "loads": self.loads, "global_token_fallbacks": self.fallbacks}
+
+
+credential_registry = CredentialRegistry()
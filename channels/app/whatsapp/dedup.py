@@ -0,0 +1,57 @@
+import os
+
+from .ttl_cache import TTLCache
+
+# Meta retries a delivery for up to a few hours, so remember IDs for longer than that
+MESSAGE_DEDUP_TTL = float(os.getenv("MESSAGE_DEDUP_TTL", str(24 * 3600)))
+MESSAGE_DEDUP_MAX_SIZE = int(os.getenv("MESSAGE_DEDUP_MAX_SIZE", "100000"))
+
+
+class MessageDeduplicator:
+    """
+    Drops redelivered WhatsApp messages by their `message.id`.
+
+    The in-memory LRU answers the common case (a retry reaching the same
+    instance) with a single lookup. The UNIQUE(wa_message_id) constraint on
+    `messages` is the durable fallback, reported back through `record_duplicate`.
+    Claims of messages that fail are released, so the webhook queue's retry
+    is not mistaken for a redelivery.
+    """
+
+    def __init__(self, ttl: float = MESSAGE_DEDUP_TTL, max_size: int = MESSAGE_DEDUP_MAX_SIZE):
+        self._seen = TTLCache(ttl=ttl, max_size=max_size)
+        self.memory_duplicates = 0
+        self.db_duplicates = 0
+
+    def claim(self, message_id: str) -> bool:
+        """Returns True the first time a message ID is seen, False for a redelivery."""
+        if not message_id:
+            return True
+        if self._seen.add(message_id):
+            return True
+        self.memory_duplicates += 1
+        return False
+
+    def holds(self, message_id: str) -> bool:
+        """True while a message ID is claimed: answered, being answered, or dropped as a redelivery."""
+        return bool(message_id) and message_id in self._seen
+
+    def release(self, message_id: str):
+        """Forgets a claimed ID whose processing failed, so its retry is processed again."""
+        if message_id:
+            self._seen.pop(message_id)
+
+    def record_duplicate(self):
+        """Counts a redelivery caught by the database constraint instead of the cache."""
+        self.db_duplicates += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._seen),
+            "duplicates": self.memory_duplicates + self.db_duplicates,
+            "memory_duplicates": self.memory_duplicates,
+            "db_duplicates": self.db_duplicates,
+        }
+
+
+message_dedup = MessageDeduplicator()
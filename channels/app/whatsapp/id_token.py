@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+import google.auth.transport.requests
+import google.oauth2.id_token
+import jwt
+
+logger = logging.getLogger(__name__)
+
+# Tokens are refreshed in the background once they are this close to their real exp
+ID_TOKEN_REFRESH_MARGIN = float(os.getenv("ID_TOKEN_REFRESH_MARGIN", "300"))
+# Below this remaining lifetime a token is not handed out anymore; callers wait for the refresh
+ID_TOKEN_MIN_VALIDITY = float(os.getenv("ID_TOKEN_MIN_VALIDITY", "30"))
+# Used only if a token comes back without a readable exp
+ID_TOKEN_DEFAULT_LIFETIME = 3000
+
+
+class IdTokenProvider:
+    """
+    Google ID tokens for service-to-service calls, cached per audience.
+
+    A token is served from memory until `refresh_margin` seconds before its
+    exp; in that window the cached token is still returned while a single
+    background fetch replaces it. Callers that find no usable token share
+    one in-flight fetch per audience instead of each starting their own.
+    """
+
+    def __init__(self, refresh_margin: float = ID_TOKEN_REFRESH_MARGIN, min_validity: float = ID_TOKEN_MIN_VALIDITY):
+        self.refresh_margin = refresh_margin
+        self.min_validity = min_validity
+        # audience -> (token, expires_at as a unix timestamp)
+        self._tokens: dict[str, tuple[str, float]] = {}
+        self._refreshes: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.waits = 0
+        self.background_refreshes = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.refresh_seconds_total = 0.0
+        self.refresh_seconds_max = 0.0
+        self.last_refresh_seconds: Optional[float] = None
+
+    async def get(self, audience: str) -> str:
+        entry = self._tokens.get(audience)
+        remaining = entry[1] - time.time() if entry else 0.0
+
+        if remaining > self.min_validity:
+            self.hits += 1
+            if remaining <= self.refresh_margin and audience not in self._refreshes:
+                self.background_refreshes += 1
+                self._refresh(audience)
+            return entry[0]
+
+        self.waits += 1
+        # shield: a cancelled caller must not cancel the fetch other callers are waiting on
+        return await asyncio.shield(self._refresh(audience))
+
+    def _refresh(self, audience: str) -> asyncio.Task:
+        task = self._refreshes.get(audience)
+        if task is None:
+            task = self._refreshes[audience] = asyncio.create_task(self._fetch(audience))
+            task.add_done_callback(lambda t: self._done(audience, t))
+        return task
+
+    def _done(self, audience: str, task: asyncio.Task):
+        self._refreshes.pop(audience, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Callers awaiting the task get the exception; background refreshes only log it
+            logger.warning("ID token refresh for %s failed: %s", audience, task.exception())
+
+    async def _fetch(self, audience: str) -> str:
+        start = time.perf_counter()
+        try:
+            auth_req = google.auth.transport.requests.Request()
+            token = await asyncio.to_thread(google.oauth2.id_token.fetch_id_token, auth_req, audience)
+        except Exception:
+            self.refresh_failures += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.last_refresh_seconds = elapsed
+            self.refresh_seconds_total += elapsed
+            self.refresh_seconds_max = max(self.refresh_seconds_max, elapsed)
+        self.refreshes += 1
+
+        try:
+            expires_at = float(jwt.decode(token, options={"verify_signature": False})["exp"])
+        except Exception:
+            expires_at = time.time() + ID_TOKEN_DEFAULT_LIFETIME
+        self._tokens[audience] = (token, expires_at)
+        return token
+
+    def stats(self) -> dict:
+        now = time.time()
+        attempts = self.refreshes + self.refresh_failures
+        return {
+            "audiences": {audience: round(expires_at - now) for audience, (_, expires_at) in self._tokens.items()},
+            "hits": self.hits,
+            "waits": self.waits,
+            "refreshes": self.refreshes,
+            "background_refreshes": self.background_refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refresh_ms_avg": self.refresh_seconds_total / attempts * 1000 if attempts else 0.0,
+            "refresh_ms_max": self.refresh_seconds_max * 1000,
+            "refresh_ms_last": self.last_refresh_seconds * 1000 if self.last_refresh_seconds is not None else None,
+        }
+
+
+id_token_provider = IdTokenProvider()
+
+
+async def get_id_token(audience: str) -> str:
+    """Fetch an ID token for the given audience (service URL without path), cached until shortly before exp."""
+    return await id_token_provider.get(audience)
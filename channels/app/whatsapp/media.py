@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import time
+import uuid
+from typing import Optional
+
+from .config import GRAPH_URL, MIME_TYPE, client
+from .credentials import credential_registry
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Files not used for this long are removed by the periodic sweep
+MEDIA_CACHE_MAX_AGE = float(os.getenv("MEDIA_CACHE_MAX_AGE", str(24 * 3600)))
+MEDIA_CACHE_SWEEP_INTERVAL = float(os.getenv("MEDIA_CACHE_SWEEP_INTERVAL", "3600"))
+# Uploaded media stays on Meta's side for 30 days; re-upload well before that
+WHATSAPP_MEDIA_ID_TTL = float(os.getenv("WHATSAPP_MEDIA_ID_TTL", str(24 * 3600)))
+# Inbound media downloaded in the background at once; more wait their turn
+MEDIA_PREFETCH_CONCURRENCY = int(os.getenv("MEDIA_PREFETCH_CONCURRENCY", "4"))
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+
+class CachedMedia:
+    def __init__(self, sha256: str, path: str, mime_type: str, size: int):
+        self.sha256 = sha256
+        self.path = path
+        self.mime_type = mime_type
+        self.size = size
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MEDIA_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _touched_size(path: str) -> Optional[int]:
+    """Marks a cached file as used and returns its size, or None if it isn't cached."""
+    try:
+        os.utime(path)
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return None
+
+
+def _commit(tmp_path: str, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+
+
+def _discard(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class MediaStore:
+    """
+    Content-addressed disk cache for WhatsApp media.
+
+    Files are stored as `<dir>/<sha256[:2]>/<sha256>`. Downloads are
+    streamed to disk in chunks, so a large video never sits in memory.
+    Disk access happens in worker threads, off the event loop. Inbound
+    media is looked up by the sha256 Graph reports, so the same bytes are
+    only downloaded once; `prefetch` does that in the background. Media
+    fetched by URL is remembered by URL for `max_age` seconds. Uploads are
+    remembered by (phone_number_id, sha256) and reuse the returned media_id
+    for `media_id_ttl` seconds. A periodic sweep deletes files unused for
+    `max_age` seconds and then the least recently used ones until the
+    cache fits in `max_bytes`.
+    """
+
+    def __init__(self, root: str = MEDIA_CACHE_DIR, max_bytes: int = MEDIA_CACHE_MAX_BYTES, max_age: float = MEDIA_CACHE_MAX_AGE, media_id_ttl: float = WHATSAPP_MEDIA_ID_TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._media_ids = TTLCache(ttl=media_id_ttl, max_size=10000)
+        # url -> (sha256, mime_type) of media fetched by `fetch_url`
+        self._urls = TTLCache(ttl=max_age, max_size=10000)
+        self._task: Optional[asyncio.Task] = None
+        self._sweep_task: Optional[asyncio.Task] = None
+        self._prefetch_slots = asyncio.Semaphore(MEDIA_PREFETCH_CONCURRENCY)
+        self._prefetching: set[asyncio.Task] = set()
+        self.size_bytes: Optional[int] = None
+        self.downloads = 0
+        self.download_hits = 0
+        self.uploads = 0
+        self.upload_hits = 0
+        self.evictions = 0
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _added(self, size: int):
+        if self.size_bytes is not None:
+            self.size_bytes += size
+            if self.size_bytes > self.max_bytes:
+                self._schedule_sweep()
+
+    async def _stream_to_cache(self, url: str, headers: dict, expected_sha256: Optional[str] = None) -> tuple[str, str, int]:
+        """Streams a download into a temp file, hashing as it goes, then moves it to its content address."""
+        await asyncio.to_thread(os.makedirs, self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                mime_type = response.headers.get("content-type", "application/octet-stream").split(";")[0]
+                f = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(MEDIA_CHUNK_SIZE):
+                        digest.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                        size += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            sha256 = digest.hexdigest()
+            if expected_sha256 and sha256 != expected_sha256:
+                logger.warning("Media from %s hashed to %s, Graph reported %s", url, sha256, expected_sha256)
+            await asyncio.to_thread(_commit, tmp_path, self._path(sha256))
+        finally:
+            await asyncio.to_thread(_discard, tmp_path)
+        self._added(size)
+        return sha256, mime_type, size
+
+    async def download(self, media_id: str, phone_number_id: Optional[str] = None) -> CachedMedia:
+        """Fetches inbound media by its Graph media ID, reusing the cached file when the content is known."""
+        credentials = await credential_registry.get(phone_number_id)
+        response = await client.get(f"{GRAPH_URL}/{media_id}", headers=credentials.auth_headers)
+        response.raise_for_status()
+        info = response.json()
+        mime_type = info.get("mime_type", "application/octet-stream")
+
+        sha256 = info.get("sha256")
+        if sha256:
+            size = await asyncio.to_thread(_touched_size, self._path(sha256))
+            if size is not None:
+                self.download_hits += 1
+                return CachedMedia(sha256, self._path(sha256), mime_type, size)
+
+        self.downloads += 1
+        sha256, _, size = await self._stream_to_cache(info["url"], credentials.auth_headers, sha256)
+        return CachedMedia(sha256, self._path(sha256), mime_type, size)
+
+    def prefetch(self, media_id: str, phone_number_id: Optional[str] = None):
+        """Downloads inbound media into the cache in the background; the caller doesn't wait for it."""
+        task = asyncio.create_task(self._prefetch(media_id, phone_number_id))
+        self._prefetching.add(task)
+        task.add_done_callback(self._prefetching.discard)
+
+    async def _prefetch(self, media_id: str, phone_number_id: Optional[str]):
+        async with self._prefetch_slots:
+            try:
+                cached = await self.download(media_id, phone_number_id)
+                logger.info("Cached inbound media %s", media_id, extra={"sha256": cached.sha256, "bytes": cached.size})
+            except Exception as e:
+                logger.error("Error downloading inbound media %s: %s", media_id, e)
+
+    async def fetch_url(self, url: str) -> CachedMedia:
+        """Caches media the agent links to (e.g. a signed storage URL) so it can be uploaded from disk."""
+        known = self._urls.get(url)
+        if known is not None:
+            sha256, mime_type = known
+            size = await asyncio.to_thread(_touched_size, self._path(sha256))
+            if size is not None:
+                self.download_hits += 1
+                return CachedMedia(sha256, self._path(sha256), mime_type, size)
+
+        self.downloads += 1
+        sha256, mime_type, size = await self._stream_to_cache(url, {})
+        self._urls.set(url, (sha256, mime_type))
+        return CachedMedia(sha256, self._path(sha256), mime_type, size)
+
+    async def upload(self, path: str, phone_number_id: str, mime_type: Optional[str] = None) -> dict:
+        """Uploads a file to Graph for `phone_number_id`, or returns the media_id of an earlier upload of the same bytes."""
+        sha256 = await asyncio.to_thread(_hash_file, path)
+        key = (phone_number_id, sha256)
+        media_id = self._media_ids.get(key)
+        if media_id is not None:
+            self.upload_hits += 1
+            return {"id": media_id}
+
+        mime_type = mime_type or mimetypes.guess_type(path)[0] or MIME_TYPE
+        credentials = await credential_registry.get(phone_number_id)
+        self.uploads += 1
+        # Read in a worker thread: httpx would read a file object on the event loop while sending.
+        # WhatsApp caps media at 100MB, so holding one upload in memory is bounded.
+        content = await asyncio.to_thread(_read_file, path)
+        response = await client.post(
+            f"{GRAPH_URL}/{phone_number_id}/media",
+            headers=credentials.auth_headers,
+            data={"messaging_product": "whatsapp", "type": mime_type},
+            files={"file": (os.path.basename(path), content, mime_type)},
+        )
+        response.raise_for_status()
+        result = response.json()
+        if result.get("id"):
+            self._media_ids.set(key, result["id"])
+        return result
+
+    def _sweep(self) -> tuple[int, int]:
+        """Deletes stale files, then the least recently used ones over the size bound. Returns (files, bytes) left."""
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith("."):
+                    # Downloads still in progress
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - self.max_age
+        kept = 0
+        for mtime, size, path in files:
+            if mtime < cutoff or total > self.max_bytes:
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+            else:
+                kept += 1
+        return kept, total
+
+    async def sweep(self):
+        if not os.path.isdir(self.root):
+            self.size_bytes = 0
+            return
+        files, self.size_bytes = await asyncio.to_thread(self._sweep)
+        logger.debug("Media cache swept", extra={"files": files, "bytes": self.size_bytes})
+
+    def _schedule_sweep(self):
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.get_running_loop().create_task(self.sweep())
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("Error sweeping media cache: %s", e)
+            await asyncio.sleep(MEDIA_CACHE_SWEEP_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        tasks = list(self._prefetching)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "downloads": self.downloads,
+            "prefetching": len(self._prefetching),
+            "download_hits": self.download_hits,
+            "uploads": self.uploads,
+            "upload_hits": self.upload_hits,
+            "evictions": self.evictions,
+        }
+
+
+media_store = MediaStore()
@@ -8,3 +8,21 @@ class Subscription(BaseModel):
     mode: Annotated[str | None, Query(alias="hub.mode")] = None
     token: Annotated[str | None, Query(alias="hub.verify_token")] = None
     challenge: Annotated[str | None, Query(alias="hub.challenge")] = None
+
+
+class InboundMessage(BaseModel):
+    """One message from a webhook batch, with the metadata and contact of its change."""
+    display_phone_number: str
+    phone_number_id: str | None = None
+    wa_id: str
+    name: str = "Unknown"
+    message: dict
+
+    @property
+    def conversation_key(self) -> tuple[str, str]:
+        return (self.phone_number_id or self.display_phone_number, self.wa_id)
+
+
+class WebhookBatch(BaseModel):
+    messages: list[InboundMessage] = []
+    statuses: list[dict] = []
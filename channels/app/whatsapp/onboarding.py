@@ -3,7 +3,7 @@ from .config import (
     client, 
     WHATSAPP_ACCESS_TOKEN, 
     WHATSAPP_BUSINESS_ACCOUNT_ID, 
-    GRAPH_API_VERSION,
+    GRAPH_URL,
     HEADERS
 )
 
@@ -17,7 +17,7 @@ async def register_phone_number(phone_number: str, display_name: str):
     If not, we attempt to add it using the WABA API.
     """
     # 1. Get Phone Number ID
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{WHATSAPP_BUSINESS_ACCOUNT_ID}/phone_numbers"
+    url = f"{GRAPH_URL}/{WHATSAPP_BUSINESS_ACCOUNT_ID}/phone_numbers"
     
     try:
         response = await client.get(url, headers=HEADERS)
@@ -58,7 +58,7 @@ async def register_phone_number(phone_number: str, display_name: str):
             cc = str(parsed_number.country_code)
             national_number = str(parsed_number.national_number)
             
-            add_url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{WHATSAPP_BUSINESS_ACCOUNT_ID}/phone_numbers"
+            add_url = f"{GRAPH_URL}/{WHATSAPP_BUSINESS_ACCOUNT_ID}/phone_numbers"
             payload = {
                 "cc": cc,
                 "phone_number": national_number,
@@ -86,7 +86,7 @@ async def register_number_with_pin(phone_number_id: str, pin: str):
     Registers the phone number for messaging and sets the 2FA PIN.
     This is required before the number can send/receive messages or request OTPs.
     """
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{phone_number_id}/register"
+    url = f"{GRAPH_URL}/{phone_number_id}/register"
     payload = {
         "messaging_product": "whatsapp",
         "pin": pin
@@ -109,7 +109,7 @@ async def request_code(phone_number_id: str):
     """
     Triggers the OTP code via SMS.
     """
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{phone_number_id}/request_code"
+    url = f"{GRAPH_URL}/{phone_number_id}/request_code"
     payload = {
         "code_method": "SMS",
         "language": "en_US"
@@ -122,7 +122,7 @@ async def verify_code(phone_number_id: str, code: str):
     """
     Verifies the OTP code.
     """
-    url = f"https://graph.facebook.com/{GRAPH_API_VERSION}/{phone_number_id}/verify_code"
+    url = f"{GRAPH_URL}/{phone_number_id}/verify_code"
     payload = {
         "code": code
     }
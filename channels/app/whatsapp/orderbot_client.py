@@ -0,0 +1,47 @@
+import os
+from typing import Optional
+
+import httpx
+
+ORDERBOT_API_URL = os.getenv("ORDERBOT_API_URL", "http://localhost:8001")
+
+# HTTP/2 is negotiated over TLS (Cloud Run); plain http:// URLs fall back to HTTP/1.1 keep-alive
+ORDERBOT_HTTP2 = os.getenv("ORDERBOT_HTTP2", "true").lower() == "true"
+ORDERBOT_MAX_CONNECTIONS = int(os.getenv("ORDERBOT_MAX_CONNECTIONS", "100"))
+ORDERBOT_MAX_KEEPALIVE = int(os.getenv("ORDERBOT_MAX_KEEPALIVE", "20"))
+ORDERBOT_KEEPALIVE_EXPIRY = float(os.getenv("ORDERBOT_KEEPALIVE_EXPIRY", "60"))
+ORDERBOT_CONNECT_TIMEOUT = float(os.getenv("ORDERBOT_CONNECT_TIMEOUT", "5"))
+# An agent turn may run several LLM and tool calls, so reading the reply gets the bulk of the budget
+ORDERBOT_READ_TIMEOUT = float(os.getenv("ORDERBOT_READ_TIMEOUT", "55"))
+ORDERBOT_POOL_TIMEOUT = float(os.getenv("ORDERBOT_POOL_TIMEOUT", "10"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_orderbot_client() -> httpx.AsyncClient:
+    """Returns the shared, pooled client for ORDERBOT_API_URL (created on first use)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=ORDERBOT_API_URL,
+            http2=ORDERBOT_HTTP2,
+            limits=httpx.Limits(
+                max_connections=ORDERBOT_MAX_CONNECTIONS,
+                max_keepalive_connections=ORDERBOT_MAX_KEEPALIVE,
+                keepalive_expiry=ORDERBOT_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=ORDERBOT_CONNECT_TIMEOUT,
+                read=ORDERBOT_READ_TIMEOUT,
+                write=ORDERBOT_CONNECT_TIMEOUT,
+                pool=ORDERBOT_POOL_TIMEOUT,
+            ),
+        )
+    return _client
+
+
+async def close_orderbot_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
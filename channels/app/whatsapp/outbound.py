@@ -0,0 +1,290 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+from .config import client
+from .credentials import credential_registry
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_rates(raw: str) -> dict[str, float]:
+    rates = {}
+    for part in raw.split(","):
+        if "=" in part:
+            phone_number_id, rate = part.split("=", 1)
+            rates[phone_number_id.strip()] = float(rate)
+    return rates
+
+
+# Meta's Cloud API allows 80 messages/s per business phone number by default (up to 1000 on higher tiers)
+WHATSAPP_SEND_RATE = float(os.getenv("WHATSAPP_SEND_RATE", "80"))
+# Per-number overrides for upgraded numbers, e.g. "1022538604275579=1000"
+WHATSAPP_SEND_RATES = _parse_rates(os.getenv("WHATSAPP_SEND_RATES", ""))
+OUTBOUND_MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "64"))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "6"))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", "0.5"))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", "30"))
+OUTBOUND_DEAD_LETTER_PATH = os.getenv("OUTBOUND_DEAD_LETTER_PATH", "outbound_dead_letters.db")
+
+# Graph error codes worth retrying besides 429/5xx: throughput and pair rate limits, temporary errors
+RETRYABLE_GRAPH_CODES = {1, 2, 4, 17, 341, 80007, 130429, 131000, 131016, 131056}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone_number_id TEXT NOT NULL,
+    to_number TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    status_code INTEGER,
+    error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class TokenBucket:
+    """Allows `rate` sends per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> float:
+        """Takes one token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            delay = (1 - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+    def drain(self):
+        """Empties the bucket after Meta reported a rate limit, so the next sends back off too."""
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+
+class _OutboundMessage:
+    def __init__(self, phone_number_id: str, to: str, url: str, payload: dict, headers: dict):
+        self.phone_number_id = phone_number_id
+        self.to = to
+        self.url = url
+        self.payload = payload
+        self.headers = headers
+        self.attempts = 0
+        self.credentials_refreshed = False
+        self.enqueued_at = time.monotonic()
+
+
+class _SendError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: bool = False, rate_limited: bool = False, auth_failed: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+        self.rate_limited = rate_limited
+        self.auth_failed = auth_failed
+
+
+class OutboundDispatcher:
+    """
+    Sends outbound Graph API messages with rate limiting and retries.
+
+    Messages queue per (phone_number_id, recipient) so a customer always
+    receives them in order, and each phone number draws from its own token
+    bucket sized to its Meta throughput tier. 429s, 5xx, transport errors
+    and transient Graph error codes are retried with full-jitter exponential
+    backoff; other failures, and messages still failing after
+    `max_attempts`, are written to a SQLite dead-letter table. A spike
+    therefore shows up as queue depth and latency instead of lost replies.
+    """
+
+    def __init__(
+        self,
+        default_rate: float = WHATSAPP_SEND_RATE,
+        rates: dict = WHATSAPP_SEND_RATES,
+        max_concurrency: int = OUTBOUND_MAX_CONCURRENCY,
+        max_attempts: int = OUTBOUND_MAX_ATTEMPTS,
+        dead_letter_path: str = OUTBOUND_DEAD_LETTER_PATH,
+    ):
+        self.default_rate = default_rate
+        self.rates = rates
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self._limiter = asyncio.Semaphore(max_concurrency)
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lanes: dict[tuple[str, str], deque[_OutboundMessage]] = {}
+        self._tasks: dict[tuple[str, str], asyncio.Task] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self.queued = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.throttled_seconds = 0.0
+
+    def _bucket(self, phone_number_id: str) -> TokenBucket:
+        bucket = self._buckets.get(phone_number_id)
+        if bucket is None:
+            bucket = self._buckets[phone_number_id] = TokenBucket(self.rates.get(phone_number_id, self.default_rate))
+        return bucket
+
+    def enqueue(self, phone_number_id: str, to: str, url: str, payload: dict, headers: dict):
+        """Queues a /messages call; it is sent in the background."""
+        key = (phone_number_id, to)
+        self._lanes.setdefault(key, deque()).append(_OutboundMessage(phone_number_id, to, url, payload, headers))
+        self.queued += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._drain(key))
+
+    async def _post(self, message: _OutboundMessage):
+        try:
+            response = await client.post(message.url, json=message.payload, headers=message.headers)
+        except httpx.TransportError as e:
+            raise _SendError(f"{type(e).__name__}: {e}", retryable=True)
+        except httpx.HTTPError as e:
+            # Too many redirects, undecodable body and the like won't go away on a retry
+            raise _SendError(f"{type(e).__name__}: {e}")
+        if response.is_success:
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        error = body.get("error") if isinstance(body, dict) else None
+        if not isinstance(error, dict):
+            error = {}
+        code = error.get("code")
+        rate_limited = response.status_code == 429 or code in (4, 80007, 130429)
+        retryable = rate_limited or response.status_code >= 500 or code in RETRYABLE_GRAPH_CODES or bool(error.get("is_transient"))
+        auth_failed = response.status_code == 401 or code == 190
+        raise _SendError(f"{response.status_code}: {response.text}", response.status_code, retryable, rate_limited, auth_failed)
+
+    def _backoff(self, attempts: int) -> float:
+        return random.uniform(0, min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE * 2 ** (attempts - 1)))
+
+    async def _drain(self, key: tuple[str, str]):
+        lane = self._lanes[key]
+        bucket = self._bucket(key[0])
+        try:
+            while lane:
+                message = lane[0]
+                self.throttled_seconds += await bucket.acquire()
+                message.attempts += 1
+                retry_in = None
+                reload_credentials = False
+                async with self._limiter:
+                    self.in_flight += 1
+                    try:
+                        await self._post(message)
+                    except _SendError as e:
+                        if e.rate_limited:
+                            bucket.drain()
+                        if e.auth_failed and not message.credentials_refreshed:
+                            # The tenant token may have been rotated since it was cached; retry once with a fresh one
+                            message.credentials_refreshed = True
+                            reload_credentials = True
+                            retry_in = 0.0
+                            logger.warning("Token rejected for %s, reloading credentials: %s", message.phone_number_id, e)
+                        elif e.retryable and message.attempts < self.max_attempts:
+                            self.retried += 1
+                            retry_in = self._backoff(message.attempts)
+                            logger.warning("Retrying message to %s in %.2fs (attempt %d): %s", message.to, retry_in, message.attempts, e)
+                        else:
+                            logger.error("Giving up on message to %s after %d attempts: %s", message.to, message.attempts, e)
+                            self._dead_letter(message, str(e), e.status_code)
+                    except Exception as e:
+                        # A bug, not a delivery failure: park the message and keep the lane moving
+                        logger.exception("Unexpected error sending message to %s: %s", message.to, e)
+                        self._dead_letter(message, f"{type(e).__name__}: {e}")
+                    else:
+                        self.sent += 1
+                        logger.info("Message sent successfully to %s", message.to)
+                    finally:
+                        self.in_flight -= 1
+                if reload_credentials:
+                    credential_registry.invalidate(message.phone_number_id)
+                    try:
+                        message.headers = (await credential_registry.get(message.phone_number_id)).headers
+                    except Exception as e:
+                        logger.error("Could not reload credentials for %s: %s", message.phone_number_id, e)
+                        self._dead_letter(message, f"credential reload failed: {e}", 401)
+                        retry_in = None
+                if retry_in is not None:
+                    # Later messages to this customer wait too, so they can't overtake this one
+                    await asyncio.sleep(retry_in)
+                    continue
+                lane.popleft()
+                self.queued -= 1
+        finally:
+            del self._tasks[key]
+            if not lane:
+                del self._lanes[key]
+
+    def _open(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.dead_letter_path, isolation_level=None, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+
+    def _dead_letter(self, message: _OutboundMessage, error: str, status_code: Optional[int] = None):
+        self.dead_lettered += 1
+        try:
+            self._open()
+            self._conn.execute(
+                "INSERT INTO outbound_dead_letters (phone_number_id, to_number, payload, attempts, status_code, error, failed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (message.phone_number_id, message.to, json.dumps(message.payload), message.attempts, status_code, error, time.time()),
+            )
+        except sqlite3.Error as e:
+            logger.error("Could not store dead letter for %s: %s", message.to, e, extra={"payload": message.payload})
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Waits for queued messages to go out, dead-lettering whatever is left after `timeout`."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()), timeout=timeout)
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        for lane in self._lanes.values():
+            for message in lane:
+                self._dead_letter(message, "shutdown before delivery")
+        self._lanes.clear()
+        self.queued = 0
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        oldest = min((lane[0].enqueued_at for lane in self._lanes.values() if lane), default=None)
+        depth_by_number: dict[str, int] = {}
+        for (phone_number_id, _), lane in self._lanes.items():
+            depth_by_number[phone_number_id] = depth_by_number.get(phone_number_id, 0) + len(lane)
+        return {
+            "queued": self.queued,
+            "depth_by_phone_number_id": depth_by_number,
+            "oldest_seconds": now - oldest if oldest is not None else 0.0,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "throttled_seconds": self.throttled_seconds,
+        }
+
+
+outbound_dispatcher = OutboundDispatcher()
@@ -1,12 +1,9 @@
-from fastapi import BackgroundTasks, Request, Response
+from fastapi import Response
+from datetime import datetime, timezone
 from typing import Optional
-import httpx
-import os
-import json
-import google.auth.transport.requests
-import google.oauth2.id_token
 import asyncio
-import time
+import logging
+import os
 
 from .client import (
     mark_message_as_read,
@@ -15,28 +12,15 @@ from .client import (
     upload_media,
 )
 from .config import VERIFY_TOKEN
-from .models import Subscription
+from .models import InboundMessage, Subscription
 from .utils import process_message_type, remove_extra_one
+from .webhook_batch import dispatch_batch, parse_webhook
+from .webhook_queue import PermanentError
+from .orderbot_client import ORDERBOT_API_URL, get_orderbot_client
+from .id_token import get_id_token
+from ..log import bind_log_context
 
-# Configuration
-ORDERBOT_API_URL = os.getenv("ORDERBOT_API_URL", "http://localhost:8001")
-
-# Simple in-memory cache: { "token": str, "expiry": float }
-_token_cache = {"token": None, "expiry": 0.0}
-
-async def get_id_token(url: str) -> str:
-    """Fetch ID token for the given URL with caching."""
-    now = time.time()
-    if _token_cache["token"] and _token_cache["expiry"] > now:
-        return _token_cache["token"]
-
-    auth_req = google.auth.transport.requests.Request()
-    token = await asyncio.to_thread(google.oauth2.id_token.fetch_id_token, auth_req, url)
-
-    # Cache for 50 minutes (3000 seconds) - typical Google tokens last 1h
-    _token_cache["token"] = token
-    _token_cache["expiry"] = now + 3000
-    return token
+logger = logging.getLogger(__name__)
 
 def verify_subscription(subscription: Subscription):
     if subscription.mode == "subscribe" and subscription.token == VERIFY_TOKEN:
@@ -51,14 +35,24 @@ async def process_message_answer(response_text: str, image_path: str, from_numbe
         # Ideally, Orderbot API should return a URL or signed URL.
         # Assuming shared volume or local execution for now. 
         image_uploaded = await upload_media(image_path, phone_number_id=phone_number_id)
-        print("IMAGE UPLOADED: ", image_uploaded)
+        logger.info("Image uploaded", extra={"media": image_uploaded})
         media_id = image_uploaded.get("id")
         await send_whatsapp_image_message(from_number, response_text, media_id, phone_number_id=phone_number_id)
     else:
         await send_whatsapp_text_message(from_number, response_text, phone_number_id=phone_number_id)
 
 
-from .supabase_client import supabase
+from .supabase_client import execute, supabase
+from .business_cache import business_directory
+from .dedup import message_dedup
+from .coalescer import MessageCoalescer
+from .quota import ai_quota
+
+LIMIT_REACHED_MESSAGE = "You have reached your AI message limit for the month. To continue using AITake, please upgrade your plan or wait until your limit resets."
+AGENT_UNAVAILABLE_MESSAGE = "Agent is not available right now. Please try again later."
+# Redeliveries of a message stored less than this many seconds ago and not yet answered are
+# taken for a turn still running elsewhere and dropped (see ingest_inbound_message)
+MESSAGE_CLAIM_TTL = int(os.getenv("MESSAGE_CLAIM_TTL", "120"))
 
 async def save_message(conversation_id: str, content: str, sender_type: str):
     try:
@@ -67,12 +61,58 @@ async def save_message(conversation_id: str, content: str, sender_type: str):
             "content": content,
             "sender_type": sender_type
         }
-        supabase.table("messages").insert(payload).execute()
+        await execute(supabase.table("messages").insert(payload))
+    except Exception as e:
+        logger.error("Error saving message to Supabase: %s", e)
+
+
+async def ingest_inbound_message(business_uuid: str, client_wa_id: str, client_name: str, content: str, wa_message_id: Optional[str] = None) -> Optional[dict]:
+    """
+    Resolves/creates the client and conversation and stores the inbound message
+    in one round trip (see db/schemas/functions.sql), claiming it for this
+    turn. Returns the tracking IDs and whether the message was already
+    answered or is being answered elsewhere (`duplicate`).
+    """
+    params = {
+        "p_business_id": business_uuid,
+        "p_wa_id": client_wa_id,
+        "p_full_name": client_name,
+        "p_content": content,
+        "p_wa_message_id": wa_message_id,
+        "p_claim_ttl": MESSAGE_CLAIM_TTL,
+    }
+    result = await execute(supabase.rpc("ingest_inbound_message", params))
+    if result.data:
+        return result.data[0]
+    return None
+
+
+async def mark_message_handled(wa_message_id: str):
+    """Marks an inbound message as answered; from then on ingest reports redeliveries as duplicates."""
+    try:
+        query = supabase.table("messages").update({"handled_at": datetime.now(timezone.utc).isoformat()})
+        await execute(query.eq("wa_message_id", wa_message_id))
+    except Exception as e:
+        logger.error("Error marking message %s as handled: %s", wa_message_id, e)
+
+
+async def release_message_claim(wa_message_id: str):
+    """Gives back the claim ingest took on an unanswered message, so the retry of a failed turn isn't dropped."""
+    try:
+        query = supabase.table("messages").update({"claimed_at": None})
+        await execute(query.eq("wa_message_id", wa_message_id).is_("handled_at", "null"))
     except Exception as e:
-        print(f"Error saving message to Supabase: {e}")
+        logger.error("Error releasing the claim on message %s: %s", wa_message_id, e)
+
 
+async def run_agent_and_send_reply(message_content: str, from_number: str, business_number: str, client_wa_id: str, client_name: str, conversation_id: Optional[str] = None, phone_number_id: Optional[str] = None, business_uuid: Optional[str] = None, subscription_tier: Optional[str] = None):
+    bind_log_context(conversation_id=conversation_id, wa_id=client_wa_id)
+    # The reply is counted before calling the agent so concurrent turns can't overshoot the limit
+    if business_uuid and not await ai_quota.try_consume(business_uuid, subscription_tier):
+        await send_limit_reached_message(from_number, phone_number_id, conversation_id)
+        return
 
-async def run_agent_and_send_reply(message_content: str, from_number: str, business_number: str, client_wa_id: str, client_name: str, conversation_id: Optional[str] = None, phone_number_id: Optional[str] = None, business_uuid: Optional[str] = None):
+    replied = False
     try:
         # Prepare payload for OrderBot API
         payload = {
@@ -86,8 +126,7 @@ async def run_agent_and_send_reply(message_content: str, from_number: str, busin
             }
         }
         
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Calling OrderBot at {ORDERBOT_API_URL}/chat with payload: {json.dumps(payload)}\n")
+        logger.debug("Calling OrderBot at %s/chat", ORDERBOT_API_URL, extra={"payload": payload})
             
         headers = {}
         # Only attach Google Auth token if in production
@@ -99,190 +138,202 @@ async def run_agent_and_send_reply(message_content: str, from_number: str, busin
                 parsed_url = urlparse(ORDERBOT_API_URL)
                 target_audience = f"{parsed_url.scheme}://{parsed_url.netloc}"
                 
-                id_token = await get_id_token(ORDERBOT_API_URL)
+                id_token = await get_id_token(target_audience)
                 headers["Authorization"] = f"Bearer {id_token}"
-                with open("debug_log.txt", "a") as f:
-                    f.write(f"Successfully generated/retrieved Google Auth token for production audience: {target_audience}\n")
+                logger.debug("Using Google Auth token for production audience: %s", target_audience)
             except Exception as auth_e:
-                with open("debug_log.txt", "a") as f:
-                    f.write(f"Failed to generate Google Auth token: {auth_e}\n")
-                print(f"Failed to generate Google Auth token: {auth_e}")
-
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(f"{ORDERBOT_API_URL}/chat", json=payload, headers=headers, timeout=60.0)
-            with open("debug_log.txt", "a") as f:
-                f.write(f"OrderBot status: {resp.status_code}\n")
-            resp.raise_for_status()
-            data = resp.json()
-            
-            response_text = data.get("message", "")
-            image_path = data.get("image_path")
-            print(f"Agent Response: {response_text}, Image Path: {image_path}")
-            
-            # Save bot response to conversation tracking
-            if conversation_id and response_text:
-                await save_message(conversation_id, response_text, "bot")
-            
-            # Increment AI message count
-            if business_uuid:
-                try:
-                    b_query = supabase.table("businesses").select("ai_message_count").eq("business_id", business_uuid).execute()
-                    if b_query.data:
-                        current_count = b_query.data[0].get("ai_message_count") or 0
-                        supabase.table("businesses").update({"ai_message_count": current_count + 1}).eq("business_id", business_uuid).execute()
-                except Exception as e:
-                    print(f"Error incrementing ai_message_count: {e}")
-
-            await process_message_answer(response_text, image_path, from_number, phone_number_id)
+                logger.error("Failed to generate Google Auth token: %s", auth_e)
+
+        client = get_orderbot_client()
+        resp = await client.post("/chat", json=payload, headers=headers)
+        logger.debug("OrderBot status: %s", resp.status_code)
+        resp.raise_for_status()
+        data = resp.json()
+        
+        response_text = data.get("message", "")
+        image_path = data.get("image_path")
+        replied = True
+        logger.info("Agent response received", extra={"response_text": response_text, "image_path": image_path})
+        
+        # Save bot response to conversation tracking
+        if conversation_id and response_text:
+            await save_message(conversation_id, response_text, "bot")
+        
+        await process_message_answer(response_text, image_path, from_number, phone_number_id)
 
     except Exception as e:
-        with open("debug_log.txt", "a") as f:
-            f.write(f"Error in background task: {e}\n")
-        print(f"Error in background task: {e}")
-        error_msg = "Agent is not available right now. Please try again later."
-        if conversation_id:
-            await save_message(conversation_id, error_msg, "bot")
-        await send_whatsapp_text_message(
-            from_number, error_msg, phone_number_id=phone_number_id
+        if replied:
+            # The turn already ran in orderbot; retrying it would apply the order twice
+            logger.exception("Error delivering agent reply: %s", e)
+            return
+        if business_uuid:
+            ai_quota.refund(business_uuid)
+        # Left to the webhook queue, which retries and sends AGENT_UNAVAILABLE_MESSAGE once it gives up
+        raise
+
+
+async def send_limit_reached_message(from_number: str, phone_number_id: Optional[str], conversation_id: Optional[str]):
+    await send_whatsapp_text_message(from_number, LIMIT_REACHED_MESSAGE, phone_number_id=phone_number_id)
+    # The incoming message was already saved on ingest, but don't process via agent
+    if conversation_id:
+        await save_message(conversation_id, LIMIT_REACHED_MESSAGE, "bot")
+
+
+message_coalescer = MessageCoalescer(run_agent_and_send_reply)
+
+
+async def _finish_turn(turn: asyncio.Future, message_id: Optional[str], stored: bool):
+    try:
+        await turn
+    except BaseException:
+        message_dedup.release(message_id)
+        if stored:
+            await release_message_claim(message_id)
+        raise
+    if stored:
+        await mark_message_handled(message_id)
+
+
+async def process_message(inbound: InboundMessage) -> Optional[asyncio.Task]:
+    """
+    Handles a single inbound message from a webhook batch. Returns a task that
+    finishes with the message's agent turn, or None if no turn was needed.
+    Failures are raised, so the webhook queue retries the payload.
+    """
+    message_id = inbound.message.get("id")
+    bind_log_context(message_id=message_id)
+
+    # Meta redelivers messages it thinks we missed; only the first delivery is processed.
+    # A message that fails gives its claim back, so the retry isn't taken for a redelivery.
+    if not message_dedup.claim(message_id):
+        logger.info("Skipping redelivered message %s", message_id)
+        return None
+    try:
+        return await _process_claimed_message(inbound)
+    except BaseException:
+        message_dedup.release(message_id)
+        raise
+
+
+async def _process_claimed_message(inbound: InboundMessage) -> Optional[asyncio.Task]:
+    business_phone = remove_extra_one(inbound.display_phone_number)
+    client_wa_id = remove_extra_one(inbound.wa_id)
+    client_name = inbound.name
+
+    message = inbound.message
+    message_id = message.get("id")
+    from_number = message.get("from")
+    bind_log_context(wa_id=client_wa_id)
+
+    logger.debug("Business: %s, Client WA ID: %s, Name: %s", business_phone, client_wa_id, client_name)
+
+    # Process message content
+    message_content = await process_message_type(message, inbound.phone_number_id)
+
+    # 1. Resolve Business, Client, and Conversation for tracking
+    business_uuid = None
+    client_uuid = None
+    conversation_id = None
+    whatsapp_phone_number_id = None
+    subscription_tier = 'free'
+
+    # Resolve Business (cached, see business_cache.py)
+    business = await business_directory.resolve(
+        phone=business_phone,
+        phone_number_id=inbound.phone_number_id,
+    )
+    logger.debug("Business lookup result", extra={"business": business})
+
+    if business:
+        business_uuid = business.get("business_id")
+        whatsapp_phone_number_id = business.get("whatsapp_phone_number_id")
+        ai_quota.observe(business_uuid, business.get("ai_message_count"))
+        subscription_tier = business.get("subscription_tier") or 'free'
+
+    if business_uuid:
+        # Resolve/Create Client and Conversation and save the incoming message
+        tracking = await ingest_inbound_message(business_uuid, client_wa_id, client_name, message_content, message_id)
+        if tracking and tracking.get("duplicate"):
+            message_dedup.record_duplicate()
+            logger.info("Skipping message %s, already answered or being answered elsewhere", message_id)
+            return None
+        if tracking:
+            client_uuid = tracking.get("client_id")
+            conversation_id = tracking.get("conversation_id")
+    # Only messages stored by ingest can be marked as handled
+    stored = bool(message_id and conversation_id)
+    try:
+        # Mark as read, preferring the phone_number_id stored for the business over the payload one
+        resolved_phone_number_id = whatsapp_phone_number_id or inbound.phone_number_id
+
+        await mark_message_as_read(message_id, phone_number_id=resolved_phone_number_id)
+
+        bind_log_context(conversation_id=conversation_id)
+        logger.info(
+            "Message from %s: %s", from_number, message_content,
+            extra={"business_phone": business_phone, "business_id": business_uuid, "client_id": client_uuid},
         )
 
+        # Check AI message limits based on tier (answered from memory, see quota.py)
+        if business_uuid and ai_quota.exhausted(business_uuid, subscription_tier):
+            await send_limit_reached_message(from_number, resolved_phone_number_id, conversation_id)
+            if stored:
+                await mark_message_handled(message_id)
+            return None
 
-async def process_request(request: Request, background_tasks: BackgroundTasks):
-    data = await request.json()
-    with open("debug_log.txt", "a") as f:
-        f.write(f"\n--- New Request ---\n{json.dumps(data, indent=2)}\n")
+        # 2. Process with Agent, merging messages the customer sends in quick succession.
+        # The queued webhook stays leased until the turn has run (see webhook_batch.py).
+        turn = message_coalescer.submit(
+            (resolved_phone_number_id or business_phone, client_wa_id),
+            message_content,
+            from_number=from_number,
+            business_number=business_phone,
+            client_wa_id=client_wa_id,
+            client_name=client_name,
+            conversation_id=conversation_id,
+            phone_number_id=resolved_phone_number_id,
+            business_uuid=business_uuid,
+            subscription_tier=subscription_tier,
+        )
+        return asyncio.create_task(_finish_turn(turn, message_id, stored))
+    except BaseException:
+        if stored:
+            await release_message_claim(message_id)
+        raise
+
+
+async def process_request(data: dict):
+    """Handles one webhook payload taken off the webhook queue; returns once every message has been answered."""
     try:
-        entry_list = data.get("entry", [])
-        if not entry_list:
-            print("No entry found in webhook data")
-            return {"status": "no entry"}
-            
-        entry = entry_list[0]["changes"][0]["value"]
-
-        if "messages" in entry:
-            print("ENTRY", entry)
-            business_phone = remove_extra_one(entry["metadata"]["display_phone_number"])
-
-            # Extract contact info
-            contacts = entry.get("contacts", [])
-            contact = contacts[0] if contacts else {}
-            client_wa_id = remove_extra_one(contact.get("wa_id"))
-            client_name = contact.get("profile", {}).get("name", "Unknown")
-
-            print(
-                f"Business: {business_phone}, Client WA ID: {client_wa_id}, Name: {client_name}"
-            )
-
-            # 1. Resolve Business, Client, and Conversation for tracking
-            business_uuid = None
-            client_uuid = None
-            conversation_id = None
-            
-            try:
-                # Resolve Business
-                all_b = supabase.table("businesses").select("*").execute()
-                with open("debug_log.txt", "a") as f:
-                    f.write(f"All businesses in DB: {all_b.data}\n")
-                b_query = supabase.table("businesses").select("business_id, whatsapp_phone_number_id, ai_message_count, subscription_tier").eq("whatsapp_phone_number", business_phone).execute()
-                with open("debug_log.txt", "a") as f:
-                    f.write(f"Business query result: {b_query.data}\n")
-                
-                ai_message_count = 0
-                subscription_tier = 'free'
-                if b_query.data:
-                    business_uuid = b_query.data[0].get("business_id")
-                    whatsapp_phone_number_id = b_query.data[0].get("whatsapp_phone_number_id")
-                    ai_message_count = b_query.data[0].get("ai_message_count") or 0
-                    subscription_tier = b_query.data[0].get("subscription_tier") or 'free'
-                
-                if business_uuid:
-                    # Resolve/Create Client
-                    c_query = supabase.table("clients").select("client_id").eq("business_id", business_uuid).eq("wa_id", client_wa_id).execute()
-                    if c_query.data:
-                        client_uuid = c_query.data[0].get("client_id")
-                    else:
-                        new_client = {
-                            "business_id": business_uuid,
-                            "wa_id": client_wa_id,
-                            "full_name": client_name,
-                            "phone_number": client_wa_id
-                        }
-                        c_insert = supabase.table("clients").insert(new_client).execute()
-                        if c_insert.data:
-                            client_uuid = c_insert.data[0].get("client_id")
-                            print(f"Created new client: {client_uuid}")
-                    
-                    if client_uuid:
-                        # Resolve/Create Conversation
-                        conv_query = supabase.table("conversations").select("conversation_id").eq("business_id", business_uuid).eq("client_id", client_uuid).execute()
-                        if conv_query.data:
-                            conversation_id = conv_query.data[0].get("conversation_id")
-                        else:
-                            new_conv = {
-                                "business_id": business_uuid,
-                                "client_id": client_uuid
-                            }
-                            conv_insert = supabase.table("conversations").insert(new_conv).execute()
-                            if conv_insert.data:
-                                conversation_id = conv_insert.data[0].get("conversation_id")
-                                print(f"Created new conversation: {conversation_id}")
-            except Exception as e:
-                with open("debug_log.txt", "a") as f:
-                    f.write(f"Supabase Error: {e}\n")
-                print(f"Error in Supabase tracking setup: {e}")
-
-            message = entry["messages"][0]
-            message_id = message.get("id")
-            from_number = message.get("from")
-            # Mark as read
-            # Determine phone_number_id from entry metadata if possible, but for now using the one from DB or None
-            # Actually entry metadata has id
-            payload_phone_number_id = entry["metadata"].get("phone_number_id")
-            resolved_phone_number_id = whatsapp_phone_number_id if 'whatsapp_phone_number_id' in locals() and whatsapp_phone_number_id else payload_phone_number_id
-            
-            await mark_message_as_read(message_id, phone_number_id=resolved_phone_number_id)
-            
-            # Process message content
-            message_content = await process_message_type(message)
-            with open("debug_log.txt", "a") as f:
-                f.write(f"Processed Message: {message_content}, From: {from_number}, Business: {business_phone}\n")
-                f.write(f"Resolved business_uuid: {business_uuid}, client_uuid: {client_uuid}, conversation_id: {conversation_id}\n")
-            print(f"Message from {from_number}: {message_content}")
-            
-            # Check AI message limits based on tier
-            has_reached_limit = False
-            if 'subscription_tier' in locals() and 'ai_message_count' in locals():
-                if subscription_tier == 'free' and ai_message_count >= 1000:
-                    has_reached_limit = True
-                elif subscription_tier == 'pro' and ai_message_count >= 10000:
-                    has_reached_limit = True
-
-            if has_reached_limit:
-                limit_msg = "You have reached your AI message limit for the month. To continue using AITake, please upgrade your plan or wait until your limit resets."
-                await send_whatsapp_text_message(from_number, limit_msg, phone_number_id=resolved_phone_number_id)
-                # Still save the incoming message if conversation exists, but don't process via agent
-                if conversation_id:
-                    await save_message(conversation_id, message_content, "client")
-                    await save_message(conversation_id, limit_msg, "bot")
-                return {"status": "accepted"}
-
-            # 2. Save incoming message to conversation tracking
-            if conversation_id:
-                await save_message(conversation_id, message_content, "client")
-
-            # 3. Process with Agent
-            background_tasks.add_task(
-                run_agent_and_send_reply,
-                message_content,
-                from_number,
-                business_phone,
-                client_wa_id,
-                client_name,
-                conversation_id,
-                resolved_phone_number_id,
-                business_uuid
-            )
-        return {"status": "accepted"}
-    except Exception as e:
-        print(f"Error: {e}")
-        return {"status": "error", "message": str(e)}
+        batch = parse_webhook(data)
+    except (AttributeError, TypeError, ValueError) as e:
+        raise PermanentError(f"Malformed webhook payload: {e}") from e
+    logger.debug(
+        "New webhook request",
+        extra={"entries": len(data.get("entry") or []), "messages": len(batch.messages), "statuses": len(batch.statuses)},
+    )
+    if not batch.messages and not batch.statuses:
+        logger.info("No messages or statuses found in webhook data")
+        return {"status": "no entry"}
+
+    for status in batch.statuses:
+        logger.debug("Status update: %s -> %s", status.get("id"), status.get("status"))
+
+    await dispatch_batch(batch, process_message)
+    return {"status": "accepted", "messages": len(batch.messages), "statuses": len(batch.statuses)}
+
+
+async def notify_failed_request(data: dict):
+    """
+    Tells the customers of a webhook the queue gave up on that their messages
+    went unanswered. Messages that still hold their claim were answered (or
+    skipped as redeliveries) by an earlier attempt, since a failed turn gives
+    its claim back, so their customers are left alone.
+    """
+    customers = {
+        (inbound.phone_number_id, inbound.message.get("from"))
+        for inbound in parse_webhook(data).messages
+        if inbound.message.get("from") and not message_dedup.holds(inbound.message.get("id"))
+    }
+    for phone_number_id, from_number in customers:
+        await send_whatsapp_text_message(from_number, AGENT_UNAVAILABLE_MESSAGE, phone_number_id=phone_number_id)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from .supabase_client import execute, supabase
+from .business_cache import business_directory
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_limits(raw: str) -> dict[str, int]:
+    limits = {}
+    for part in raw.split(","):
+        if "=" in part:
+            tier, limit = part.split("=", 1)
+            limits[tier.strip()] = int(limit)
+    return limits
+
+
+# Monthly AI replies per subscription tier, e.g. "free=1000,pro=10000". Tiers not listed are unlimited.
+AI_MESSAGE_LIMITS = _parse_limits(os.getenv("AI_MESSAGE_LIMITS", "free=1000,pro=10000"))
+# Increments an instance may hold before other instances see them; this bounds the overshoot per instance
+AI_QUOTA_MAX_UNFLUSHED = int(os.getenv("AI_QUOTA_MAX_UNFLUSHED", "10"))
+AI_QUOTA_FLUSH_INTERVAL = float(os.getenv("AI_QUOTA_FLUSH_INTERVAL", "5.0"))
+
+
+class AIMessageQuota:
+    """
+    Counts AI replies per business in memory and enforces the tier limits.
+
+    Limit checks are answered from the last count seen in the database plus
+    the increments this instance has not flushed yet. Increments are flushed
+    in batches through `increment_ai_message_counts` (db/schemas/functions.sql),
+    which adds the deltas server side and returns the new totals, so nothing
+    is lost to concurrent read-modify-writes. A business never accumulates
+    more than `max_unflushed` increments: reaching it forces a flush, and if
+    that flush fails further replies are refused until one succeeds.
+    """
+
+    def __init__(self, limits: dict = AI_MESSAGE_LIMITS, max_unflushed: int = AI_QUOTA_MAX_UNFLUSHED, flush_interval: float = AI_QUOTA_FLUSH_INTERVAL):
+        self.limits = limits
+        self.max_unflushed = max_unflushed
+        self.flush_interval = flush_interval
+        self._counts: dict[str, int] = {}
+        self._pending: dict[str, int] = {}
+        # Deltas sent by a flush that hasn't returned yet still count against the limit
+        self._flushing: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.consumed = 0
+        self.refused = 0
+        self.flushes = 0
+        self.flush_failures = 0
+
+    def observe(self, business_id: str, count: Optional[int]):
+        """Records the count read from the business row (also picks up monthly resets)."""
+        self._counts[business_id] = count or 0
+
+    def used(self, business_id: str) -> int:
+        return self._counts.get(business_id, 0) + self._flushing.get(business_id, 0) + self._pending.get(business_id, 0)
+
+    def exhausted(self, business_id: str, tier: Optional[str]) -> bool:
+        limit = self.limits.get(tier or "free")
+        return limit is not None and self.used(business_id) >= limit
+
+    async def try_consume(self, business_id: str, tier: Optional[str]) -> bool:
+        """Takes one AI reply from the business quota; False means the limit is reached."""
+        if self._pending.get(business_id, 0) >= self.max_unflushed:
+            await self.flush()
+            if self._pending.get(business_id, 0) >= self.max_unflushed:
+                self.refused += 1
+                return False
+        if self.exhausted(business_id, tier):
+            self.refused += 1
+            return False
+        self._pending[business_id] = self._pending.get(business_id, 0) + 1
+        self.consumed += 1
+        return True
+
+    def refund(self, business_id: str):
+        """
+        Gives back a reply taken by `try_consume` when no reply was produced.
+        If a flush already sent the increment, the refund stays pending as a
+        negative delta and the next flush takes it back off the database count.
+        """
+        self._pending[business_id] = self._pending.get(business_id, 0) - 1
+        self.consumed -= 1
+
+    async def flush(self):
+        async with self._lock:
+            deltas = {business_id: delta for business_id, delta in self._pending.items() if delta}
+            if not deltas:
+                return
+            self._pending = {}
+            self._flushing = deltas
+            try:
+                result = await execute(supabase.rpc("increment_ai_message_counts", {"p_deltas": deltas}))
+            except Exception as e:
+                self.flush_failures += 1
+                logger.error("Error flushing ai_message_count deltas: %s", e)
+                for business_id, delta in deltas.items():
+                    self._pending[business_id] = self._pending.get(business_id, 0) + delta
+                return
+            finally:
+                self._flushing = {}
+            self.flushes += 1
+            for row in result.data or []:
+                self._counts[row["business_id"]] = row["ai_message_count"]
+                business_directory.set_ai_message_count(row["business_id"], row["ai_message_count"])
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "limits": self.limits,
+            "businesses": len(self._counts),
+            "unflushed": sum(self._pending.values()),
+            "consumed": self.consumed,
+            "refused": self.refused,
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+        }
+
+
+ai_quota = AIMessageQuota()
@@ -1,8 +1,41 @@
+import asyncio
+import logging
 import os
-from supabase import create_client, Client
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions
+
+logger = logging.getLogger(__name__)
 
 url: str = os.environ.get("SUPABASE_URL", "")
 key: str = os.environ.get("SUPABASE_KEY", "")
-with open("debug_log.txt", "a") as f:
-    f.write(f"Supabase Client Config - URL: {url}, Key Length: {len(key)}\n")
-supabase: Client = create_client(url, key)
+logger.info("Supabase Client Config - URL: %s, Key Length: %d", url, len(key))
+
+# Deadline for a single PostgREST/auth call, including waiting for a pooled connection
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+
+# One pooled HTTP/2 connection set shared by the PostgREST and auth clients.
+# Closed by the FastAPI lifespan via close_supabase().
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(SUPABASE_TIMEOUT, connect=5.0),
+    http2=True,
+    limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS, max_keepalive_connections=SUPABASE_MAX_KEEPALIVE),
+)
+
+# The service key never expires, so there is no user session to persist or refresh
+supabase: AsyncClient = AsyncClient(
+    url,
+    key,
+    AsyncClientOptions(httpx_client=http_client, auto_refresh_token=False, persist_session=False),
+)
+
+
+async def execute(query, timeout: float = SUPABASE_TIMEOUT):
+    """Runs a table/rpc query builder without blocking the event loop, failing after `timeout` seconds."""
+    return await asyncio.wait_for(query.execute(), timeout)
+
+
+async def close_supabase():
+    await http_client.aclose()
@@ -1,3 +1,10 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = ("image", "audio", "video", "document", "sticker")
+
+
 def remove_extra_one(from_number: str) -> str:
     """
     Removes the extra '1' in Mexican numbers (e.g., 521... -> 52...).
@@ -10,9 +17,17 @@ def remove_extra_one(from_number: str) -> str:
         return "52" + clean_number[3:]
     return clean_number
 
-async def process_message_type(message: dict) -> str:
+async def process_message_type(message: dict, phone_number_id: str = None) -> str:
     if "text" in message:
         return message["text"]["body"]
     elif "location" in message:
         return str(message["location"])
+    media_type = message.get("type")
+    if media_type in MEDIA_TYPES and media_type in message:
+        from .media import media_store
+        media = message[media_type]
+        # The agent only gets the caption; the file is cached in the background for re-sending
+        media_store.prefetch(media["id"], phone_number_id)
+        caption = media.get("caption") or media.get("filename") or ""
+        return f"[{media_type}] {caption}".strip()
     return "message not processed"
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from .models import InboundMessage, WebhookBatch
+
+logger = logging.getLogger(__name__)
+
+
+def parse_webhook(data: dict) -> WebhookBatch:
+    """
+    Flattens every entry -> change -> message/status of a Meta webhook payload.
+    Meta batches several messages and statuses into one POST under load.
+    """
+    batch = WebhookBatch()
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            metadata = value.get("metadata") or {}
+            contacts = {c.get("wa_id"): c for c in value.get("contacts") or []}
+            first_contact = next(iter(contacts.values()), {})
+
+            for message in value.get("messages") or []:
+                contact = contacts.get(message.get("from"), first_contact)
+                batch.messages.append(InboundMessage(
+                    display_phone_number=metadata.get("display_phone_number", ""),
+                    phone_number_id=metadata.get("phone_number_id"),
+                    wa_id=contact.get("wa_id") or message.get("from", ""),
+                    name=contact.get("profile", {}).get("name", "Unknown"),
+                    message=message,
+                ))
+            batch.statuses.extend(value.get("statuses") or [])
+    return batch
+
+
+async def _run_in_order(messages: list[InboundMessage], handler: Callable[[InboundMessage], Awaitable]):
+    """
+    Runs `handler` for the messages of one conversation, one after another. A
+    handler may return an awaitable for work it handed off (the agent turn);
+    those are awaited after the last message, so the messages can still share
+    a turn. Stops at the first failing message and raises its error once the
+    handed-off work is done, leaving the rest of the conversation for the retry.
+    """
+    handed_off = []
+    error = None
+    for inbound in messages:
+        try:
+            result = await handler(inbound)
+        except Exception as e:
+            error = e
+            break
+        if result is not None:
+            handed_off.append(result)
+    for result in await asyncio.gather(*handed_off, return_exceptions=True):
+        if error is None and isinstance(result, Exception):
+            error = result
+    if error is not None:
+        raise error
+
+
+async def dispatch_batch(batch: WebhookBatch, handler: Callable[[InboundMessage], Awaitable]):
+    """
+    Runs `handler` for every message of the batch. Conversations are processed
+    concurrently; messages of the same conversation run one after another in
+    the order Meta sent them. Every conversation runs to the end even if
+    another one fails; the first failure is raised afterwards.
+    """
+    conversations: dict[tuple[str, str], list[InboundMessage]] = {}
+    for inbound in batch.messages:
+        conversations.setdefault(inbound.conversation_key, []).append(inbound)
+    results = await asyncio.gather(*(_run_in_order(messages, handler) for messages in conversations.values()), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors[1:]:
+        logger.error("Error processing webhook batch: %s", error)
+    if errors:
+        raise errors[0]
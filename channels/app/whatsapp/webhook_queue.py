@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional
+
+from ..log import log_context
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_PATH = os.getenv("WEBHOOK_QUEUE_PATH", "webhook_queue.db")
+# A worker holds its row until the messages' agent turns have finished, so this also
+# bounds how many webhooks (roughly, conversations) are in progress at once
+WEBHOOK_QUEUE_WORKERS = int(os.getenv("WEBHOOK_QUEUE_WORKERS", "64"))
+WEBHOOK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_QUEUE_MAX_ATTEMPTS", "5"))
+# Idle workers wake up at least this often, even without an enqueue notification
+WEBHOOK_QUEUE_POLL_INTERVAL = float(os.getenv("WEBHOOK_QUEUE_POLL_INTERVAL", "1.0"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_queue_status ON webhook_queue(status, available_at, id);
+"""
+
+
+class PermanentError(Exception):
+    """Raised for a payload that can never be handled; its row fails without retries or `on_failed`."""
+
+
+class WebhookQueue:
+    """
+    Durable queue for raw Meta webhook payloads, backed by a local SQLite file.
+
+    The webhook endpoint only appends the payload and returns; a pool of async
+    workers drains the queue with bounded concurrency. A row is deleted only
+    once the handler returns, i.e. once its messages have been answered, and
+    retried with backoff if the handler raises. After `max_attempts` it is kept
+    as 'failed' and `on_failed` is called with the payload; a `PermanentError`
+    fails it at once. Rows left 'processing' by a crash are requeued on start.
+    """
+
+    def __init__(self, path: str = WEBHOOK_QUEUE_PATH, workers: int = WEBHOOK_QUEUE_WORKERS, max_attempts: int = WEBHOOK_QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._conn: Optional[sqlite3.Connection] = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.in_flight = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def open(self):
+        if self._conn is not None:
+            return
+        self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        # Anything still marked as processing belongs to a previous process
+        self._conn.execute("UPDATE webhook_queue SET status = 'pending' WHERE status = 'processing'")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def enqueue(self, payload: str) -> int:
+        """Appends a raw webhook body and wakes an idle worker."""
+        self.open()
+        now = time.time()
+        cursor = self._conn.execute(
+            "INSERT INTO webhook_queue (payload, enqueued_at, available_at) VALUES (?, ?, ?)",
+            (payload, now, now),
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return cursor.lastrowid
+
+    def _claim(self) -> Optional[tuple[int, str, int]]:
+        return self._conn.execute(
+            """
+            UPDATE webhook_queue SET status = 'processing', attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM webhook_queue
+                WHERE status = 'pending' AND available_at <= ?
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, payload, attempts
+            """,
+            (time.time(),),
+        ).fetchone()
+
+    def _ack(self, row_id: int):
+        self._conn.execute("DELETE FROM webhook_queue WHERE id = ?", (row_id,))
+
+    def _release(self, row_id: int):
+        self._conn.execute(
+            "UPDATE webhook_queue SET status = 'pending', attempts = attempts - 1 WHERE id = ?",
+            (row_id,),
+        )
+
+    def _nack(self, row_id: int, attempts: int, error: str, retry: bool = True) -> bool:
+        """Schedules a retry, or fails the row for good. Returns True in the latter case."""
+        if not retry or attempts >= self.max_attempts:
+            self.failed += 1
+            self._conn.execute(
+                "UPDATE webhook_queue SET status = 'failed', last_error = ? WHERE id = ?",
+                (error, row_id),
+            )
+            return True
+        self.retried += 1
+        self._conn.execute(
+            "UPDATE webhook_queue SET status = 'pending', available_at = ?, last_error = ? WHERE id = ?",
+            (time.time() + 2 ** attempts, error, row_id),
+        )
+        return False
+
+    async def _handle(self, row_id: int, payload: str, attempts: int, handler: Callable[[dict], Awaitable], on_failed: Optional[Callable[[dict], Awaitable]]):
+        try:
+            try:
+                data = json.loads(payload)
+            except ValueError as e:
+                raise PermanentError(f"Invalid JSON payload: {e}") from e
+            await handler(data)
+        except asyncio.CancelledError:
+            self._release(row_id)
+            raise
+        except Exception as e:
+            logger.exception("Error processing queued webhook %s (attempt %d): %s", row_id, attempts, e)
+            permanent = isinstance(e, PermanentError)
+            # A permanently failing payload can't be parsed for on_failed either
+            if self._nack(row_id, attempts, str(e), retry=not permanent) and on_failed and not permanent:
+                try:
+                    await on_failed(data)
+                except Exception as e:
+                    logger.exception("Error notifying failed webhook %s: %s", row_id, e)
+        else:
+            self.processed += 1
+            self._ack(row_id)
+
+    async def _worker(self, handler: Callable[[dict], Awaitable], on_failed: Optional[Callable[[dict], Awaitable]]):
+        while not self._stopping:
+            row = self._claim()
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=WEBHOOK_QUEUE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            row_id, payload, attempts = row
+            self.in_flight += 1
+            try:
+                with log_context(request_id=row_id):
+                    await self._handle(row_id, payload, attempts, handler, on_failed)
+            finally:
+                self.in_flight -= 1
+
+    async def start(self, handler: Callable[[dict], Awaitable], on_failed: Optional[Callable[[dict], Awaitable]] = None):
+        """Starts the workers. `on_failed` is called with the payload of every row that fails for good."""
+        self.open()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker(handler, on_failed)) for _ in range(self.workers)]
+
+    async def stop(self, timeout: Optional[float] = None):
+        """Stops claiming rows and gives in-flight ones `timeout` seconds; unfinished rows go back to pending."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.close()
+
+    def stats(self) -> dict:
+        self.open()
+        depth, oldest = self._conn.execute(
+            "SELECT COUNT(*), MIN(enqueued_at) FROM webhook_queue WHERE status IN ('pending', 'processing')"
+        ).fetchone()
+        dead = self._conn.execute("SELECT COUNT(*) FROM webhook_queue WHERE status = 'failed'").fetchone()[0]
+        return {
+            "depth": depth,
+            "lag_seconds": time.time() - oldest if oldest else 0.0,
+            "in_flight": self.in_flight,
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "dead": dead,
+        }
+
+
+webhook_queue = WebhookQueue()
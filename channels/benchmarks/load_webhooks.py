@@ -0,0 +1,151 @@
+"""
+Load generator for the channels webhook pipeline.
+
+Replays a realistic Meta webhook payload (benchmarks/payloads/text_message.json
+by default, override with BENCH_PAYLOAD) against a running channels service,
+giving every webhook its own message id and customer so nothing is deduped
+or coalesced. The Graph and orderbot stubs from benchmarks/stubs.py run in
+this process, so each webhook is timed from POST /webhook until the stub
+Graph API receives the reply to that customer.
+
+    uv run python benchmarks/load_webhooks.py     # in one shell
+    GRAPH_API_BASE_URL=http://127.0.0.1:8790 GRAPH_API_VERSION=v21.0 \\
+    ORDERBOT_API_URL=http://127.0.0.1:8791 COALESCE_WINDOW=0 \\
+    uv run fastapi run app/main.py                # in another
+
+The generator waits for the service to answer on BENCH_CHANNELS_URL before
+starting. Supabase calls go to whatever SUPABASE_URL the service has, which
+must be reachable: failed lookups and tracking writes make the webhook queue
+retry the payload, so its reply arrives late or not at all. The business need
+not exist there (unknown businesses are answered without tracking).
+
+Reports throughput, p50/p95/p99 for the webhook ack and for the full reply,
+and error counts (failed POSTs, replies that never arrived, stub-injected
+errors, and "agent not available" fallback replies).
+"""
+import asyncio
+import copy
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+import stubs
+
+CHANNELS_URL = os.getenv("BENCH_CHANNELS_URL", "http://127.0.0.1:8000")
+PAYLOAD_PATH = os.getenv("BENCH_PAYLOAD", os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads", "text_message.json"))
+WEBHOOKS = int(os.getenv("BENCH_WEBHOOKS", "500"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "50"))
+# Webhooks started per second; 0 sends as fast as BENCH_CONCURRENCY allows
+RATE = float(os.getenv("BENCH_RATE", "0"))
+REPLY_TIMEOUT = float(os.getenv("BENCH_REPLY_TIMEOUT", "60"))
+
+with open(PAYLOAD_PATH) as f:
+    TEMPLATE = json.load(f)
+
+_waiting: dict[str, asyncio.Future] = {}
+
+
+def _reply_received(to: str, body: dict):
+    future = _waiting.get(to)
+    if future is not None and not future.done():
+        future.set_result((time.perf_counter(), body))
+
+
+def build_webhook(run_id: str, i: int) -> tuple[str, dict]:
+    """Copies the template with a unique customer and message id."""
+    payload = copy.deepcopy(TEMPLATE)
+    wa_id = f"52133{run_id}{i:06d}"
+    for entry in payload["entry"]:
+        for change in entry["changes"]:
+            value = change["value"]
+            for contact in value.get("contacts", []):
+                contact["wa_id"] = wa_id
+            for message in value.get("messages", []):
+                message["from"] = wa_id
+                message["id"] = f"wamid.bench.{uuid.uuid4().hex}"
+                message["timestamp"] = str(int(time.time()))
+    return wa_id, payload
+
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return f"p50={statistics.median(values) * 1000:8.1f}ms  p95={pick(0.95):8.1f}ms  p99={pick(0.99):8.1f}ms"
+
+
+async def wait_for_service(client: httpx.AsyncClient):
+    while True:
+        try:
+            await client.get(f"{CHANNELS_URL}/")
+            return
+        except httpx.TransportError:
+            print(f"Waiting for channels on {CHANNELS_URL} ...")
+            await asyncio.sleep(2)
+
+
+async def main():
+    servers = await stubs.start()
+    stubs.on_message_sent = _reply_received
+    run_id = str(int(time.time()) % 10000).zfill(4)
+
+    ack_latencies: list[float] = []
+    reply_latencies: list[float] = []
+    errors = {"post_failed": 0, "no_reply": 0, "agent_unavailable": 0}
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        await wait_for_service(client)
+
+        async def one(i: int):
+            wa_id, payload = build_webhook(run_id, i)
+            future = _waiting[wa_id] = asyncio.get_running_loop().create_future()
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    resp = await client.post(f"{CHANNELS_URL}/webhook", json=payload)
+                    resp.raise_for_status()
+                except httpx.HTTPError:
+                    errors["post_failed"] += 1
+                    return
+                ack_latencies.append(time.perf_counter() - start)
+                try:
+                    received_at, body = await asyncio.wait_for(future, REPLY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    errors["no_reply"] += 1
+                    return
+                finally:
+                    _waiting.pop(wa_id, None)
+                reply_latencies.append(received_at - start)
+                if body.get("text", {}).get("body", "").startswith("Agent is not available"):
+                    errors["agent_unavailable"] += 1
+
+        print(f"{WEBHOOKS} webhooks, concurrency={CONCURRENCY}, rate={RATE or 'max'}/s, target={CHANNELS_URL}")
+        started = time.perf_counter()
+        tasks = []
+        for i in range(WEBHOOKS):
+            tasks.append(asyncio.create_task(one(i)))
+            if RATE:
+                await asyncio.sleep(1 / RATE)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    print(f"elapsed {elapsed:.2f}s  acked {len(ack_latencies) / elapsed:.1f}/s  replied {len(reply_latencies) / elapsed:.1f}/s")
+    print(f"  ack    {percentiles(ack_latencies)}")
+    print(f"  reply  {percentiles(reply_latencies)}")
+    print(f"  errors {errors}")
+    print(f"  stubs  {dict(stubs.counters)}")
+
+    await stubs.stop(servers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+Event-loop stall caused by request-path logging: the old per-message
+`open("debug_log.txt", "a")` + `json.dumps(indent=2)` appends versus the
+queue-backed JSON logger from app/log.py.
+
+Each simulated webhook logs what process_request used to log for one
+message. Reports the time spent logging on the event loop per webhook and
+how late a 1ms ticker task wakes up meanwhile.
+
+    uv run python benchmarks/logging_stall.py
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LOG_DIR = tempfile.mkdtemp()
+os.environ.setdefault("LOG_FILE", os.path.join(LOG_DIR, "app.jsonl"))
+os.environ.setdefault("LOG_LEVEL", "DEBUG")
+
+from app.log import log_context, setup_logging, shutdown_logging
+
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "2000"))
+# Simulated non-logging I/O per webhook, so the writer thread sees a realistic arrival rate
+REQUEST_IO = float(os.getenv("BENCH_REQUEST_IO", "0.0005"))
+PAYLOAD_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp3.json")
+
+with open(PAYLOAD_FILE) as f:
+    PAYLOAD = json.load(f)
+
+logger = logging.getLogger("app.benchmark")
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+def old_style(i: int):
+    # What process_request/client.py did for every message before
+    path = os.path.join(LOG_DIR, "debug_log.txt")
+    with open(path, "a") as f:
+        f.write(f"\n--- New Request ---\n{json.dumps(PAYLOAD, indent=2)}\n")
+    with open(path, "a") as f:
+        f.write(f"Business query result: {PAYLOAD['data'][0]}\n")
+    with open(path, "a") as f:
+        f.write(f"Processed Message: hello {i}, From: 5213300000000, Business: 15550000000\n")
+        f.write(f"Resolved business_uuid: b, client_uuid: c, conversation_id: {i}\n")
+    with open(path, "a") as f:
+        f.write(f"Calling OrderBot with payload: {json.dumps(PAYLOAD)}\n")
+    with open(path, "a") as f:
+        f.write("Message sent successfully to 5213300000000: {}\n")
+
+
+def new_style(i: int):
+    with log_context(request_id=i, conversation_id="bench"):
+        logger.debug("New webhook request", extra={"entries": 1, "messages": 1, "statuses": 0})
+        logger.debug("Business lookup result", extra={"business": PAYLOAD["data"][0]})
+        logger.info("Message from %s: %s", "5213300000000", f"hello {i}", extra={"business_phone": "15550000000"})
+        logger.debug("Calling OrderBot at %s/chat", "http://localhost:8001", extra={"payload": PAYLOAD})
+        logger.info("Message sent successfully to %s", "5213300000000", extra={"response": "{}"})
+
+
+async def measure(label: str, log_one_request):
+    lags: list[float] = []
+    logging_time = 0.0
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    for i in range(REQUESTS):
+        start = time.perf_counter()
+        log_one_request(i)
+        logging_time += time.perf_counter() - start
+        await asyncio.sleep(REQUEST_IO)
+    stop.set()
+    await tick
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    print(
+        f"{label:>20}  on-loop logging/request={logging_time / REQUESTS * 1e6:7.1f}us"
+        f"  loop lag p99={p99 * 1000:5.2f}ms  max={max(lags or [0]) * 1000:5.2f}ms"
+    )
+
+
+async def main():
+    setup_logging()
+    print(f"{REQUESTS} webhooks, 5 log lines each, payload={PAYLOAD_FILE}")
+    await measure("open()+json.dumps", old_style)
+    await measure("queued JSON logger", new_style)
+    logging.getLogger("app").setLevel(logging.INFO)
+    await measure("... at LOG_LEVEL=INFO", new_style)
+    shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
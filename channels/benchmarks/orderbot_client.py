@@ -0,0 +1,101 @@
+"""
+Latency of the channels -> orderbot /chat call: a new httpx.AsyncClient per
+message (the old behaviour) versus the shared pooled client.
+
+Starts a stub orderbot on localhost that answers /chat after a fixed delay,
+then fires BENCH_REQUESTS calls with BENCH_CONCURRENCY in flight and
+reports p50/p99. Point BENCH_ORDERBOT_URL at a deployed (TLS) service to
+include handshake costs; the stub is then not started.
+
+    uv run python benchmarks/orderbot_client.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+STUB_PORT = int(os.getenv("BENCH_STUB_PORT", "8765"))
+ORDERBOT_URL = os.getenv("BENCH_ORDERBOT_URL", f"http://127.0.0.1:{STUB_PORT}")
+os.environ["ORDERBOT_API_URL"] = ORDERBOT_URL
+
+from app.whatsapp.orderbot_client import close_orderbot_client, get_orderbot_client
+
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "500"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "20"))
+STUB_LATENCY = float(os.getenv("BENCH_STUB_LATENCY", "0.01"))
+
+PAYLOAD = {
+    "message": "2 large pizzas please",
+    "thread_id": "5213300000000",
+    "user": {"phone_number": "5213300000000", "business_phone_number": "15550000000", "name": "Bench", "items": []},
+}
+
+stub = FastAPI()
+
+
+@stub.post("/chat")
+async def chat(payload: dict):
+    await asyncio.sleep(STUB_LATENCY)
+    return {"message": f"Echo: {payload['message']}", "image_path": None}
+
+
+async def call_fresh_client():
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(f"{ORDERBOT_URL}/chat", json=PAYLOAD, timeout=60.0)
+        resp.raise_for_status()
+
+
+async def call_shared_client():
+    resp = await get_orderbot_client().post("/chat", json=PAYLOAD)
+    resp.raise_for_status()
+
+
+async def measure(call) -> list[float]:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    return latencies
+
+
+def report(label: str, latencies: list[float]):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{label:>14}  p50={p50:7.2f}ms  p99={p99:7.2f}ms")
+
+
+async def main():
+    server = None
+    if "BENCH_ORDERBOT_URL" not in os.environ:
+        server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+    print(f"{REQUESTS} requests, concurrency={CONCURRENCY}, target={ORDERBOT_URL}")
+    await measure(call_shared_client)  # warm up
+    report("fresh client", await measure(call_fresh_client))
+    report("shared client", await measure(call_shared_client))
+    await close_orderbot_client()
+
+    if server is not None:
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
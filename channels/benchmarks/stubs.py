@@ -0,0 +1,179 @@
+"""
+Local stand-ins for the services the channels webhook pipeline calls, so it
+can be load tested without Meta or the LLM-backed orderbot.
+
+- Graph API: /{version}/{phone_number_id}/messages, /media and
+  /whatsapp_business_profile, plus media lookups and downloads, with STUB_GRAPH_LATENCY seconds of latency
+  and a STUB_GRAPH_ERROR_RATE fraction of 500 responses.
+- Orderbot: /chat echoing the message after STUB_CHAT_LATENCY seconds, with
+  a STUB_CHAT_ERROR_RATE fraction of 500 responses.
+
+Latencies vary uniformly between 0.5x and 1.5x the configured value.
+
+    uv run python benchmarks/stubs.py
+
+then start channels against them:
+
+    GRAPH_API_BASE_URL=http://127.0.0.1:8790 GRAPH_API_VERSION=v21.0 \\
+    ORDERBOT_API_URL=http://127.0.0.1:8791 uv run fastapi run app/main.py
+
+benchmarks/load_webhooks.py starts the same stubs in-process to time replies.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+GRAPH_PORT = int(os.getenv("STUB_GRAPH_PORT", "8790"))
+ORDERBOT_PORT = int(os.getenv("STUB_ORDERBOT_PORT", "8791"))
+GRAPH_LATENCY = float(os.getenv("STUB_GRAPH_LATENCY", "0.05"))
+GRAPH_ERROR_RATE = float(os.getenv("STUB_GRAPH_ERROR_RATE", "0.0"))
+CHAT_LATENCY = float(os.getenv("STUB_CHAT_LATENCY", "0.5"))
+CHAT_ERROR_RATE = float(os.getenv("STUB_CHAT_ERROR_RATE", "0.0"))
+
+# Requests served per endpoint, including injected errors
+counters: Counter = Counter()
+# Called with (to, body) for every text/image message the Graph stub accepts
+on_message_sent: Optional[Callable[[str, dict], None]] = None
+_tasks: list[asyncio.Task] = []
+
+
+async def _simulate(name: str, latency: float, error_rate: float) -> Optional[JSONResponse]:
+    counters[name] += 1
+    await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+    if random.random() < error_rate:
+        counters[f"{name}_errors"] += 1
+        return JSONResponse(
+            status_code=500,
+            content={"error": {"message": "Stub injected error", "type": "OAuthException", "code": 1, "is_transient": True}},
+        )
+    return None
+
+
+graph = FastAPI()
+
+
+@graph.post("/{version}/{phone_number_id}/messages")
+async def messages(version: str, phone_number_id: str, request: Request):
+    body = await request.json()
+    if body.get("status") == "read":
+        return await _simulate("read", GRAPH_LATENCY, GRAPH_ERROR_RATE) or {"success": True}
+
+    error = await _simulate("messages", GRAPH_LATENCY, GRAPH_ERROR_RATE)
+    if error:
+        return error
+    to = body.get("to")
+    if on_message_sent is not None:
+        on_message_sent(to, body)
+    return {
+        "messaging_product": "whatsapp",
+        "contacts": [{"input": to, "wa_id": to}],
+        "messages": [{"id": f"wamid.stub.{uuid.uuid4().hex}"}],
+    }
+
+
+@graph.post("/{version}/{phone_number_id}/media")
+async def media(version: str, phone_number_id: str, request: Request):
+    await request.body()
+    return await _simulate("media", GRAPH_LATENCY, GRAPH_ERROR_RATE) or {"id": f"stub-media-{uuid.uuid4().hex[:16]}"}
+
+
+@graph.get("/{version}/{phone_number_id}/whatsapp_business_profile")
+async def get_business_profile(version: str, phone_number_id: str):
+    return await _simulate("profile", GRAPH_LATENCY, GRAPH_ERROR_RATE) or {
+        "data": [{
+            "about": "Stub business",
+            "address": "Av. Siempre Viva 742",
+            "description": "Pizzas",
+            "email": "stub@example.com",
+            "profile_picture_url": None,
+            "websites": [],
+            "vertical": "RESTAURANT",
+            "messaging_product": "whatsapp",
+        }]
+    }
+
+
+@graph.post("/{version}/{phone_number_id}/whatsapp_business_profile")
+async def update_business_profile(version: str, phone_number_id: str):
+    return await _simulate("profile", GRAPH_LATENCY, GRAPH_ERROR_RATE) or {"success": True}
+
+
+STUB_MEDIA_SIZE = int(os.getenv("STUB_MEDIA_SIZE", str(256 * 1024)))
+
+
+def _media_bytes(media_id: str) -> bytes:
+    return (media_id.encode() * (STUB_MEDIA_SIZE // max(len(media_id), 1) + 1))[:STUB_MEDIA_SIZE]
+
+
+# Registered before /{version}/{media_id}, which would otherwise match it
+@graph.get("/media-download/{media_id}")
+async def media_download(media_id: str):
+    counters["media_download"] += 1
+    return Response(content=_media_bytes(media_id), media_type="image/jpeg")
+
+
+@graph.get("/{version}/{media_id}")
+async def media_info(version: str, media_id: str):
+    error = await _simulate("media_info", GRAPH_LATENCY, GRAPH_ERROR_RATE)
+    if error:
+        return error
+    return {
+        "url": f"http://127.0.0.1:{GRAPH_PORT}/media-download/{media_id}",
+        "mime_type": "image/jpeg",
+        "sha256": hashlib.sha256(_media_bytes(media_id)).hexdigest(),
+        "file_size": STUB_MEDIA_SIZE,
+        "id": media_id,
+        "messaging_product": "whatsapp",
+    }
+
+
+orderbot = FastAPI()
+
+
+@orderbot.post("/chat")
+async def chat(payload: dict):
+    error = await _simulate("chat", CHAT_LATENCY, CHAT_ERROR_RATE)
+    if error:
+        return error
+    return {"message": f"Stub reply to: {payload.get('message', '')}", "image_path": None}
+
+
+async def start(graph_port: int = GRAPH_PORT, orderbot_port: int = ORDERBOT_PORT) -> list[uvicorn.Server]:
+    """Starts both stubs on the running loop and returns their servers (set should_exit to stop them)."""
+    servers = [
+        uvicorn.Server(uvicorn.Config(graph, port=graph_port, log_level="warning")),
+        uvicorn.Server(uvicorn.Config(orderbot, port=orderbot_port, log_level="warning")),
+    ]
+    _tasks.extend(asyncio.create_task(server.serve()) for server in servers)
+    while not all(server.started for server in servers):
+        await asyncio.sleep(0.05)
+    return servers
+
+
+async def stop(servers: list[uvicorn.Server]):
+    for server in servers:
+        server.should_exit = True
+    await asyncio.gather(*_tasks)
+    _tasks.clear()
+
+
+async def main():
+    await start()
+    print(f"Graph stub on :{GRAPH_PORT} (latency={GRAPH_LATENCY}s, errors={GRAPH_ERROR_RATE:.0%})")
+    print(f"Orderbot stub on :{ORDERBOT_PORT} (latency={CHAT_LATENCY}s, errors={CHAT_ERROR_RATE:.0%})")
+    while True:
+        await asyncio.sleep(10)
+        print(time.strftime("%H:%M:%S"), dict(counters))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+N simultaneous webhooks doing their Supabase work (ingest RPC + bot message
+insert): the synchronous supabase-py client called from async handlers (the
+old behaviour) versus the async access layer in supabase_client.py.
+
+Starts a stub PostgREST on localhost that answers after a fixed delay. With
+the sync client every call blocks the event loop, so the webhooks complete
+one after another; with the async layer the wall time stays close to a
+single webhook's.
+
+    uv run python benchmarks/supabase_concurrency.py
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import FastAPI
+
+STUB_PORT = int(os.getenv("BENCH_STUB_PORT", "8766"))
+os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{STUB_PORT}"
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from supabase import create_client
+
+from app.whatsapp.supabase_client import close_supabase, execute, supabase
+
+WEBHOOKS = [int(n) for n in os.getenv("BENCH_WEBHOOKS", "1,10,50").split(",")]
+STUB_LATENCY = float(os.getenv("BENCH_STUB_LATENCY", "0.05"))
+
+INGEST_PARAMS = {"p_business_id": "b", "p_wa_id": "5213300000000", "p_full_name": "Bench", "p_content": "hola", "p_wa_message_id": None}
+MESSAGE = {"conversation_id": "c", "content": "Hola! Que te sirvo?", "sender_type": "bot"}
+
+stub = FastAPI()
+
+
+@stub.post("/rest/v1/rpc/ingest_inbound_message")
+async def ingest(params: dict):
+    await asyncio.sleep(STUB_LATENCY)
+    return [{"client_id": "c", "conversation_id": "c", "message_id": "m", "duplicate": False}]
+
+
+@stub.post("/rest/v1/messages")
+async def insert_message(payload: dict):
+    await asyncio.sleep(STUB_LATENCY)
+    return [payload]
+
+
+sync_supabase = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"])
+
+
+async def webhook_sync():
+    sync_supabase.rpc("ingest_inbound_message", INGEST_PARAMS).execute()
+    sync_supabase.table("messages").insert(MESSAGE).execute()
+
+
+async def webhook_async():
+    await execute(supabase.rpc("ingest_inbound_message", INGEST_PARAMS))
+    await execute(supabase.table("messages").insert(MESSAGE))
+
+
+async def measure(webhook, n: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(webhook() for _ in range(n)))
+    return time.perf_counter() - start
+
+
+def run_stub():
+    server = uvicorn.Server(uvicorn.Config(stub, port=STUB_PORT, log_level="warning"))
+    asyncio.run(server.serve())
+
+
+async def main():
+    # The stub runs on its own thread so the blocking sync client can't stall it
+    threading.Thread(target=run_stub, daemon=True).start()
+    await asyncio.sleep(1.0)
+
+    print(f"stub latency={STUB_LATENCY * 1000:.0f}ms per call, 2 calls per webhook")
+    await webhook_async()  # warm up
+    await webhook_sync()
+    for n in WEBHOOKS:
+        sync_time = await measure(webhook_sync, n)
+        async_time = await measure(webhook_async, n)
+        print(f"{n:>4} webhooks  sync client={sync_time * 1000:8.1f}ms  async layer={async_time * 1000:8.1f}ms")
+    await close_supabase()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Throughput of webhook batch processing with 1, 10 and 100 messages per payload.
+
+The per-message handler is replaced with a sleep that stands in for the
+Supabase/Graph/orderbot I/O of a real turn, so the numbers show how much
+of a batch runs concurrently.
+
+    uv run python benchmarks/webhook_batch.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from app.whatsapp.webhook_batch import dispatch_batch, parse_webhook
+
+IO_LATENCY = float(os.getenv("BENCH_IO_LATENCY", "0.05"))
+CUSTOMERS = int(os.getenv("BENCH_CUSTOMERS", "20"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "5"))
+
+
+def build_payload(size: int) -> dict:
+    contacts = [{"wa_id": f"52133{i:07d}", "profile": {"name": f"Customer {i}"}} for i in range(min(size, CUSTOMERS))]
+    messages = [
+        {
+            "from": contacts[i % len(contacts)]["wa_id"],
+            "id": f"wamid.bench.{size}.{i}",
+            "timestamp": str(int(time.time())),
+            "type": "text",
+            "text": {"body": f"message {i}"},
+        }
+        for i in range(size)
+    ]
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "bench-waba",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "15550000000", "phone_number_id": "bench-phone-id"},
+                    "contacts": contacts,
+                    "messages": messages,
+                },
+            }],
+        }],
+    }
+
+
+async def fake_handler(inbound):
+    await asyncio.sleep(IO_LATENCY)
+
+
+async def run_sequential(batch):
+    for inbound in batch.messages:
+        await fake_handler(inbound)
+
+
+async def bench(size: int):
+    payload = build_payload(size)
+    results = {}
+    for label, runner in (("sequential", run_sequential), ("batched", lambda b: dispatch_batch(b, fake_handler))):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            await runner(parse_webhook(payload))
+        elapsed = time.perf_counter() - start
+        results[label] = size * ROUNDS / elapsed
+    return results
+
+
+async def main():
+    print(f"handler latency={IO_LATENCY * 1000:.0f}ms customers<={CUSTOMERS} rounds={ROUNDS}")
+    print(f"{'msgs/payload':>12} {'sequential msg/s':>17} {'batched msg/s':>14} {'speedup':>8}")
+    for size in (1, 10, 100):
+        r = await bench(size)
+        print(f"{size:>12} {r['sequential']:>17.1f} {r['batched']:>14.1f} {r['batched'] / r['sequential']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
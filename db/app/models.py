@@ -97,6 +97,7 @@ class MenuItemBase(SQLModel):
     name: str
     description: Optional[str] = None
     image_url: Optional[str] = None
+    category: Optional[str] = None
     price: Decimal = Field(
         default=0.00,
         sa_column=Column(Numeric(10, 2), nullable=False, server_default=text("0.00"))
@@ -253,6 +254,9 @@ class Message(MessageBase, table=True):
         sa_column_kwargs={"server_default": text("uuid_generate_v4()")}
     )
     conversation_id: uuid.UUID = Field(foreign_key="conversations.conversation_id")
+    wa_message_id: Optional[str] = Field(default=None, unique=True)
+    handled_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    claimed_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
     created_at: datetime = Field(
         default_factory=datetime.utcnow,
         sa_column=Column(DateTime(timezone=True), server_default=text("CURRENT_TIMESTAMP"))
@@ -24,6 +24,8 @@ def run_sql_file(filename):
 if __name__ == "__main__":
     try:
         run_sql_file("schemas/schema.sql")
+        run_sql_file("schemas/migrations.sql")
+        run_sql_file("schemas/functions.sql")
         run_sql_file("schemas/dummy_data.sql")
         print("Database initialized successfully!")
     except Exception as e:
@@ -0,0 +1,101 @@
+-- =============================================================================
+-- RPC FUNCTIONS
+-- Called from the services through PostgREST (supabase.rpc(...)).
+-- =============================================================================
+
+-- ingest_inbound_message: Resolves or creates the client and conversation for an
+-- inbound WhatsApp message and stores the message, in a single round trip.
+-- Relies on UNIQUE(business_id, wa_id) and UNIQUE(business_id, client_id) so that
+-- concurrent first messages from the same customer converge on the same rows, and
+-- on UNIQUE(wa_message_id) to recognise Meta redeliveries and queue retries without
+-- touching the conversation. Storing a message claims it (claimed_at) for the
+-- caller that answers it. A later delivery is reported as duplicate = true while the
+-- message is answered (handled_at set by the channels service) or its claim is less
+-- than p_claim_ttl seconds old, i.e. being answered elsewhere. Otherwise, e.g. after
+-- the first attempt failed and gave its claim back, it takes over the claim and the
+-- stored message is returned again so its turn can be retried.
+DROP FUNCTION IF EXISTS ingest_inbound_message(UUID, TEXT, TEXT, TEXT);
+DROP FUNCTION IF EXISTS ingest_inbound_message(UUID, TEXT, TEXT, TEXT, TEXT);
+CREATE OR REPLACE FUNCTION ingest_inbound_message(
+    p_business_id UUID,
+    p_wa_id TEXT,
+    p_full_name TEXT,
+    p_content TEXT,
+    p_wa_message_id TEXT DEFAULT NULL,
+    p_claim_ttl INTEGER DEFAULT 120
+)
+RETURNS TABLE (client_id UUID, conversation_id UUID, message_id UUID, duplicate BOOLEAN)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_client_id UUID;
+    v_conversation_id UUID;
+    v_message_id UUID;
+    v_new_conversation BOOLEAN := true;
+    v_duplicate BOOLEAN := false;
+BEGIN
+    INSERT INTO clients AS c (business_id, wa_id, full_name, phone_number)
+    VALUES (p_business_id, p_wa_id, p_full_name, p_wa_id)
+    ON CONFLICT (business_id, wa_id)
+        DO UPDATE SET full_name = COALESCE(c.full_name, EXCLUDED.full_name)
+    RETURNING c.client_id INTO v_client_id;
+
+    INSERT INTO conversations AS cv (business_id, client_id, last_message)
+    VALUES (p_business_id, v_client_id, p_content)
+    ON CONFLICT (business_id, client_id) DO NOTHING
+    RETURNING cv.conversation_id INTO v_conversation_id;
+
+    IF v_conversation_id IS NULL THEN
+        v_new_conversation := false;
+        SELECT cv.conversation_id INTO v_conversation_id
+        FROM conversations AS cv
+        WHERE cv.business_id = p_business_id AND cv.client_id = v_client_id;
+    END IF;
+
+    INSERT INTO messages AS m (conversation_id, sender_type, content, wa_message_id, claimed_at)
+    VALUES (v_conversation_id, 'client', p_content, p_wa_message_id, CURRENT_TIMESTAMP)
+    ON CONFLICT (wa_message_id) DO NOTHING
+    RETURNING m.message_id INTO v_message_id;
+
+    IF v_message_id IS NULL THEN
+        -- A redelivered message leaves the conversation untouched. The row lock makes
+        -- concurrent deliveries wait here, so only one of them takes the claim.
+        UPDATE messages AS m
+        SET claimed_at = CURRENT_TIMESTAMP
+        WHERE m.wa_message_id = p_wa_message_id
+          AND m.handled_at IS NULL
+          AND (m.claimed_at IS NULL OR m.claimed_at <= CURRENT_TIMESTAMP - make_interval(secs => p_claim_ttl))
+        RETURNING m.message_id INTO v_message_id;
+
+        IF v_message_id IS NULL THEN
+            v_duplicate := true;
+            SELECT m.message_id INTO v_message_id
+            FROM messages AS m
+            WHERE m.wa_message_id = p_wa_message_id;
+        END IF;
+    ELSIF NOT v_new_conversation THEN
+        UPDATE conversations AS cv
+        SET last_message = p_content, updated_at = CURRENT_TIMESTAMP
+        WHERE cv.conversation_id = v_conversation_id;
+    END IF;
+
+    RETURN QUERY SELECT v_client_id, v_conversation_id, v_message_id, v_duplicate;
+END;
+$$;
+
+-- increment_ai_message_counts: Adds batched AI reply counts to businesses.ai_message_count.
+-- p_deltas maps business_id to the number of replies sent since the last flush,
+-- e.g. {"<uuid>": 3}; a negative delta gives back replies refunded after an earlier
+-- flush. The increment happens in the UPDATE itself, so flushes from several
+-- instances never overwrite each other. Returns the new totals.
+CREATE OR REPLACE FUNCTION increment_ai_message_counts(p_deltas JSONB)
+RETURNS TABLE (business_id UUID, ai_message_count INTEGER)
+LANGUAGE sql
+AS $$
+    UPDATE businesses AS b
+    SET ai_message_count = GREATEST(COALESCE(b.ai_message_count, 0) + d.delta::INTEGER, 0)
+    FROM jsonb_each_text(p_deltas) AS d(business_id, delta)
+    WHERE b.business_id = d.business_id::UUID
+    RETURNING b.business_id, b.ai_message_count;
+$$;
@@ -0,0 +1,18 @@
+-- =============================================================================
+-- MIGRATIONS
+-- Idempotent changes for databases created from an older schema.sql.
+-- =============================================================================
+
+-- messages.wa_message_id: dedup key for inbound WhatsApp messages.
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS wa_message_id TEXT UNIQUE;
+
+-- messages.handled_at: when an inbound message was answered. Rows that exist when
+-- the column is added count as answered; new rows start out NULL.
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS handled_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE messages ALTER COLUMN handled_at DROP DEFAULT;
+
+-- messages.claimed_at: when the delivery being answered took an inbound message.
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP WITH TIME ZONE;
+
+-- menu_items.category: menu section used to page long menus.
+ALTER TABLE menu_items ADD COLUMN IF NOT EXISTS category TEXT;
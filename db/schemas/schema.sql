@@ -53,6 +53,7 @@ CREATE TABLE menu_items (
     name TEXT NOT NULL,
     description TEXT,
     image_url TEXT,
+    category TEXT, -- Menu section, lets the bot show one section at a time
     price NUMERIC(10, 2) NOT NULL DEFAULT 0.00,
     is_available BOOLEAN DEFAULT true,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
@@ -119,6 +120,9 @@ CREATE TABLE messages (
     conversation_id UUID REFERENCES conversations(conversation_id) ON DELETE CASCADE,
     sender_type sender_type NOT NULL,
     content TEXT NOT NULL,
+    wa_message_id TEXT UNIQUE, -- WhatsApp message.id of inbound messages, drops webhook redeliveries
+    handled_at TIMESTAMP WITH TIME ZONE, -- set once an inbound message has been answered
+    claimed_at TIMESTAMP WITH TIME ZONE, -- when a delivery started answering it; redeliveries are dropped while this is recent or handled_at is set
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
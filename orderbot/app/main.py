@@ -1,5 +1,8 @@
 import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -7,7 +10,10 @@ load_dotenv(override=True)
 from fastapi import FastAPI, HTTPException, Request as FastAPIRequest, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from app.schemas import MessageRequest, ChatResponse
-from app.order_agent.agent import orderbot_agent
+from app.order_agent.agent import ORDERBOT_MAX_CONCURRENT_TURNS, orderbot_agent
+from app.order_agent.menu_cache import menu_cache
+from app.order_agent.menu_render import render_stats
+from app.order_agent.session_store import session_store
 
 import google.auth.transport.requests
 import google.oauth2.id_token
@@ -46,17 +52,44 @@ def verify_google_token(request: FastAPIRequest, credentials: HTTPAuthorizationC
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="OrderBot API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tools run their Supabase queries in the default executor; give it a thread per turn slot
+    # instead of min(32, cpus + 4), which would cap concurrent turns on a small instance
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ORDERBOT_MAX_CONCURRENT_TURNS, thread_name_prefix="orderbot-io")
+    )
+    session_store.start()
+    yield
+    # Spill live carts and histories so the next instance can resume them
+    session_store.stop()
+
+app = FastAPI(title="OrderBot API", lifespan=lifespan)
 
 @app.get("/")
 async def root():
     return {"message": "OrderBot API is running with Google ADK"}
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "turns": orderbot_agent.stats(),
+        "menu_cache": menu_cache.stats(),
+        "menu_render": render_stats.stats(),
+        "sessions": session_store.stats(),
+    }
+
+@app.post("/cache/menu/invalidate")
+async def invalidate_menu_cache(business_id: str = None, business_phone: str = None, token_info: dict = Depends(verify_google_token)):
+    """Drops cached menus after the CRM edits them (all of them if no business is given)."""
+    menu_cache.invalidate(business_id=business_id, business_phone=business_phone)
+    return {"status": "success", "cache": menu_cache.stats()}
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request_data: MessageRequest, request: FastAPIRequest, token_info: dict = Depends(verify_google_token)):
     try:
         user = request_data.user
-        response_text = orderbot_agent.process_message(
+        response_text = await orderbot_agent.process_message_async(
             message=request_data.message,
             user_phone=user.phone_number,
             business_phone=user.business_phone_number,
@@ -1,11 +1,19 @@
+import asyncio
 import os
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import wraps
 from google.adk.agents.llm_agent import Agent
 from google.adk import Runner
-from google.adk.sessions.in_memory_session_service import InMemorySessionService
+from google.adk.tools.tool_context import ToolContext
 from google.genai import types
-from typing import Dict, Optional, Callable
+from typing import Dict, List, Optional, Callable
 
 from app.order_agent.session import SessionState
+from app.order_agent.menu_cache import menu_cache
+from app.order_agent.session_store import SessionConflict, SessionStore, session_store
 from app.order_agent.tools import (
     get_user_phone_number,
     get_user_name,
@@ -16,19 +24,38 @@ from app.order_agent.tools import (
     get_order_summary
 )
 
+# Turns running at once on this instance; the rest wait their turn (see /metrics "turns")
+ORDERBOT_MAX_CONCURRENT_TURNS = int(os.getenv("ORDERBOT_MAX_CONCURRENT_TURNS", "64"))
+
 class OrderbotADKAgent:
-    def __init__(self):
+    def __init__(self, store: Optional[SessionStore] = None, max_concurrent_turns: int = ORDERBOT_MAX_CONCURRENT_TURNS):
         self.model_name = "gemini-3-flash-preview"
-        self._sessions: Dict[str, SessionState] = {}
-        self._agents: Dict[str, Agent] = {}
-        self._session_service = InMemorySessionService()
+        # Holds both our SessionState and the ADK session history, bounded and spilling to disk/Postgres
+        self._sessions = store or session_store
+        self.max_concurrent_turns = max_concurrent_turns
+        self._turn_slots = asyncio.Semaphore(max_concurrent_turns)
+        # Session acquire/release block on the backend (lease, group commit), one call per turn at a
+        # time: a thread per turn slot, so the default executor's few threads don't cap the turns
+        self._session_threads = ThreadPoolExecutor(max_workers=max_concurrent_turns, thread_name_prefix="orderbot-session")
+        self.turns = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.queued = 0
+        self.queue_wait_seconds = 0.0
+        self.turn_conflicts = 0
+        # session_id -> [lock, turns holding or waiting for it]; dropped when no turn needs it
+        self._conversations: Dict[str, List] = {}
+        self.conversation_waits = 0
+        self.conversation_wait_seconds = 0.0
+        self.max_conversation_wait = 0.0
         
         self.system_instruction = """You are OrderBot, an automated assistant for taking restaurant orders.
 
 Your responsibilities:
 - Greet the customer in a friendly, casual way based on their name if you know it, otherwise ask for it.
 - Never list or describe the menu in the greeting.
-- Use `get_menu` only to understand what items and options exist.
+- Use `get_menu` only to understand what items and options exist. Long menus come in pages and sections; request another `page` or a `category` only when you need it, and `details` when a shortened description leaves an item's options unclear.
+- Pass the item's #id from the menu to `add_order_item` when you have it.
 - Collect the customer’s order step by step.
 - For each item, clarify required options (size, extras, variations) so the item is uniquely identified.
 - Only offer items, options, and extras that exist in the menu. Never invent anything.
@@ -52,100 +79,212 @@ Conversation rules:
 - Never offer suggestions or items that are not on the menu.
 """
 
+        # One agent definition and one runner serve every session; tools find
+        # the caller's SessionState through the ADK session id at call time.
+        self._agent = Agent(
+            model=self.model_name,
+            name='orderbot_agent',
+            description="Takes restaurant orders from users via chat.",
+            instruction=self.system_instruction,
+            tools=[
+                self._session_tool(get_user_phone_number),
+                self._session_tool(get_user_name),
+                self._session_tool(update_user_name),
+                self._session_tool(get_menu),
+                self._session_tool(add_order_item),
+                self._session_tool(add_order),
+                self._session_tool(get_order_summary)
+            ]
+        )
+        self._runner = Runner(
+            agent=self._agent,
+            app_name='orderbot',
+            session_service=self._sessions,
+            auto_create_session=True
+        )
+
+    @staticmethod
+    def session_id(user_phone: str, business_phone: str) -> str:
+        return f"{business_phone}:{user_phone}"
+
     def get_or_create_session(self, user_phone: str, business_phone: str, name: str = "Unknown") -> SessionState:
-        session_id = f"{business_phone}:{user_phone}"
-        if session_id not in self._sessions:
-            self._sessions[session_id] = SessionState(
+        """Returns the live session, rehydrating or creating it. Pinned in memory until `release_session`."""
+        session_id = self.session_id(user_phone, business_phone)
+        # Fetch the menu while the model is still reading the message (a no-op when it's cached)
+        menu_cache.preload(business_phone)
+
+        def create() -> SessionState:
+            return SessionState(
                 user_id=session_id,
                 phone_number=user_phone,
                 business_phone_number=business_phone,
                 name=name
             )
-        return self._sessions[session_id]
-
-    def _get_agent(self, session: SessionState) -> Agent:
-        if session.user_id not in self._agents:
-            # We must bind the session object to the tools.
-            # ADK supports callable objects as tools.
-            tools = [
-                self._bind_tool(get_user_phone_number, session),
-                self._bind_tool(get_user_name, session),
-                self._bind_tool(update_user_name, session),
-                self._bind_tool(get_menu, session),
-                self._bind_tool(add_order_item, session),
-                self._bind_tool(add_order, session),
-                self._bind_tool(get_order_summary, session)
-            ]
-            
-            # ADK uses `Agent(...)` which initializes the generative model under the hood.
-            chat_agent = Agent(
-                model=self.model_name,
-                name='orderbot_agent',
-                description="Takes restaurant orders from users via chat.",
-                instruction=self.system_instruction,
-                tools=tools
-            )
-            self._agents[session.user_id] = chat_agent
-            
-        return self._agents[session.user_id]
-        
-    def _bind_tool(self, func: Callable, session: SessionState) -> Callable:
-        """Helper to create a wrapped function that injects the session."""
-        import inspect
-        from functools import wraps
-        
+
+        return self._sessions.acquire(session_id, create)
+
+    def release_session(self, session: SessionState):
+        """
+        Ends the turn once the session is stored. Raises SessionConflict if
+        the turn lost its write to another instance (see SessionStore.release):
+        its tools may already have placed an order, so it is failed rather
+        than run again.
+        """
+        if not self._sessions.release(session.user_id):
+            self.turn_conflicts += 1
+            raise SessionConflict(f"Session {session.user_id} changed on another instance during the turn")
+
+    def _session_tool(self, func: Callable) -> Callable:
+        """
+        Wraps a tool taking `session` so ADK calls it with `tool_context`
+        instead, and the session is looked up from the ADK session id.
+        Built once per tool, shared by all sessions.
+        """
         sig = inspect.signature(func)
-        parameters = list(sig.parameters.values())
-        
-        # Remove 'session' from the parameters exposed to the LLM
-        new_params = [p for p in parameters if p.name != 'session']
+        is_async = inspect.iscoroutinefunction(func)
+
+        # Hide 'session' from the LLM; ADK injects 'tool_context' and leaves it out of the schema
+        new_params = [p for p in sig.parameters.values() if p.name != 'session']
+        new_params.append(inspect.Parameter('tool_context', inspect.Parameter.KEYWORD_ONLY, annotation=ToolContext))
         new_sig = sig.replace(parameters=new_params)
-        
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, session=session, **kwargs)
-            
+
+        if is_async:
+            # Async tools keep the event loop free while they wait on Supabase
+            @wraps(func)
+            async def wrapper(*args, tool_context: ToolContext, **kwargs):
+                session = self._sessions.get(tool_context.session.id)
+                if session is None:
+                    return "Error: Session not found."
+                return await func(*args, session=session, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, tool_context: ToolContext, **kwargs):
+                session = self._sessions.get(tool_context.session.id)
+                if session is None:
+                    return "Error: Session not found."
+                return func(*args, session=session, **kwargs)
+
         wrapper.__signature__ = new_sig # ADK/Pydantic uses signature to generate schema
         return wrapper
 
-    def process_message(self, message: str, user_phone: str, business_phone: str, name: str = "Unknown", image_path: Optional[str] = None) -> str:
-        """Main entry point to talk to the agent."""
-        session = self.get_or_create_session(user_phone, business_phone, name)
-        
-        # Get the ADK Agent instance for this session
-        agent = self._get_agent(session)
-        
-        runner = Runner(
-            agent=agent, 
-            app_name='orderbot', 
-            session_service=self._session_service, 
-            auto_create_session=True
-        )
-        
+    def _new_message(self, message: str, image_path: Optional[str]) -> types.Content:
         contents = []
         if image_path and os.path.exists(image_path):
              # Skipping file logic for now unless requested
              pass
         else:
              contents.append(types.Part.from_text(text=message))
-             
-        new_message = types.Content(role='user', parts=contents)
-        
-        response_generator = runner.run(
-            new_message=new_message,
-            user_id=session.user_id,
-            session_id=session.user_id
-        )
-        
+
+        return types.Content(role='user', parts=contents)
+
+    @staticmethod
+    def _collect_text(event, final_text: list):
         # ADK runner yields events. We concatenate assistant content.
+        if event.content and event.content.parts:
+            for part in event.content.parts:
+                if part.text:
+                    final_text.append(part.text)
+
+    def process_message(self, message: str, user_phone: str, business_phone: str, name: str = "Unknown", image_path: Optional[str] = None) -> str:
+        """
+        Main entry point to talk to the agent from synchronous code (scripts,
+        tests). Blocks until the reply; unlike `process_message_async` it
+        doesn't order concurrent turns of one conversation.
+        """
+        session = self.get_or_create_session(user_phone, business_phone, name)
+        new_message = self._new_message(message, image_path)
+
         final_text = []
-        for event in response_generator:
-            if event.content and event.content.parts:
-                for part in event.content.parts:
-                    if part.text:
-                        final_text.append(part.text)
-                        
+        try:
+            for event in self._runner.run(new_message=new_message, user_id=session.user_id, session_id=session.user_id):
+                self._collect_text(event, final_text)
+        finally:
+            self.release_session(session)
         return "".join(final_text)
 
+    @asynccontextmanager
+    async def _conversation(self, session_id: str):
+        """
+        Runs the turns of one conversation one at a time, in arrival order
+        (asyncio.Lock is FIFO), so two messages sent together never work on
+        the same cart and ADK history at once. Other conversations don't wait.
+        """
+        entry = self._conversations.get(session_id)
+        if entry is None:
+            entry = self._conversations[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            if entry[0].locked():
+                waited_since = time.perf_counter()
+                await entry[0].acquire()
+                waited = time.perf_counter() - waited_since
+                self.conversation_waits += 1
+                self.conversation_wait_seconds += waited
+                self.max_conversation_wait = max(self.max_conversation_wait, waited)
+            else:
+                await entry[0].acquire()
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._conversations[session_id]
+
+    async def process_message_async(self, message: str, user_phone: str, business_phone: str, name: str = "Unknown", image_path: Optional[str] = None) -> str:
+        """
+        Main entry point from async code (the /chat endpoint). The model call
+        and the tools are awaited, so other conversations keep running on
+        the event loop meanwhile. A conversation's turns run in order, one
+        at a time; at most `max_concurrent_turns` turns run at once and later
+        ones wait for a free slot.
+        """
+        # A turn waiting behind its own conversation doesn't hold a slot meanwhile
+        async with self._conversation(self.session_id(user_phone, business_phone)):
+            return await self._run_turn(message, user_phone, business_phone, name, image_path)
+
+    async def _run_turn(self, message: str, user_phone: str, business_phone: str, name: str, image_path: Optional[str]) -> str:
+        waited_since = time.perf_counter()
+        if self._turn_slots.locked():
+            self.queued += 1
+        async with self._turn_slots:
+            self.queue_wait_seconds += time.perf_counter() - waited_since
+            self.turns += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                # Loading and storing a session may hit the backend, so both happen off the event loop
+                loop = asyncio.get_running_loop()
+                session = await loop.run_in_executor(self._session_threads, self.get_or_create_session, user_phone, business_phone, name)
+                new_message = self._new_message(message, image_path)
+
+                final_text = []
+                try:
+                    async for event in self._runner.run_async(new_message=new_message, user_id=session.user_id, session_id=session.user_id):
+                        self._collect_text(event, final_text)
+                finally:
+                    await loop.run_in_executor(self._session_threads, self.release_session, session)
+                return "".join(final_text)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent_turns": self.max_concurrent_turns,
+            "turns": self.turns,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "queued": self.queued,
+            "avg_queue_wait_ms": self.queue_wait_seconds / self.turns * 1000 if self.turns else 0.0,
+            # Turns failed after losing their session write to another instance
+            "turn_conflicts": self.turn_conflicts,
+            "conversations_busy": len(self._conversations),
+            # Turns that waited for an earlier turn of the same conversation
+            "conversation_waits": self.conversation_waits,
+            "avg_conversation_wait_ms": self.conversation_wait_seconds / self.conversation_waits * 1000 if self.conversation_waits else 0.0,
+            "max_conversation_wait_ms": self.max_conversation_wait * 1000,
+        }
+
 # Global agent instance
 orderbot_agent = OrderbotADKAgent()
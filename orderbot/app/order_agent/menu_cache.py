@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+# Menu edits in the CRM show up after at most this many seconds (or right away via /cache/menu/invalidate)
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "300"))
+MENU_CACHE_MAX_BUSINESSES = int(os.getenv("MENU_CACHE_MAX_BUSINESSES", "1000"))
+# Phone numbers with no business are remembered this long, so unknown senders don't hit Supabase every turn
+MENU_CACHE_NOT_FOUND_TTL = float(os.getenv("MENU_CACHE_NOT_FOUND_TTL", "60"))
+
+
+class Menu:
+    """
+    Snapshot of one business's menu items.
+
+    `version` is a fingerprint of the items, so it only changes when the
+    menu actually does. Data built from the items (name index, rendered
+    text) is kept in `derived` and lives exactly as long as this version.
+    """
+
+    def __init__(self, business_id: str, items: List[Dict[str, Any]]):
+        self.business_id = business_id
+        self.items = items
+        self.items_by_id = {item.get("item_id"): item for item in items}
+        self.version = hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        self.loaded_at = time.monotonic()
+        self.short_ids = _short_ids(items)
+        self.derived: Dict[Any, Any] = {}
+
+
+def _short_ids(items: List[Dict[str, Any]]) -> Dict[str, str]:
+    """item_id -> shortest unique item_id prefix (at least 4 characters), so compact menus can cite items cheaply."""
+    ids = [str(item.get("item_id") or "").replace("-", "") for item in items]
+    length = 4
+    while length < 32 and len({item_id[:length] for item_id in ids}) < len(ids):
+        length += 2
+    return {item.get("item_id"): item_id[:length] for item, item_id in zip(items, ids)}
+
+
+class MenuCache:
+    """
+    Per-business menu cache shared by every session of this worker.
+
+    Business phone numbers resolve to a business_id and business_ids to a
+    `Menu`, both kept for `ttl` seconds (least recently used entries are
+    dropped beyond `max_businesses`); numbers with no business are
+    remembered for `not_found_ttl`. Tools only do dictionary lookups on a
+    hit; a miss loads from Supabase once per business even when several
+    threads ask at the same time. If a reload fails the previous menu keeps
+    being served. `preload` warms a business in the background when a new
+    session starts, before the model first calls a menu tool. The `a*`
+    variants never block the event loop.
+    """
+
+    def __init__(
+        self,
+        ttl: float = MENU_CACHE_TTL,
+        max_businesses: int = MENU_CACHE_MAX_BUSINESSES,
+        not_found_ttl: float = MENU_CACHE_NOT_FOUND_TTL,
+    ):
+        self.ttl = ttl
+        self.max_businesses = max_businesses
+        self.not_found_ttl = not_found_ttl
+        # business phone -> (business_id, or "" if there is none, expires_at), kept in LRU order
+        self._business_ids: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # business_id -> (menu, expires_at), kept in LRU order
+        self._menus: "OrderedDict[str, Tuple[Menu, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # load key -> [lock, threads using it]; dropped once nobody is loading that key
+        self._load_locks: Dict[str, list] = {}
+        self._preloader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="menu-preload")
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+
+    @contextmanager
+    def _load_lock(self, key: str):
+        with self._lock:
+            entry = self._load_locks.get(key)
+            if entry is None:
+                entry = self._load_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._load_locks[key]
+
+    def _store(self, entries: "OrderedDict", key: str, value: Any, ttl: float):
+        with self._lock:
+            entries[key] = (value, time.monotonic() + ttl)
+            entries.move_to_end(key)
+            while len(entries) > self.max_businesses:
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def _touch(self, entries: "OrderedDict", key: str):
+        with self._lock:
+            if key in entries:
+                entries.move_to_end(key)
+
+    def _fresh(self, entries: dict, key: str) -> Optional[Any]:
+        entry = entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def business_id(self, business_phone: str) -> Optional[str]:
+        """Resolves a business UUID from its WhatsApp phone number."""
+        business_id = self._fresh(self._business_ids, business_phone)
+        if business_id is not None:
+            self.hits += 1
+            self._touch(self._business_ids, business_phone)
+            return business_id or None
+        with self._load_lock(f"phone:{business_phone}"):
+            # Another thread may have loaded it while we waited
+            business_id = self._fresh(self._business_ids, business_phone)
+            if business_id is not None:
+                self.hits += 1
+                return business_id or None
+            self.misses += 1
+            try:
+                response = supabase.table("businesses").select("business_id").eq("whatsapp_phone_number", business_phone).limit(1).execute()
+            except Exception as e:
+                self.load_errors += 1
+                logger.error(f"Error fetching business ID from Supabase: {e}")
+                stale = self._business_ids.get(business_phone)
+                return (stale[0] or None) if stale else None
+            if not response.data:
+                self._store(self._business_ids, business_phone, "", self.not_found_ttl)
+                return None
+            business_id = response.data[0].get("business_id")
+            self._store(self._business_ids, business_phone, business_id, self.ttl)
+            return business_id
+
+    def get_menu(self, business_id: str) -> Optional[Menu]:
+        """Returns the business's menu, loading it on a miss. None if it could never be loaded."""
+        menu = self._fresh(self._menus, business_id)
+        if menu is not None:
+            self.hits += 1
+            self._touch(self._menus, business_id)
+            return menu
+        with self._load_lock(f"menu:{business_id}"):
+            menu = self._fresh(self._menus, business_id)
+            if menu is not None:
+                self.hits += 1
+                return menu
+            self.misses += 1
+            return self._load(business_id)
+
+    def get(self, business_phone: str) -> Optional[Menu]:
+        """Menu of the business behind a WhatsApp phone number."""
+        business_id = self.business_id(business_phone)
+        if not business_id:
+            return None
+        return self.get_menu(business_id)
+
+    async def abusiness_id(self, business_phone: str) -> Optional[str]:
+        """`business_id` for async code: answered inline from the cache, looked up in a worker thread on a miss."""
+        if self._fresh(self._business_ids, business_phone) is not None:
+            return self.business_id(business_phone)
+        return await asyncio.to_thread(self.business_id, business_phone)
+
+    async def aget_menu(self, business_id: str) -> Optional[Menu]:
+        """`get_menu` for async code: answered inline from the cache, loaded in a worker thread on a miss."""
+        if self._fresh(self._menus, business_id) is not None:
+            return self.get_menu(business_id)
+        return await asyncio.to_thread(self.get_menu, business_id)
+
+    def _load(self, business_id: str) -> Optional[Menu]:
+        self.loads += 1
+        started = time.perf_counter()
+        try:
+            response = supabase.table("menu_items").select("*").eq("business_id", business_id).execute()
+        except Exception as e:
+            self.load_errors += 1
+            logger.error(f"Error fetching menu from Supabase: {e}")
+            stale = self._menus.get(business_id)
+            return stale[0] if stale else None
+        finally:
+            self.load_seconds += time.perf_counter() - started
+
+        menu = Menu(business_id, response.data or [])
+        previous = self._menus.get(business_id)
+        if previous is not None and previous[0].version == menu.version:
+            # Unchanged: keep the old object so whatever was derived from it is reused
+            menu = previous[0]
+            menu.loaded_at = time.monotonic()
+        self._store(self._menus, business_id, menu, self.ttl)
+        return menu
+
+    def preload(self, business_phone: str):
+        """Warms the cache for a business in the background; returns immediately."""
+        if not business_phone:
+            return
+        business_id = self._fresh(self._business_ids, business_phone)
+        if business_id == "" or business_id is not None and self._fresh(self._menus, business_id) is not None:
+            return
+        self._preloader.submit(self._preload, business_phone)
+
+    def _preload(self, business_phone: str):
+        try:
+            business_id = self.business_id(business_phone)
+            if business_id:
+                self.get_menu(business_id)
+        except Exception as e:
+            logger.error(f"Error preloading menu for {business_phone}: {e}")
+
+    def invalidate(self, business_id: Optional[str] = None, business_phone: Optional[str] = None):
+        """Drops one business (by ID or phone number), or everything when neither is given."""
+        with self._lock:
+            if business_phone:
+                entry = self._business_ids.pop(business_phone, None)
+                if entry is not None:
+                    self._menus.pop(entry[0], None)
+            elif business_id:
+                self._menus.pop(business_id, None)
+                # A new business may own a number we remembered as unknown
+                for phone, (cached_id, _) in list(self._business_ids.items()):
+                    if cached_id in (business_id, ""):
+                        del self._business_ids[phone]
+            else:
+                self._menus.clear()
+                self._business_ids.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "businesses": len(self._menus),
+            "phone_numbers": len(self._business_ids),
+            "max_businesses": self.max_businesses,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "avg_load_ms": self.load_seconds / self.loads * 1000 if self.loads else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+menu_cache = MenuCache()
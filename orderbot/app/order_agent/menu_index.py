@@ -0,0 +1,155 @@
+import difflib
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+
+from app.order_agent.menu_cache import Menu
+
+# Lowest similarity (0-1) a typo'd name may have and still be added without asking
+FUZZY_MIN_SCORE = 0.75
+# Weaker matches than this are not even suggested
+FUZZY_SUGGEST_SCORE = 0.6
+# The best fuzzy match must beat the runner-up by this much, otherwise we ask
+FUZZY_MIN_MARGIN = 0.08
+# At most this many items sharing words with the query are scored
+FUZZY_MAX_CANDIDATES = 30
+MIN_PREFIX = 2
+MAX_SUGGESTIONS = 8
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text: str) -> str:
+    """Casefolds, strips accents and punctuation: 'Jamón & Piña' -> 'jamon pina'."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return _NON_ALNUM.sub(" ", text).strip()
+
+
+class MatchResult:
+    """Outcome of a lookup: `item` when exactly one matched, otherwise the `candidates` to ask about."""
+
+    def __init__(self, item: Optional[Dict[str, Any]] = None, candidates: Optional[List[Dict[str, Any]]] = None, kind: Optional[str] = None, score: float = 1.0):
+        self.item = item
+        self.candidates = candidates or []
+        # "exact", "tokens" or "fuzzy"; None when nothing matched
+        self.kind = kind
+        # Best fuzzy similarity, 1.0 otherwise
+        self.score = score
+
+
+class MenuIndex:
+    """
+    Name lookup structures for one menu version.
+
+    Built once in O(items x name length): a normalized-name dictionary, a
+    token -> items index and a token-prefix -> items index. A lookup then
+    only touches the items sharing the query's tokens, so its cost depends
+    on the query and on how many names share a word, not on menu size.
+    Typos fall back to fuzzy matching against the menu's vocabulary
+    (distinct words), then score only the items containing those words.
+    """
+
+    def __init__(self, menu: Menu):
+        self.version = menu.version
+        self.items = menu.items
+        self.names = [normalize(item.get("name", "")) for item in self.items]
+        self.by_name: Dict[str, List[int]] = {}
+        self.by_token: Dict[str, Set[int]] = {}
+        self.by_prefix: Dict[str, Set[int]] = {}
+        for i, name in enumerate(self.names):
+            self.by_name.setdefault(name, []).append(i)
+            for token in name.split():
+                self.by_token.setdefault(token, set()).add(i)
+                for end in range(MIN_PREFIX, len(token)):
+                    self.by_prefix.setdefault(token[:end], set()).add(i)
+        self.vocabulary = list(self.by_token)
+        # Short IDs as shown in the compact menu ("#3fa8")
+        self.by_short_id = {menu.short_ids.get(item.get("item_id"), "").lower(): i for i, item in enumerate(self.items)}
+
+    def _token_matches(self, token: str) -> Set[int]:
+        return self.by_token.get(token, set()) | self.by_prefix.get(token, set())
+
+    def _items(self, indexes) -> List[Dict[str, Any]]:
+        return [self.items[i] for i in sorted(indexes, key=lambda i: (len(self.names[i]), self.names[i]))]
+
+    def match(self, query: str) -> MatchResult:
+        name = normalize(query)
+        if not name:
+            return MatchResult()
+
+        exact = self.by_name.get(name)
+        if exact:
+            return MatchResult(self.items[exact[0]], kind="exact") if len(exact) == 1 else MatchResult(candidates=self._items(exact), kind="exact")
+        by_id = self.by_short_id.get(query.strip().lstrip("#").lower())
+        if by_id is not None:
+            return MatchResult(self.items[by_id], kind="exact")
+
+        # Every query word must be a word (or the start of a word) of the item name
+        tokens = name.split()
+        found = None
+        for token in sorted(tokens, key=lambda t: len(self._token_matches(t))):
+            matches = self._token_matches(token)
+            found = matches if found is None else found & matches
+            if not found:
+                break
+        if found:
+            if len(found) == 1:
+                return MatchResult(self.items[next(iter(found))], kind="tokens")
+            return MatchResult(candidates=self._items(found), kind="tokens")
+
+        return self._fuzzy(name, tokens)
+
+    def _score(self, name: str, tokens: List[str], i: int, similarity: Dict[tuple, float]) -> float:
+        """Similarity of the whole name, or of each query word to its closest word in the item name if higher."""
+        whole = difflib.SequenceMatcher(None, name, self.names[i]).ratio()
+        total = 0.0
+        for token in tokens:
+            best = 0.0
+            for word in self.names[i].split():
+                # Item names share words, so each (query word, menu word) pair is compared once per lookup
+                ratio = similarity.get((token, word))
+                if ratio is None:
+                    ratio = similarity[(token, word)] = difflib.SequenceMatcher(None, token, word).ratio()
+                best = max(best, ratio)
+            total += best
+        return max(whole, total / len(tokens))
+
+    def _fuzzy(self, name: str, tokens: List[str]) -> MatchResult:
+        # Items containing each query word, or the menu words closest to it
+        related = []
+        for token in tokens:
+            matches = self._token_matches(token)
+            for close in difflib.get_close_matches(token, self.vocabulary, n=3, cutoff=0.7):
+                matches = matches | self.by_token[close]
+            if matches:
+                related.append(matches)
+        if not related:
+            return MatchResult()
+        # Narrow down to the items sharing as many of those words as possible
+        related.sort(key=len)
+        candidates = related[0]
+        for matches in related[1:]:
+            narrowed = candidates & matches
+            if narrowed:
+                candidates = narrowed
+        candidates = sorted(candidates, key=lambda i: len(self.names[i]))[:FUZZY_MAX_CANDIDATES]
+
+        similarity: Dict[tuple, float] = {}
+        scored = sorted(((self._score(name, tokens, i, similarity), i) for i in candidates), reverse=True)
+        best_score, best = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        if best_score >= FUZZY_MIN_SCORE and best_score - runner_up >= FUZZY_MIN_MARGIN:
+            return MatchResult(self.items[best], kind="fuzzy", score=best_score)
+        suggestions = [self.items[i] for score, i in scored[:MAX_SUGGESTIONS] if score >= FUZZY_SUGGEST_SCORE]
+        if not suggestions:
+            return MatchResult(score=best_score)
+        return MatchResult(candidates=suggestions, kind="fuzzy", score=best_score)
+
+
+def index_for(menu: Menu) -> MenuIndex:
+    """The index of `menu`, built on first use. A reload with unchanged items keeps the same Menu, and so the index."""
+    index = menu.derived.get("index")
+    if index is None:
+        index = menu.derived.setdefault("index", MenuIndex(menu))
+    return index
@@ -0,0 +1,158 @@
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.order_agent.menu_cache import Menu
+from app.order_agent.menu_index import normalize
+
+# "compact" (short IDs, names, prices and shortened descriptions) or "full" (names, prices and whole descriptions)
+MENU_FORMAT = os.getenv("MENU_FORMAT", "compact")
+# Items per get_menu page; 0 lists the whole menu at once
+MENU_PAGE_SIZE = int(os.getenv("MENU_PAGE_SIZE", "60"))
+MENU_NAME_MAX = int(os.getenv("MENU_NAME_MAX", "40"))
+# Compact lines keep this much of each description (options, sizes); get_menu(details=True) shows all of it
+MENU_DESCRIPTION_MAX = int(os.getenv("MENU_DESCRIPTION_MAX", "80"))
+
+FORMATS = ("compact", "full")
+
+# Roughly how SentencePiece/BPE tokenizers split text: words in chunks of up to 4 characters, punctuation apart
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate prompt tokens of `text`, good enough to compare menu formats."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def _price(item: Dict[str, Any]) -> str:
+    price = f"{float(item.get('price') or 0):.2f}"
+    return price[:-3] if price.endswith(".00") else price
+
+
+def _shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _line(menu: Menu, item: Dict[str, Any], fmt: str) -> str:
+    available = item.get("is_available", True) is not False
+    if fmt == "full":
+        line = f"- {item.get('name')}: ${float(item.get('price') or 0):.2f}"
+        if item.get("description"):
+            line += f" ({item.get('description')})"
+        return line if available else line + " (not available right now)"
+    line = f"#{menu.short_ids.get(item.get('item_id'))} {_shorten(item.get('name') or '', MENU_NAME_MAX)} ${_price(item)}"
+    description = " ".join((item.get("description") or "").split())
+    if description and MENU_DESCRIPTION_MAX:
+        line += f" ({_shorten(description, MENU_DESCRIPTION_MAX)})"
+    return line if available else line + " [sold out]"
+
+
+def sections(menu: Menu) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """(category, items) in menu order; a single unnamed section when items have no category."""
+    cached = menu.derived.get("sections")
+    if cached is None:
+        grouped: Dict[str, List[Dict[str, Any]]] = {}
+        for item in menu.items:
+            grouped.setdefault(item.get("category") or "", []).append(item)
+        cached = menu.derived.setdefault("sections", list(grouped.items()))
+    return cached
+
+
+class RenderStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.renders: Counter = Counter()
+        self.served: Counter = Counter()
+        self.tokens_served: Counter = Counter()
+
+    def record(self, fmt: str, tokens: int, rendered: bool):
+        with self._lock:
+            if rendered:
+                self.renders[fmt] += 1
+            self.served[fmt] += 1
+            self.tokens_served[fmt] += tokens
+
+    def stats(self) -> dict:
+        return {
+            "default_format": MENU_FORMAT,
+            "page_size": MENU_PAGE_SIZE,
+            "renders": dict(self.renders),
+            "served": dict(self.served),
+            "tokens_served": dict(self.tokens_served),
+            "avg_tokens_served": {fmt: self.tokens_served[fmt] / count for fmt, count in self.served.items()},
+        }
+
+
+render_stats = RenderStats()
+
+
+def _render(menu: Menu, fmt: str, category: str, page: int, page_size: int) -> Tuple[str, Optional[int], bool]:
+    """(text, tokens, freshly rendered); tokens is None for error messages, which are not cached."""
+    all_sections = sections(menu)
+    wanted = normalize(category)
+    if wanted:
+        selected = [(name, items) for name, items in all_sections if normalize(name) == wanted]
+        if not selected:
+            selected = [(name, items) for name, items in all_sections if normalize(name).startswith(wanted)]
+        if not selected:
+            names = ", ".join(name for name, _ in all_sections if name)
+            return f"There is no '{category}' section on the menu." + (f" Sections: {names}" if names else ""), None, False
+        wanted = normalize(selected[0][0])
+        selected = selected[:1]
+    else:
+        selected = all_sections
+
+    key = ("render", fmt, wanted, page, page_size)
+    cached = menu.derived.get(key)
+    if cached is not None:
+        return cached[0], cached[1], False
+
+    rows: List[Tuple[str, Dict[str, Any]]] = [(name, item) for name, items in selected for item in items]
+    pages = max(1, -(-len(rows) // page_size)) if page_size else 1
+    if page < 1 or page > pages:
+        return f"The menu has {pages} page(s); there is no page {page}.", None, False
+    if page_size:
+        rows = rows[(page - 1) * page_size:page * page_size]
+
+    lines = ["Welcome to our menu!", ""] if fmt == "full" else ["Menu (#id name $price (description)):"]
+    current: Optional[str] = None
+    for name, item in rows:
+        if name and name != current:
+            if fmt == "full" and lines[-1]:
+                lines.append("")
+            lines.append(f"{name}:")
+            current = name
+        lines.append(_line(menu, item, fmt))
+    if fmt != "full" and any("…)" in line for line in lines):
+        lines.append("Descriptions ending in … are shortened; call get_menu with details=true for the full text.")
+    if pages > 1:
+        footer = f"Page {page} of {pages}; call get_menu with page={page + 1} for more." if page < pages else f"Page {page} of {pages}."
+        if not wanted and len(all_sections) > 1:
+            footer += " Sections: " + ", ".join(name for name, _ in all_sections if name)
+        lines.append(footer)
+
+    text = "\n".join(lines) + "\n"
+    tokens = estimate_tokens(text)
+    menu.derived[key] = (text, tokens)
+    return text, tokens, True
+
+
+def render(menu: Menu, fmt: str = MENU_FORMAT, category: str = "", page: int = 1, page_size: int = MENU_PAGE_SIZE) -> str:
+    """
+    Menu text for the model, cached on the Menu so it is built once per
+    menu version, format, section and page. `category` limits it to one
+    section; with `page_size`, long menus come in pages whose footer says
+    how to get the rest.
+    """
+    fmt = fmt if fmt in FORMATS else MENU_FORMAT
+    text, tokens, rendered = _render(menu, fmt, category, page, page_size)
+    if tokens is not None:
+        render_stats.record(fmt, tokens, rendered)
+    return text
+
+
+def token_counts(menu: Menu) -> Dict[str, int]:
+    """Estimated tokens of the whole, unpaged menu in each format, to compare them."""
+    return {fmt: _render(menu, fmt, "", 1, 0)[1] for fmt in FORMATS}
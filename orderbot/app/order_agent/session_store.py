@@ -0,0 +1,754 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from google.adk.sessions.in_memory_session_service import InMemorySessionService
+from google.adk.sessions.session import Session
+
+from app.order_agent.session import SessionState
+
+logger = logging.getLogger(__name__)
+
+# sqlite:///path for a local file, postgresql://... in production, "none" to drop evicted sessions
+SESSION_BACKEND_URL = os.getenv("SESSION_BACKEND_URL", "sqlite:///orderbot_sessions.db")
+SESSION_MAX_LIVE = int(os.getenv("SESSION_MAX_LIVE", "5000"))
+# Sessions idle this long are dropped from memory (the backend keeps them)
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+# Spilled sessions not resumed within this many seconds are deleted from the backend
+SESSION_RETENTION = float(os.getenv("SESSION_RETENTION", str(7 * 24 * 3600)))
+SESSION_BACKEND_POOL_SIZE = int(os.getenv("SESSION_BACKEND_POOL_SIZE", "4"))
+# A writer thread batches the turns that end while it is busy, and retries failed writes this often.
+# 0 has every turn write itself instead, without batching. Either way a turn is stored before its reply.
+SESSION_WRITE_INTERVAL = float(os.getenv("SESSION_WRITE_INTERVAL", "0.05"))
+SESSION_WRITE_BATCH = int(os.getenv("SESSION_WRITE_BATCH", "200"))
+# A turn holds its conversation's lease so no other instance serves it meanwhile; a crashed
+# instance's lease lapses after SESSION_LEASE_TTL seconds. Turns wait up to SESSION_LEASE_WAIT for it.
+SESSION_LEASE_TTL = float(os.getenv("SESSION_LEASE_TTL", "120"))
+SESSION_LEASE_WAIT = float(os.getenv("SESSION_LEASE_WAIT", "60"))
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orderbot_sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orderbot_sessions_updated_at ON orderbot_sessions(updated_at);
+CREATE TABLE IF NOT EXISTS orderbot_session_leases (
+    session_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orderbot_sessions (
+    session_id TEXT PRIMARY KEY,
+    data JSONB NOT NULL,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE orderbot_sessions ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
+CREATE INDEX IF NOT EXISTS idx_orderbot_sessions_updated_at ON orderbot_sessions(updated_at);
+CREATE TABLE IF NOT EXISTS orderbot_session_leases (
+    session_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+"""
+
+# Takes the lease if it is free, lapsed or already ours, and returns the stored version with it
+POSTGRES_LEASE = """
+WITH lease AS (
+    INSERT INTO orderbot_session_leases (session_id, owner, expires_at)
+    VALUES (%(session_id)s, %(owner)s, CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s))
+    ON CONFLICT (session_id) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+    WHERE orderbot_session_leases.owner = EXCLUDED.owner OR orderbot_session_leases.expires_at <= CURRENT_TIMESTAMP
+    RETURNING session_id
+)
+SELECT COALESCE(s.version, 0) FROM lease LEFT JOIN orderbot_sessions s ON s.session_id = lease.session_id
+"""
+
+# Writes a batch in one round trip: rows whose stored version still matches are updated (or inserted
+# when new) and come back with their new version; the missing ones lost to another instance.
+POSTGRES_SAVE_MANY = """
+WITH input AS (
+    SELECT * FROM unnest(%s::text[], %s::jsonb[], %s::bigint[]) AS t(session_id, data, expected)
+),
+updated AS (
+    UPDATE orderbot_sessions s
+    SET data = input.data, version = s.version + 1, updated_at = CURRENT_TIMESTAMP
+    FROM input
+    WHERE s.session_id = input.session_id AND input.expected > 0 AND s.version = input.expected
+    RETURNING s.session_id, s.version
+),
+inserted AS (
+    INSERT INTO orderbot_sessions (session_id, data, version)
+    SELECT session_id, data, 1 FROM input WHERE expected = 0
+    ON CONFLICT (session_id) DO NOTHING
+    RETURNING session_id, version
+)
+SELECT session_id, version FROM updated
+UNION ALL
+SELECT session_id, version FROM inserted
+"""
+
+
+class SessionConflict(Exception):
+    """A turn could not get its conversation's lease, or lost its session write after the lease lapsed."""
+
+
+class SessionBackend:
+    """
+    Durable, shared home of sessions. `data` is a JSON-serializable dict.
+
+    Every row carries a version that each successful write bumps (a new
+    session starts at 1, 0 means "not stored"). Writes are conditional on
+    the version the writer last saw, so two instances that served the
+    same conversation can't silently overwrite each other.
+
+    A turn first takes the session's lease, so while it runs no other
+    instance starts a turn on the same conversation.
+    """
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        """(data, version), or None if the session was never stored."""
+        raise NotImplementedError
+
+    def save_many(self, rows: List[Tuple[str, Dict[str, Any], int]]) -> Dict[str, Optional[int]]:
+        """Writes (session_id, data, expected_version) rows. Returns each new version, None where the stored version had moved on."""
+        raise NotImplementedError
+
+    def lease(self, session_id: str, owner: str, ttl: float) -> Optional[int]:
+        """Takes or extends the session's lease for `owner`. Returns the stored version (0 if not stored), None while someone else holds it."""
+        raise NotImplementedError
+
+    def unlease(self, session_id: str, owner: str):
+        """Gives the lease back if `owner` still holds it."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def prune(self, older_than: float) -> int:
+        """Deletes sessions last saved more than `older_than` seconds ago. Returns how many."""
+        return 0
+
+    def close(self):
+        pass
+
+
+class SqliteSessionBackend(SessionBackend):
+    """Single-file backend for local runs; also shared safely by several worker processes on one machine."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _open(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SQLITE_SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(orderbot_sessions)")}
+            if "version" not in columns:
+                self._conn.execute("ALTER TABLE orderbot_sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        return self._conn
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        with self._lock:
+            row = self._open().execute("SELECT data, version FROM orderbot_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def save_many(self, rows: List[Tuple[str, Dict[str, Any], int]]) -> Dict[str, Optional[int]]:
+        results: Dict[str, Optional[int]] = {}
+        now = time.time()
+        with self._lock:
+            conn = self._open()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for session_id, data, expected in rows:
+                    if expected == 0:
+                        written = conn.execute(
+                            "INSERT OR IGNORE INTO orderbot_sessions (session_id, data, version, updated_at) VALUES (?, ?, 1, ?)",
+                            (session_id, json.dumps(data), now),
+                        ).rowcount
+                    else:
+                        written = conn.execute(
+                            "UPDATE orderbot_sessions SET data = ?, version = version + 1, updated_at = ? WHERE session_id = ? AND version = ?",
+                            (json.dumps(data), now, session_id, expected),
+                        ).rowcount
+                    results[session_id] = expected + 1 if written else None
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def lease(self, session_id: str, owner: str, ttl: float) -> Optional[int]:
+        now = time.time()
+        with self._lock:
+            conn = self._open()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                taken = conn.execute(
+                    "INSERT INTO orderbot_session_leases (session_id, owner, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                    "WHERE orderbot_session_leases.owner = excluded.owner OR orderbot_session_leases.expires_at <= ?",
+                    (session_id, owner, now + ttl, now),
+                ).rowcount
+                row = conn.execute("SELECT version FROM orderbot_sessions WHERE session_id = ?", (session_id,)).fetchone()
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if not taken:
+            return None
+        return row[0] if row else 0
+
+    def unlease(self, session_id: str, owner: str):
+        with self._lock:
+            self._open().execute("DELETE FROM orderbot_session_leases WHERE session_id = ? AND owner = ?", (session_id, owner))
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._open().execute("DELETE FROM orderbot_sessions WHERE session_id = ?", (session_id,))
+
+    def prune(self, older_than: float) -> int:
+        with self._lock:
+            conn = self._open()
+            conn.execute("DELETE FROM orderbot_session_leases WHERE expires_at < ?", (time.time(),))
+            return conn.execute("DELETE FROM orderbot_sessions WHERE updated_at < ?", (time.time() - older_than,)).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class PostgresSessionBackend(SessionBackend):
+    """Production backend: every instance reads and writes the same orderbot_sessions table."""
+
+    def __init__(self, url: str):
+        from psycopg.types.json import Jsonb
+        from psycopg_pool import ConnectionPool
+
+        self._jsonb = Jsonb
+        self._pool = ConnectionPool(url, min_size=1, max_size=SESSION_BACKEND_POOL_SIZE, kwargs={"autocommit": True}, open=False)
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    def _connection(self):
+        if not self._opened:
+            with self._open_lock:
+                if not self._opened:
+                    self._pool.open()
+                    with self._pool.connection() as conn:
+                        conn.execute(POSTGRES_SCHEMA)
+                    self._opened = True
+        return self._pool.connection()
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        with self._connection() as conn:
+            row = conn.execute("SELECT data, version FROM orderbot_sessions WHERE session_id = %s", (session_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save_many(self, rows: List[Tuple[str, Dict[str, Any], int]]) -> Dict[str, Optional[int]]:
+        with self._connection() as conn:
+            written = dict(conn.execute(POSTGRES_SAVE_MANY, (
+                [session_id for session_id, _, _ in rows],
+                [self._jsonb(data) for _, data, _ in rows],
+                [expected for _, _, expected in rows],
+            )).fetchall())
+        return {session_id: written.get(session_id) for session_id, _, _ in rows}
+
+    def lease(self, session_id: str, owner: str, ttl: float) -> Optional[int]:
+        with self._connection() as conn:
+            row = conn.execute(POSTGRES_LEASE, {"session_id": session_id, "owner": owner, "ttl": ttl}).fetchone()
+        return row[0] if row else None
+
+    def unlease(self, session_id: str, owner: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM orderbot_session_leases WHERE session_id = %s AND owner = %s", (session_id, owner))
+
+    def delete(self, session_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM orderbot_sessions WHERE session_id = %s", (session_id,))
+
+    def prune(self, older_than: float) -> int:
+        with self._connection() as conn:
+            conn.execute("DELETE FROM orderbot_session_leases WHERE expires_at < CURRENT_TIMESTAMP")
+            return conn.execute(
+                "DELETE FROM orderbot_sessions WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)", (older_than,)
+            ).rowcount
+
+    def close(self):
+        if self._opened:
+            self._pool.close()
+            self._opened = False
+
+
+def create_backend(url: str = SESSION_BACKEND_URL) -> Optional[SessionBackend]:
+    if not url or url == "none":
+        return None
+    if url.startswith("sqlite:///"):
+        return SqliteSessionBackend(url[len("sqlite:///"):])
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresSessionBackend(url)
+    raise ValueError(f"Unsupported SESSION_BACKEND_URL: {url}")
+
+
+class _Entry:
+    def __init__(self, state: SessionState, version: int = 0):
+        self.state = state
+        # Backend version this copy is based on
+        self.version = version
+        # Finished turns not written to the backend yet; `generation` counts them
+        self.dirty = False
+        self.generation = 0
+        # Last generation whose write finished (or failed); `release` waits for it
+        self.settled = 0
+        # Set when a write lost to another instance; the turns of this copy are gone
+        self.lost = False
+        self.last_used = time.monotonic()
+        self.size = 0
+        # Turns currently running on this session; pinned sessions are never evicted
+        self.pins = 0
+
+
+class SessionStore(InMemorySessionService):
+    """
+    Live conversations of this instance: our `SessionState` (cart, name)
+    plus ADK's `Session` (event history), which this class also serves as
+    the runner's session service, backed by a durable `backend` that all
+    instances share.
+
+    A turn starts with `acquire`, which waits until no other turn of the
+    conversation runs, here or on another instance (the backend lease),
+    then uses the session this instance already holds unless the backend
+    has a newer version, in which case it is reloaded. `release` ends the
+    turn and returns once the session is written, so the next message
+    finds it whichever instance serves it, and only then gives the lease
+    back. A writer thread writes the turns that end together in one batch
+    (group commit). Writes are still conditional on the version: a turn
+    that outlived its lease and lost to another instance is rejected, its
+    copy is dropped and `release` returns False. Its tools may have had
+    side effects, so the caller fails the turn rather than running it
+    again.
+
+    Memory stays bounded: sessions are kept in LRU order and dropped when
+    idle for `idle_ttl` seconds, when there are more than `max_live`, or
+    while their estimated size is over `max_bytes`. Sessions in the middle
+    of a turn, or whose write failed and is being retried, are kept.
+    """
+
+    def __init__(
+        self,
+        app_name: str = "orderbot",
+        backend: Optional[SessionBackend] = None,
+        max_live: int = SESSION_MAX_LIVE,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        max_bytes: int = SESSION_MAX_BYTES,
+        write_interval: float = SESSION_WRITE_INTERVAL,
+        lease_ttl: float = SESSION_LEASE_TTL,
+        lease_wait: float = SESSION_LEASE_WAIT,
+    ):
+        super().__init__()
+        self.app_name = app_name
+        self.backend = backend
+        self.max_live = max_live
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.write_interval = write_interval
+        self.lease_ttl = lease_ttl
+        self.lease_wait = lease_wait
+        # Lease owner name of this instance
+        self.owner = uuid.uuid4().hex
+        # session_id -> [lock, turns holding or waiting for it]; serializes turns of one session here
+        self._turn_locks: Dict[str, List] = {}
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: Dict[str, None] = {}
+        self._lock = threading.RLock()
+        # Notified whenever writes settle; `release` waits on it
+        self._written = threading.Condition(self._lock)
+        self._write_wanted = threading.Event()
+        self._write_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stopped = threading.Event()
+        self.bytes = 0
+        self.created = 0
+        self.rehydrated = 0
+        self.refreshed = 0
+        self.writes = 0
+        self.write_batches = 0
+        self.conflicts = 0
+        self.lease_waits = 0
+        self.lease_wait_seconds = 0.0
+        self.dropped = 0
+        self.backend_errors = 0
+        self.evictions: Dict[str, int] = {"idle": 0, "count": 0, "memory": 0, "shutdown": 0}
+
+    # ADK sessions are stored as sessions[app_name][user_id][session_id]; we use session_id as user_id
+    def _adk_session(self, session_id: str) -> Optional[Session]:
+        return self.sessions.get(self.app_name, {}).get(session_id, {}).get(session_id)
+
+    def _put_adk_session(self, session: Session):
+        self.sessions.setdefault(self.app_name, {}).setdefault(session.user_id, {})[session.id] = session
+
+    def _pop_adk_session(self, session_id: str) -> Optional[Session]:
+        users = self.sessions.get(self.app_name, {})
+        session = users.get(session_id, {}).pop(session_id, None)
+        if session_id in users and not users[session_id]:
+            del users[session_id]
+        return session
+
+    def _snapshot(self, session_id: str, entry: _Entry) -> Dict[str, Any]:
+        adk_session = self._adk_session(session_id)
+        return {
+            "state": entry.state.model_dump(mode="json"),
+            "adk_session": adk_session.model_dump(mode="json") if adk_session is not None else None,
+        }
+
+    def _drop(self, session_id: str):
+        """Forgets the local copy of a session. Called with the lock held."""
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry.size
+        self._dirty.pop(session_id, None)
+        self._pop_adk_session(session_id)
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        """The live SessionState, without loading or pinning it (used by tools during a turn)."""
+        entry = self._entries.get(session_id)
+        return entry.state if entry is not None else None
+
+    def _lock_turn(self, session_id: str):
+        with self._lock:
+            turn_lock = self._turn_locks.get(session_id)
+            if turn_lock is None:
+                turn_lock = self._turn_locks[session_id] = [threading.Lock(), 0]
+            turn_lock[1] += 1
+        turn_lock[0].acquire()
+
+    def _unlock_turn(self, session_id: str):
+        with self._lock:
+            turn_lock = self._turn_locks[session_id]
+            turn_lock[1] -= 1
+            if not turn_lock[1]:
+                del self._turn_locks[session_id]
+        turn_lock[0].release()
+
+    def _take_lease(self, session_id: str) -> Optional[int]:
+        """Waits for the session's lease. Returns the stored version, None if the backend couldn't be asked."""
+        started = time.monotonic()
+        delay = 0.01
+        while True:
+            try:
+                version = self.backend.lease(session_id, self.owner, self.lease_ttl)
+            except Exception as e:
+                # Go on without it; a write that then races another instance is still caught by its version
+                self.backend_errors += 1
+                logger.error(f"Error leasing session {session_id}: {e}")
+                return None
+            if version is not None:
+                if delay > 0.01:
+                    self.lease_waits += 1
+                    self.lease_wait_seconds += time.monotonic() - started
+                return version
+            if time.monotonic() - started + delay > self.lease_wait:
+                raise SessionConflict(f"Session {session_id} is busy on another instance")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    def _give_back_lease(self, session_id: str):
+        try:
+            self.backend.unlease(session_id, self.owner)
+        except Exception as e:
+            # It lapses after lease_ttl anyway
+            self.backend_errors += 1
+            logger.error(f"Error releasing the lease of session {session_id}: {e}")
+
+    def acquire(self, session_id: str, factory: Callable[[], SessionState]) -> SessionState:
+        """
+        Returns the latest copy of the session, loading or creating it, and
+        pins it until `release`. Waits while another turn of the session
+        runs; raises SessionConflict if it takes longer than `lease_wait`.
+        """
+        self._lock_turn(session_id)
+        try:
+            return self._acquire(session_id, factory)
+        except BaseException:
+            self._unlock_turn(session_id)
+            raise
+
+    def _acquire(self, session_id: str, factory: Callable[[], SessionState]) -> SessionState:
+        remote_version = self._take_lease(session_id) if self.backend is not None else None
+        entry = self._entries.get(session_id)
+        if entry is not None and remote_version is not None and not entry.dirty and not entry.pins:
+            # Another instance may have served this conversation since we last saw it
+            if remote_version != entry.version:
+                with self._lock:
+                    if self._entries.get(session_id) is entry and not entry.dirty and not entry.pins:
+                        self._drop(session_id)
+                        self.refreshed += 1
+
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is None:
+            loaded = self._load(session_id)
+            with self._lock:
+                # A concurrent acquire may have loaded it first
+                entry = self._entries.get(session_id)
+                if entry is None:
+                    entry = self._entries[session_id] = self._hydrate(session_id, loaded, factory)
+
+        with self._lock:
+            entry.pins += 1
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(session_id)
+            return entry.state
+
+    def _load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.load(session_id)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.error(f"Error loading session {session_id}: {e}")
+            return None
+
+    def _hydrate(self, session_id: str, loaded: Optional[Tuple[Dict[str, Any], int]], factory: Callable[[], SessionState]) -> _Entry:
+        """Builds the live entry from stored data, or a new session. Called with the lock held."""
+        if loaded is None:
+            self.created += 1
+            return _Entry(factory())
+        data, version = loaded
+        self.rehydrated += 1
+        self._pop_adk_session(session_id)
+        if data.get("adk_session"):
+            self._put_adk_session(Session.model_validate(data["adk_session"]))
+        return _Entry(SessionState.model_validate(data["state"]), version)
+
+    def release(self, session_id: str) -> bool:
+        """
+        Ends a turn: unpins the session, writes it to the backend, gives
+        the lease back and evicts whatever is over the limits. Returns False
+        if the write lost to another instance; the turn was dropped with the
+        local copy. A failed write is only logged and retried in the
+        background, and the lease is kept until it lapses so no other
+        instance resumes the conversation from older state meanwhile.
+        """
+        try:
+            return self._release(session_id)
+        finally:
+            self._unlock_turn(session_id)
+
+    def _release(self, session_id: str) -> bool:
+        generation = 0
+        unwritten = False
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry.pins -= 1
+                entry.last_used = time.monotonic()
+                if self.backend is not None:
+                    entry.dirty = True
+                    entry.generation += 1
+                    generation = entry.generation
+                    self._dirty[session_id] = None
+                self._measure(session_id, entry)
+        if generation:
+            if not self.write_interval or not self._threads:
+                self.write_dirty()
+            else:
+                self._write_wanted.set()
+            with self._written:
+                # Notified by the writer thread once the batch holding this turn is stored
+                self._written.wait_for(lambda: entry.settled >= generation)
+                unwritten = entry.dirty and not entry.lost
+        if self.backend is not None and not unwritten:
+            self._give_back_lease(session_id)
+        self.evict()
+        return entry is None or not entry.lost
+
+    def _measure(self, session_id: str, entry: _Entry):
+        adk_session = self._adk_session(session_id)
+        size = len(entry.state.model_dump_json())
+        if adk_session is not None:
+            size += len(adk_session.model_dump_json())
+        self.bytes += size - entry.size
+        entry.size = size
+
+    def write_dirty(self):
+        """Writes every finished turn not yet in the backend, in batches of SESSION_WRITE_BATCH."""
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    batch = []
+                    for session_id in list(self._dirty):
+                        entry = self._entries.get(session_id)
+                        if entry is None:
+                            del self._dirty[session_id]
+                            continue
+                        if entry.pins:
+                            # Mid-turn; written after the turn ends
+                            continue
+                        del self._dirty[session_id]
+                        batch.append((session_id, entry, self._snapshot(session_id, entry), entry.version, entry.generation))
+                        if len(batch) >= SESSION_WRITE_BATCH:
+                            break
+                if not batch:
+                    return
+                if not self._write_batch(batch):
+                    return
+
+    def _write_batch(self, batch: List[Tuple[str, _Entry, Dict[str, Any], int, int]]) -> bool:
+        try:
+            results = self.backend.save_many([(session_id, data, version) for session_id, _, data, version, _ in batch])
+        except Exception as e:
+            self.backend_errors += 1
+            logger.error(f"Error writing {len(batch)} sessions: {e}")
+            with self._lock:
+                for session_id, entry, _, _, generation in batch:
+                    if self._entries.get(session_id) is entry:
+                        self._dirty[session_id] = None
+                    entry.settled = max(entry.settled, generation)
+                self._written.notify_all()
+            return False
+
+        self.write_batches += 1
+        with self._lock:
+            for session_id, entry, _, version, generation in batch:
+                new_version = results.get(session_id)
+                entry.settled = max(entry.settled, generation)
+                if new_version is None:
+                    # Another instance wrote this conversation after we loaded it; theirs wins
+                    self.conflicts += 1
+                    logger.warning(f"Session {session_id} changed elsewhere since version {version}, dropping the local copy")
+                    entry.lost = True
+                    if self._entries.get(session_id) is entry and not entry.pins:
+                        self._drop(session_id)
+                    continue
+                self.writes += 1
+                entry.version = new_version
+                if entry.generation == generation:
+                    entry.dirty = False
+            self._written.notify_all()
+        return True
+
+    def evict(self, reason: Optional[str] = None):
+        """Drops sessions over the limits, or every unpinned one with reason="shutdown"."""
+        now = time.monotonic()
+        with self._lock:
+            victims = []
+            live, size = len(self._entries), self.bytes
+            for session_id, entry in self._entries.items():
+                if reason == "shutdown":
+                    why = reason
+                elif now - entry.last_used > self.idle_ttl:
+                    why = "idle"
+                elif live > self.max_live:
+                    why = "count"
+                elif size > self.max_bytes:
+                    why = "memory"
+                else:
+                    # Entries are in LRU order, the rest were used more recently
+                    break
+                if entry.pins or (entry.dirty and reason != "shutdown"):
+                    continue
+                victims.append((session_id, entry, why))
+                live -= 1
+                size -= entry.size
+
+            for session_id, entry, why in victims:
+                self.evictions[why] += 1
+                if self.backend is None:
+                    self.dropped += 1
+                elif entry.dirty:
+                    # Only at shutdown, after the last write attempt failed
+                    self.dropped += 1
+                    logger.error(f"Dropping session {session_id}, its last turns could not be written")
+                self._drop(session_id)
+
+    def _write_loop(self):
+        while not self._stopped.is_set():
+            # Woken by `release`; the interval only paces retries of failed writes
+            self._write_wanted.wait(self.write_interval)
+            self._write_wanted.clear()
+            try:
+                self.write_dirty()
+            except Exception as e:
+                logger.error(f"Error writing sessions: {e}")
+
+    def _sweep_loop(self):
+        last_prune = 0.0
+        while not self._stopped.wait(SESSION_SWEEP_INTERVAL):
+            try:
+                self.evict()
+                if self.backend is not None and time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    pruned = self.backend.prune(SESSION_RETENTION)
+                    if pruned:
+                        logger.info(f"Pruned {pruned} expired sessions")
+            except Exception as e:
+                logger.error(f"Error sweeping sessions: {e}")
+
+    def start(self):
+        if not self._threads:
+            self._stopped.clear()
+            self._threads = [threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)]
+            if self.write_interval:
+                self._threads.append(threading.Thread(target=self._write_loop, name="session-writer", daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def flush(self):
+        """Writes every finished turn and drops all idle sessions, e.g. before the instance shuts down."""
+        self.write_dirty()
+        self.evict("shutdown")
+
+    def stop(self):
+        self._stopped.set()
+        self._write_wanted.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self._entries),
+            "pinned": sum(1 for entry in self._entries.values() if entry.pins),
+            "unwritten": len(self._dirty),
+            "bytes": self.bytes,
+            "max_live": self.max_live,
+            "max_bytes": self.max_bytes,
+            "idle_ttl": self.idle_ttl,
+            "created": self.created,
+            "rehydrated": self.rehydrated,
+            "refreshed": self.refreshed,
+            "writes": self.writes,
+            "write_batches": self.write_batches,
+            "conflicts": self.conflicts,
+            # Turns that waited for another instance to finish a turn of the same conversation
+            "lease_waits": self.lease_waits,
+            "avg_lease_wait_ms": self.lease_wait_seconds / self.lease_waits * 1000 if self.lease_waits else 0.0,
+            "dropped": self.dropped,
+            "evictions": dict(self.evictions),
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "backend_errors": self.backend_errors,
+        }
+
+
+session_store = SessionStore(backend=create_backend())
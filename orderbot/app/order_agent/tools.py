@@ -1,27 +1,16 @@
-from typing import Optional, Dict, Any, List
+import asyncio
+import logging
 from app.supabase_client import supabase
 from app.order_agent.session import SessionState, OrderItem
+from app.order_agent.menu_cache import menu_cache
+from app.order_agent.menu_index import MAX_SUGGESTIONS, index_for
+from app.order_agent.menu_render import render as render_menu
 
-# Business resolution helper
-def _get_business_id(phone_number: str) -> Optional[str]:
-    """Helper to resolve business UUID from phone number."""
-    try:
-        response = supabase.table("businesses").select("business_id").eq("whatsapp_phone_number", phone_number).execute()
-        if response.data:
-            return response.data[0].get("business_id")
-        return None
-    except Exception as e:
-        print(f"Error fetching business ID from Supabase: {e}")
-        return None
+logger = logging.getLogger(__name__)
 
-def _get_menu_items(business_id: str) -> List[Dict[str, Any]]:
-    try:
-        # Note: 'menu_items' table uses 'item_id', 'name', 'price', etc.
-        response = supabase.table("menu_items").select("*").eq("business_id", business_id).execute()
-        return response.data or []
-    except Exception as e:
-        print(f"Error fetching menu from Supabase: {e}")
-        return []
+async def _execute(query):
+    """Runs a Supabase query in a worker thread so the event loop keeps serving other turns."""
+    return await asyncio.to_thread(query.execute)
 
 def get_user_phone_number(session: SessionState) -> str:
     """Get the user's phone number."""
@@ -36,67 +25,60 @@ def update_user_name(user_name: str, session: SessionState) -> str:
     session.name = user_name
     return "Successfully updated user name"
 
-def get_menu(session: SessionState) -> str:
-    """Get the menu for the business the user is interacting with."""
+async def get_menu(session: SessionState, category: str = "", page: int = 1, details: bool = False) -> str:
+    """
+    Get the menu for the business the user is interacting with.
+    Args:
+        category: Only list this section of the menu. Leave empty for the whole menu.
+        page: Page to show when the menu is split into pages.
+        details: Show the full descriptions (options, sizes, extras) instead of shortened ones.
+    """
     business_phone = session.business_phone_number
     if not business_phone:
         return "Error: Business phone number not found in session."
 
-    business_id = _get_business_id(business_phone)
+    business_id = await menu_cache.abusiness_id(business_phone)
     if not business_id:
         return "Error: Could not find business associated with this phone number."
 
-    items = _get_menu_items(business_id)
-    if not items:
+    menu = await menu_cache.aget_menu(business_id)
+    if not menu or not menu.items:
         return "The menu is currently empty."
 
-    menu_str = "Welcome to our menu!\n\n"
-    
-    for item in items:
-        price = float(item.get("price", 0))
-        name = item.get("name")
-        desc = item.get("description")
-        
-        menu_str += f"- {name}: ${price:.2f}"
-        if desc:
-            menu_str += f" ({desc})"
-        menu_str += "\n"
+    if details:
+        return render_menu(menu, fmt="full", category=category, page=page)
+    return render_menu(menu, category=category, page=page)
 
-    return menu_str
-
-def add_order_item(
+async def add_order_item(
     product_name: str, quantity: int, session: SessionState
 ) -> str:
-    """Add an item to the user's current order (cart)."""
+    """Add an item to the user's current order (cart). `product_name` may be the item name or its #id from the menu."""
     business_phone = session.business_phone_number
 
     if not business_phone:
         return "Error: Business phone number not found in session."
 
-    business_id = _get_business_id(business_phone)
+    business_id = await menu_cache.abusiness_id(business_phone)
     if not business_id:
         return "Error: Could not find business."
 
-    items = _get_menu_items(business_id)
-    
-    # Find item by name (case-insensitive)
-    target_item = None
-    for item in items:
-        if item.get("name", "").lower() == product_name.lower():
-            target_item = item
-            break
-    
+    menu = await menu_cache.aget_menu(business_id)
+    if not menu or not menu.items:
+        return "The menu is currently empty."
+
+    # Accent/case-insensitive name, word prefix, then typo-tolerant lookup
+    match = index_for(menu).match(product_name)
+    target_item = match.item
+
     if not target_item:
-        # Try partial match
-        matches = [i for i in items if product_name.lower() in i.get("name", "").lower()]
-        if len(matches) == 1:
-            target_item = matches[0]
-        elif len(matches) > 1:
-            names = ", ".join([m.get("name") for m in matches])
+        names = ", ".join([m.get("name") for m in match.candidates[:MAX_SUGGESTIONS]])
+        if match.kind == "fuzzy":
+            return f"Item '{product_name}' not found on the menu. Did you mean one of: {names}?"
+        elif match.candidates:
             return f"Multiple items found matching '{product_name}'. Please be more specific: {names}"
         else:
             return f"Item '{product_name}' not found on the menu."
-    
+
     # Construct the order item
     order_item = OrderItem(
         item_id=target_item.get("item_id"),
@@ -107,9 +89,11 @@ def add_order_item(
 
     session.add_item(order_item)
 
+    if match.kind == "fuzzy":
+        return f"Added {quantity}x {target_item.get('name')} to your cart (closest match to '{product_name}')."
     return f"Added {quantity}x {target_item.get('name')} to your cart."
 
-def add_order(delivery_type: str, address: str, session: SessionState) -> str:
+async def add_order(delivery_type: str, address: str, session: SessionState) -> str:
     """
     Place the order.
     Args:
@@ -131,7 +115,7 @@ def add_order(delivery_type: str, address: str, session: SessionState) -> str:
         return "Error: Delivery address is required for delivery orders."
 
     # 1. Get Business ID
-    business_id = _get_business_id(business_phone)
+    business_id = await menu_cache.abusiness_id(business_phone)
     if not business_id:
         return "Error: Could not resolve business ID."
 
@@ -141,11 +125,11 @@ def add_order(delivery_type: str, address: str, session: SessionState) -> str:
         
         # Try to find client
         try:
-            c_query = supabase.table("clients").select("client_id").eq("business_id", business_id).eq("wa_id", client_phone).execute()
+            c_query = await _execute(supabase.table("clients").select("client_id").eq("business_id", business_id).eq("wa_id", client_phone))
             if c_query.data:
                 client_id = c_query.data[0].get("client_id")
         except Exception as e:
-            print(f"Error checking client: {e}")
+            logger.error(f"Error checking client: {e}")
             
         # If not found, create
         if not client_id:
@@ -156,7 +140,7 @@ def add_order(delivery_type: str, address: str, session: SessionState) -> str:
                     "full_name": client_name,
                     "phone_number": client_phone
                 }
-                c_insert = supabase.table("clients").insert(new_client).execute()
+                c_insert = await _execute(supabase.table("clients").insert(new_client))
                 if c_insert.data:
                     client_id = c_insert.data[0].get("client_id")
             except Exception as e:
@@ -177,7 +161,7 @@ def add_order(delivery_type: str, address: str, session: SessionState) -> str:
             "status": "pending"
         }
         
-        order_insert = supabase.table("orders").insert(order_payload).execute()
+        order_insert = await _execute(supabase.table("orders").insert(order_payload))
         if not order_insert.data:
             return "Error: Failed to create order in Supabase."
             
@@ -196,7 +180,7 @@ def add_order(delivery_type: str, address: str, session: SessionState) -> str:
             })
         
         if items_payload:
-            supabase.table("order_items").insert(items_payload).execute()
+            await _execute(supabase.table("order_items").insert(items_payload))
 
         session.clear_cart()
 
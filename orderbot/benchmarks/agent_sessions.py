@@ -0,0 +1,144 @@
+"""
+Per-message setup cost and per-session memory of OrderbotADKAgent.
+
+Opens BENCH_SESSIONS (10k) sessions and, for each one, does the setup a
+message needs before the model is called, measuring time and traced memory:
+
+- legacy: a new Agent with seven session-bound tools per session (kept
+  forever) plus a new Runner per message, as before the shared runner;
+- shared: the SessionState and nothing else; the Agent and Runner are
+  built once.
+
+Then BENCH_MESSAGES messages go through the real ADK loop with the stub
+model (benchmarks/stub_model.py) and the in-memory Supabase, each calling
+add_order_item once, to show the end-to-end cost per turn, and once more
+with only BENCH_MAX_LIVE sessions allowed in memory, the rest spilling to
+SQLite, after which the first customer comes back to their cart.
+
+    uv run python benchmarks/agent_sessions.py
+"""
+import inspect
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from functools import wraps
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("FAKE_SUPABASE_LATENCY", "0")
+warnings.filterwarnings("ignore")
+
+import fake_supabase
+import stub_model
+
+from google.adk import Runner
+from google.adk.agents.llm_agent import Agent
+
+from app.order_agent import tools
+from app.order_agent.agent import OrderbotADKAgent
+from app.order_agent.session_store import SessionStore, SqliteSessionBackend
+
+SESSIONS = int(os.getenv("BENCH_SESSIONS", "10000"))
+MESSAGES = int(os.getenv("BENCH_MESSAGES", "500"))
+MAX_LIVE = int(os.getenv("BENCH_MAX_LIVE", "100"))
+
+TOOLS = [tools.get_user_phone_number, tools.get_user_name, tools.update_user_name, tools.get_menu, tools.add_order_item, tools.add_order, tools.get_order_summary]
+
+
+def legacy_bind_tool(func, session):
+    sig = inspect.signature(func)
+    new_sig = sig.replace(parameters=[p for p in sig.parameters.values() if p.name != "session"])
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, session=session, **kwargs)
+
+    wrapper.__signature__ = new_sig
+    return wrapper
+
+
+def legacy_setup(bot: OrderbotADKAgent, agents: dict, user_phone: str):
+    """What process_message did before the model call: per-session Agent, per-message Runner."""
+    session = bot.get_or_create_session(user_phone, fake_supabase.BUSINESS_PHONE)
+    if session.user_id not in agents:
+        agents[session.user_id] = Agent(
+            model=bot.model_name,
+            name="orderbot_agent",
+            description="Takes restaurant orders from users via chat.",
+            instruction=bot.system_instruction,
+            tools=[legacy_bind_tool(tool, session) for tool in TOOLS],
+        )
+    Runner(agent=agents[session.user_id], app_name="orderbot", session_service=bot._sessions, auto_create_session=True)
+
+
+def shared_setup(bot: OrderbotADKAgent, user_phone: str):
+    bot.release_session(bot.get_or_create_session(user_phone, fake_supabase.BUSINESS_PHONE))
+
+
+def measure(label: str, setup):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    samples = []
+    for i in range(SESSIONS):
+        start = time.perf_counter()
+        setup(f"52155{i:08d}")
+        samples.append(time.perf_counter() - start)
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    samples.sort()
+    print(
+        f"  {label:7s} setup p50={statistics.median(samples) * 1e6:8.1f}us  p99={samples[int(len(samples) * 0.99)] * 1e6:8.1f}us"
+        f"  total={sum(samples):6.2f}s  retained={retained / SESSIONS / 1024:6.1f}KiB/session"
+    )
+
+
+def main():
+    fake_supabase.install(fake_supabase.make_menu(50))
+    print(f"{SESSIONS} sessions")
+
+    legacy_bot = OrderbotADKAgent(SessionStore(max_live=SESSIONS))
+    agents: dict = {}
+    measure("legacy", lambda phone: legacy_setup(legacy_bot, agents, phone))
+    # Free the per-session agents before measuring the shared setup
+    agents.clear()
+
+    shared_bot = OrderbotADKAgent(SessionStore(max_live=SESSIONS))
+    measure("shared", lambda phone: shared_setup(shared_bot, phone))
+
+    stub_model.install(shared_bot)
+    names = [item["name"] for item in fake_supabase.make_menu(50)]
+    samples = []
+    for i in range(MESSAGES):
+        start = time.perf_counter()
+        reply = shared_bot.process_message(names[i % len(names)], f"52166{i:08d}", fake_supabase.BUSINESS_PHONE)
+        samples.append(time.perf_counter() - start)
+        assert reply.startswith("Added"), reply
+    print(f"{MESSAGES} messages through the ADK loop (stub model, one tool call each): p50={statistics.median(samples) * 1000:.2f}ms")
+
+    # Same turns with at most MAX_LIVE sessions in memory, the rest spilled to SQLite
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(backend=SqliteSessionBackend(os.path.join(tmp, "sessions.db")), max_live=MAX_LIVE)
+        bounded_bot = OrderbotADKAgent(store)
+        stub_model.install(bounded_bot)
+        for i in range(MESSAGES):
+            bounded_bot.process_message(names[i % len(names)], f"52177{i:08d}", fake_supabase.BUSINESS_PHONE)
+        first = bounded_bot.process_message(names[1], f"52177{0:08d}", fake_supabase.BUSINESS_PHONE)
+        cart = store.get(f"{fake_supabase.BUSINESS_PHONE}:52177{0:08d}").items
+        stats = store.stats()
+        print(
+            f"max_live={MAX_LIVE}: live={stats['live']} bytes={stats['bytes']} writes={stats['writes']} "
+            f"rehydrated={stats['rehydrated']}; first customer back with {len(cart)} items in the cart ({first})"
+        )
+        store.backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Turns in flight at once on one orderbot instance.
+
+Sends BENCH_TURNS messages from different customers at the same time, on
+one event loop like the /chat endpoint, with the stub model taking
+STUB_MODEL_LATENCY seconds per call (two calls per turn) and the in-memory
+Supabase FAKE_SUPABASE_LATENCY seconds per query (menu cache cold at the
+start):
+
+- blocking: the endpoint calling the synchronous `process_message`, as
+  before, so each turn holds the event loop until it finishes (only
+  BENCH_BLOCKING_TURNS of them, it takes turns x latency);
+- async: `process_message_async`, with the default concurrency limit and
+  with BENCH_LIMIT slots.
+
+Also reports how late a 10ms ticker on the same event loop ran, which is
+how long any other request (health checks, /metrics) would have waited.
+
+    uv run python benchmarks/concurrent_turns.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ.setdefault("STUB_MODEL_LATENCY", "0.2")
+warnings.filterwarnings("ignore")
+
+import fake_supabase
+import stub_model
+
+from app.order_agent.agent import ORDERBOT_MAX_CONCURRENT_TURNS, OrderbotADKAgent
+from app.order_agent.menu_cache import menu_cache
+from app.order_agent.session_store import SessionStore, SqliteSessionBackend
+
+TURNS = int(os.getenv("BENCH_TURNS", "500"))
+BLOCKING_TURNS = int(os.getenv("BENCH_BLOCKING_TURNS", "10"))
+LIMIT = int(os.getenv("BENCH_LIMIT", "50"))
+
+
+async def ticker(stalls: list, done: asyncio.Event):
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        stalls.append(time.perf_counter() - start - 0.01)
+
+
+async def measure(label: str, bot: OrderbotADKAgent, turns: int, names: list, blocking: bool):
+    menu_cache.invalidate()
+
+    async def turn(i: int) -> float:
+        start = time.perf_counter()
+        user_phone = f"52188{i:08d}"
+        if blocking:
+            reply = bot.process_message(names[i % len(names)], user_phone, fake_supabase.BUSINESS_PHONE)
+        else:
+            reply = await bot.process_message_async(names[i % len(names)], user_phone, fake_supabase.BUSINESS_PHONE)
+        assert reply.startswith("Added"), reply
+        return time.perf_counter() - start
+
+    stalls: list = []
+    done = asyncio.Event()
+    probe = asyncio.create_task(ticker(stalls, done))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    latencies = sorted(await asyncio.gather(*(turn(i) for i in range(turns))))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await probe
+    stalls.sort()
+    print(
+        f"  {label:24s} {turns:5d} turns in {elapsed:6.2f}s = {turns / elapsed:7.1f} turns/s"
+        f"  p50={statistics.median(latencies):6.2f}s  p99={latencies[int(len(latencies) * 0.99)]:6.2f}s"
+        f"  peak in flight={bot.peak_in_flight if not blocking else 1:4d}  loop stall p99={stalls[int(len(stalls) * 0.99)] * 1000:7.1f}ms max={stalls[-1] * 1000:7.1f}ms"
+    )
+
+
+def make_bot(path: str, max_concurrent_turns: int) -> OrderbotADKAgent:
+    store = SessionStore(backend=SqliteSessionBackend(path))
+    store.start()
+    bot = OrderbotADKAgent(store, max_concurrent_turns=max_concurrent_turns)
+    stub_model.install(bot)
+    return bot
+
+
+async def main():
+    fake_supabase.install(fake_supabase.make_menu(50))
+    names = [item["name"] for item in fake_supabase.make_menu(50) if item["is_available"]]
+    print(f"stub model {stub_model.LATENCY * 1000:.0f}ms per call, Supabase {fake_supabase.LATENCY * 1000:.0f}ms per query")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bots = [
+            ("blocking", make_bot(os.path.join(tmp, "blocking.db"), ORDERBOT_MAX_CONCURRENT_TURNS), BLOCKING_TURNS, True),
+            (f"async (limit {ORDERBOT_MAX_CONCURRENT_TURNS})", make_bot(os.path.join(tmp, "async.db"), ORDERBOT_MAX_CONCURRENT_TURNS), TURNS, False),
+            (f"async (limit {LIMIT})", make_bot(os.path.join(tmp, "limited.db"), LIMIT), TURNS, False),
+        ]
+        for label, bot, turns, blocking in bots:
+            await measure(label, bot, turns, names, blocking)
+        for label, bot, _, _ in bots:
+            bot._sessions.stop()
+            bot._sessions.backend.close()
+            if not label.startswith("blocking"):
+                print(f"  {label:24s} {bot.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+In-memory stand-in for the Supabase tables the orderbot tools read, with
+FAKE_SUPABASE_LATENCY seconds added to every query to mimic the network
+round trip. Benchmarks install it with `install(menu_items)`.
+"""
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List
+
+LATENCY = float(os.getenv("FAKE_SUPABASE_LATENCY", "0.04"))
+
+BUSINESS_ID = "00000000-0000-0000-0000-000000000001"
+BUSINESS_PHONE = "5215550000000"
+
+# Queries served per table
+queries: Counter = Counter()
+
+_WORDS = [
+    "pizza", "hawaiana", "pepperoni", "margarita", "cuatro", "quesos", "suprema", "vegetariana",
+    "mexicana", "bbq", "pollo", "jamón", "champiñones", "refresco", "agua", "horchata", "jamaica",
+    "alitas", "boneless", "papas", "gajo", "ensalada", "césar", "pasta", "alfredo", "boloñesa",
+    "lasaña", "postre", "pay", "queso", "brownie", "helado", "chica", "mediana", "grande", "familiar",
+]
+
+
+def make_menu(count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """`count` menu_items rows with realistic, partly overlapping Spanish names."""
+    rng = random.Random(seed)
+    items, names = [], set()
+    while len(items) < count:
+        name = " ".join(rng.sample(_WORDS, rng.randint(2, 4))).title()
+        if name in names:
+            continue
+        names.add(name)
+        items.append({
+            "item_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "business_id": BUSINESS_ID,
+            "name": name,
+            "description": f"{name} hecha al momento",
+            "price": round(rng.uniform(20, 400), 2),
+            "category": rng.choice(["Pizzas", "Bebidas", "Entradas", "Postres", "Pastas"]),
+            "is_available": rng.random() > 0.1,
+        })
+    return items
+
+
+class _Query:
+    def __init__(self, table: str, rows: List[Dict[str, Any]]):
+        self.table = table
+        self.rows = rows
+
+    def select(self, *_):
+        return self
+
+    def eq(self, column: str, value: Any):
+        return _Query(self.table, [row for row in self.rows if row.get(column) == value])
+
+    def limit(self, n: int):
+        return _Query(self.table, self.rows[:n])
+
+    def execute(self):
+        queries[self.table] += 1
+        time.sleep(LATENCY)
+        return type("Response", (), {"data": list(self.rows)})()
+
+
+class FakeSupabase:
+    def __init__(self, menu_items: List[Dict[str, Any]]):
+        self.tables = {
+            "businesses": [{"business_id": BUSINESS_ID, "whatsapp_phone_number": BUSINESS_PHONE}],
+            "menu_items": menu_items,
+        }
+
+    def table(self, name: str) -> _Query:
+        return _Query(name, self.tables.setdefault(name, []))
+
+
+def install(menu_items: List[Dict[str, Any]]) -> FakeSupabase:
+    """Points the orderbot's Supabase client at an in-memory copy of `menu_items`."""
+    import app.supabase_client
+    from app.order_agent import menu_cache, tools
+
+    fake = FakeSupabase(menu_items)
+    app.supabase_client.supabase = fake
+    menu_cache.supabase = fake
+    tools.supabase = fake
+    return fake
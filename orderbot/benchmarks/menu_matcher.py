@@ -0,0 +1,87 @@
+"""
+Lookup time of the add_order_item name matcher on synthetic menus.
+
+Compares the previous linear scan (lowercased exact pass, then substring
+pass) with the per-menu index for exact names, accent/case variants, word
+prefixes, typos and misses, on menus of 50, 500 and 5000 items
+(BENCH_MENU_SIZES to change). Index build time is reported separately
+since it only happens once per menu version.
+
+    uv run python benchmarks/menu_matcher.py
+"""
+import os
+import statistics
+import sys
+import time
+import unicodedata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+
+import fake_supabase
+
+from app.order_agent.menu_cache import Menu
+from app.order_agent.menu_index import MenuIndex
+
+SIZES = [int(size) for size in os.getenv("BENCH_MENU_SIZES", "50,500,5000").split(",")]
+REPEAT = int(os.getenv("BENCH_REPEAT", "200"))
+
+
+def linear_match(items, product_name):
+    """The matcher add_order_item used before the index."""
+    for item in items:
+        if item.get("name", "").lower() == product_name.lower():
+            return item
+    matches = [i for i in items if product_name.lower() in i.get("name", "").lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+def strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def queries(items) -> dict[str, str]:
+    name = items[len(items) // 3]["name"]
+    accented = next((i["name"] for i in items if strip_accents(i["name"]) != i["name"]), name)
+    words = name.split()
+    typo = " ".join(w[:1] + w[2:] if len(w) > 4 else w for w in words)
+    return {
+        "exact": name,
+        "accents/case": strip_accents(accented).upper(),
+        "word prefixes": " ".join(w[:4] for w in words),
+        "typo": typo,
+        "miss": "sushi de salmón",
+    }
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    for size in SIZES:
+        items = fake_supabase.make_menu(size)
+        menu = Menu(fake_supabase.BUSINESS_ID, items)
+        start = time.perf_counter()
+        index = MenuIndex(menu)
+        build = time.perf_counter() - start
+        print(f"{size} items (index built in {build * 1000:.1f}ms, {len(index.vocabulary)} words)")
+        for label, query in queries(items).items():
+            linear = timed(lambda: linear_match(items, query), REPEAT)
+            indexed = timed(lambda: index.match(query), REPEAT)
+            result = index.match(query)
+            found = result.item.get("name") if result.item else f"{len(result.candidates)} candidates"
+            print(f"  {label:14s} linear={linear * 1e6:9.1f}us  index={indexed * 1e6:8.1f}us  [{result.kind}] {found}")
+
+
+if __name__ == "__main__":
+    main()
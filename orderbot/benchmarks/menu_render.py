@@ -0,0 +1,88 @@
+"""
+Prompt size and build time of get_menu output on synthetic menus.
+
+For menus of 50, 500 and 5000 items (BENCH_MENU_SIZES) prints the estimated
+tokens of the whole menu in each format, of the first page and of a single
+category, and the time to build the text the first time versus serving it
+from the per-version cache. Token counts use the same estimate as /metrics
+(menu_render.estimate_tokens); with BENCH_COUNT_TOKENS=1 and a Gemini API
+key the full-menu counts are also checked with the model's tokenizer.
+
+    uv run python benchmarks/menu_render.py
+"""
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+
+import fake_supabase
+
+from app.order_agent.menu_cache import Menu
+from app.order_agent.menu_render import FORMATS, MENU_PAGE_SIZE, estimate_tokens, render, token_counts
+
+SIZES = [int(size) for size in os.getenv("BENCH_MENU_SIZES", "50,500,5000").split(",")]
+COUNT_TOKENS = os.getenv("BENCH_COUNT_TOKENS") == "1"
+MODEL = os.getenv("BENCH_MODEL", "gemini-3-flash-preview")
+
+
+def legacy_render(items) -> str:
+    """get_menu's output before the renderer: rebuilt with += on every call."""
+    menu_str = "Welcome to our menu!\n\n"
+    for item in items:
+        menu_str += f"- {item.get('name')}: ${float(item.get('price', 0)):.2f}"
+        if item.get("description"):
+            menu_str += f" ({item.get('description')})"
+        menu_str += "\n"
+    return menu_str
+
+
+def median_us(fn, repeat: int = 50) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def model_tokens(text: str) -> int:
+    from google import genai
+
+    return genai.Client().models.count_tokens(model=MODEL, contents=text).total_tokens
+
+
+def main():
+    for size in SIZES:
+        items = fake_supabase.make_menu(size)
+        menu = Menu(fake_supabase.BUSINESS_ID, items)
+        legacy = legacy_render(items)
+        counts = token_counts(menu)
+        print(f"{size} items")
+        print(f"  legacy        {estimate_tokens(legacy):7d} tokens  built every call in {median_us(lambda: legacy_render(items)):9.1f}us")
+        for fmt in FORMATS:
+            first = Menu(fake_supabase.BUSINESS_ID, items)
+            start = time.perf_counter()
+            render(first, fmt)
+            build = (time.perf_counter() - start) * 1e6
+            cached = median_us(lambda: render(first, fmt))
+            page = estimate_tokens(render(first, fmt))
+            category = estimate_tokens(render(first, fmt, category="Bebidas", page_size=0))
+            print(
+                f"  {fmt:12s}  {counts[fmt]:7d} tokens  page 1 ({MENU_PAGE_SIZE} items) {page:6d}  'Bebidas' {category:6d}"
+                f"  first render {build:9.1f}us  cached {cached:5.1f}us"
+            )
+        if COUNT_TOKENS:
+            measured = {"legacy": model_tokens(legacy)}
+            measured.update({fmt: model_tokens(render(menu, fmt, page_size=0)) for fmt in FORMATS})
+            print(f"  {MODEL} tokenizer: {measured}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+A stand-in for Gemini so the ADK agent loop can be benchmarked offline.
+
+For each user message StubLlm first calls `add_order_item` with the message
+text as the product name (exercising the tool path), then answers with the
+tool's result as text. STUB_MODEL_LATENCY seconds are spent per model call,
+asynchronously, like a network round trip.
+"""
+import asyncio
+import os
+from typing import AsyncGenerator
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+LATENCY = float(os.getenv("STUB_MODEL_LATENCY", "0.0"))
+
+_USAGE = types.GenerateContentResponseUsageMetadata(prompt_token_count=0, candidates_token_count=0, total_token_count=0)
+
+
+class StubLlm(BaseLlm):
+    model: str = "stub"
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        if LATENCY:
+            await asyncio.sleep(LATENCY)
+        last = llm_request.contents[-1] if llm_request.contents else None
+        parts = last.parts if last and last.parts else []
+        responses = [p.function_response for p in parts if p.function_response]
+        if responses:
+            result = responses[0].response.get("result", "")
+            yield LlmResponse(content=types.Content(role="model", parts=[types.Part.from_text(text=str(result))]), usage_metadata=_USAGE)
+            return
+        text = "".join(p.text or "" for p in parts)
+        yield LlmResponse(content=types.Content(role="model", parts=[
+            types.Part(function_call=types.FunctionCall(name="add_order_item", args={"product_name": text, "quantity": 1}))
+        ]), usage_metadata=_USAGE)
+
+
+def install(agent):
+    """Points an OrderbotADKAgent's shared agent definition at the stub model."""
+    agent._agent.model = StubLlm()
@@ -0,0 +1,72 @@
+"""
+Latency of the menu tools the model calls inside its loop.
+
+Runs `get_menu` and `add_order_item` against an in-memory Supabase with
+FAKE_SUPABASE_LATENCY seconds per query, first with every call going to the
+database (cache invalidated before each call, as before the menu cache) and
+then with the per-business cache warm.
+
+    uv run python benchmarks/tool_latency.py
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+
+import fake_supabase
+
+from app.order_agent.menu_cache import menu_cache
+from app.order_agent.session import SessionState
+from app.order_agent.tools import add_order_item, get_menu
+
+ITEMS = int(os.getenv("BENCH_MENU_ITEMS", "50"))
+CALLS = int(os.getenv("BENCH_CALLS", "200"))
+
+
+async def timed(fn, calls: int, cold: bool) -> list[float]:
+    samples = []
+    for _ in range(calls):
+        if cold:
+            menu_cache.invalidate()
+        start = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label: str, samples: list[float]):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"  {label:28s} p50={statistics.median(samples) * 1e6:10.1f}us  p99={p99 * 1e6:10.1f}us")
+
+
+async def main():
+    items = fake_supabase.make_menu(ITEMS)
+    fake_supabase.install(items)
+    session = SessionState(user_id="bench", phone_number="5215551111111", business_phone_number=fake_supabase.BUSINESS_PHONE)
+    product = items[len(items) // 2]["name"]
+
+    cold_calls = max(1, min(CALLS, int(2 / max(fake_supabase.LATENCY, 0.001))))
+    print(f"{ITEMS} menu items, {fake_supabase.LATENCY * 1000:.0f}ms per Supabase query")
+    report("get_menu (uncached)", await timed(lambda: get_menu(session), cold_calls, cold=True))
+    report("add_order_item (uncached)", await timed(lambda: add_order_item(product, 1, session), cold_calls, cold=True))
+    session.clear_cart()
+
+    menu_cache.preload(fake_supabase.BUSINESS_PHONE)
+    menu_cache._preloader.submit(lambda: None).result()
+    report("get_menu (cached)", await timed(lambda: get_menu(session), CALLS, cold=False))
+    report("add_order_item (cached)", await timed(lambda: add_order_item(product, 1, session), CALLS, cold=False))
+    print(f"  queries {dict(fake_supabase.queries)}")
+    print(f"  cache   {menu_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -20,12 +20,12 @@ sys.modules["google.genai"] = mock_genai_mod
 try:
     from app.order_agent.tools import add_order_item, get_order_summary, add_order
     from app.order_agent.utils import merge_user
-    import app.order_agent.tools as tools_module
+    from app.order_agent.menu_cache import Menu, menu_cache
 except ImportError as e:
     print(f"Import Error: {e}")
     sys.exit(1)
 
-# 4. Patch internal helpers in tools.py to avoid DB calls
+# 4. Patch the menu cache the tools read from to avoid DB calls
 def mock_get_business_id(phone):
     return "biz_123"
 
@@ -36,8 +36,8 @@ def mock_get_menu_items(bid):
         {"item_id": "3", "name": "Hamburger", "price": 5.0}
     ]
 
-tools_module._get_business_id = mock_get_business_id
-tools_module._get_menu_items = mock_get_menu_items
+menu_cache.business_id = mock_get_business_id
+menu_cache.get_menu = lambda bid: Menu(bid, mock_get_menu_items(bid))
 
 # 5. Runtime Mock
 class MockRuntime:
@@ -15,9 +15,7 @@ mock_genai_module = MagicMock()
 sys.modules["google"] = MagicMock()
 sys.modules["google.genai"] = mock_genai_module
 
-import app.order_agent.tools as tools_module
-from app.order_agent.tools import add_order_item
-from app.order_agent.utils import merge_user
+from app.order_agent.menu_cache import Menu, menu_cache
 from app.order_agent.tools import add_order_item
 from app.order_agent.utils import merge_user
 
@@ -39,11 +37,11 @@ def mock_get_menu_items(business_id):
 def mock_get_business_id(phone):
     return "biz_123"
 
-# Patch the helpers
-tools_module._get_menu_items = mock_get_menu_items
-tools_module._get_business_id = mock_get_business_id
+# Patch the menu cache the tools read from
+menu_cache.get_menu = lambda business_id: Menu(business_id, mock_get_menu_items(business_id))
+menu_cache.business_id = mock_get_business_id
 
-# Mock supabase to avoid import errors if strictly needed, but we patched the helpers directly.
+# Mock supabase to avoid import errors if strictly needed, but we patched the menu cache directly.
 # However, `app.order_agent.tools` imports `supabase` at top level. 
 # If `app.supabase_client` fails to import, we might have issues.
 # Assuming UV environment has dependencies installed.
@@ -0,0 +1,88 @@
+"""
+Concurrent messages of one conversation, as in reproduce_double_count.py.
+
+A customer sends MESSAGES messages at once while OTHERS other customers
+send one each. With the stub model taking STUB_MODEL_LATENCY seconds per
+call, the customer's turns must run one after another, in the order they
+arrived (every item in the cart once, the ADK history not interleaved),
+while the other customers' turns run alongside them instead of queuing.
+
+    uv run python tests/test_conversation_order.py
+"""
+import asyncio
+import os
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ["FAKE_SUPABASE_LATENCY"] = "0"
+os.environ["STUB_MODEL_LATENCY"] = "0.05"
+warnings.filterwarnings("ignore")
+
+MESSAGES = 4
+OTHERS = 16
+CUSTOMER = "5215552220000"
+
+
+async def run(bot, names):
+    import fake_supabase
+
+    async def send(message: str, user_phone: str):
+        return await bot.process_message_async(message, user_phone, fake_supabase.BUSINESS_PHONE)
+
+    start = time.perf_counter()
+    replies = await asyncio.gather(
+        *(send(names[i], CUSTOMER) for i in range(MESSAGES)),
+        *(send(names[i], f"52155533{i:05d}") for i in range(OTHERS)),
+    )
+    return replies, time.perf_counter() - start
+
+
+def check():
+    import fake_supabase
+    import stub_model
+    from app.order_agent.agent import OrderbotADKAgent
+    from app.order_agent.session_store import SessionStore
+
+    fake_supabase.install(fake_supabase.make_menu(50))
+    names = [item["name"] for item in fake_supabase.make_menu(50) if item["is_available"]]
+    store = SessionStore()
+    bot = OrderbotADKAgent(store)
+    stub_model.install(bot)
+
+    replies, elapsed = asyncio.run(run(bot, names))
+    assert all(reply.startswith("Added") for reply in replies), replies
+
+    session_id = bot.session_id(CUSTOMER, fake_supabase.BUSINESS_PHONE)
+    # Each message added its own item once, in the order sent
+    assert [item.name for item in store.get(session_id).items] == names[:MESSAGES]
+    # Each turn's events are contiguous in the history: user message, tool call and response, reply
+    events = store._adk_session(session_id).events
+    invocations = [event.invocation_id for event in events]
+    assert invocations == sorted(invocations, key=invocations.index)
+    assert [event.content.parts[0].text for event in events if event.author == "user"] == names[:MESSAGES]
+
+    turn = 2 * stub_model.LATENCY
+    stats = bot.stats()
+    assert stats["conversation_waits"] == MESSAGES - 1, stats
+    assert stats["conversations_busy"] == 0, stats
+    # The customer's turns ran back to back; everybody else's alongside them, not after them
+    assert MESSAGES * turn <= elapsed < (MESSAGES + OTHERS) * turn, elapsed
+    return elapsed, stats
+
+
+def test_conversation_turns_run_in_order():
+    check()
+
+
+if __name__ == "__main__":
+    print("--- Concurrent messages of one conversation ---")
+    elapsed, stats = check()
+    print(f"{MESSAGES} messages from one customer and {OTHERS} from others in {elapsed:.2f}s: OK")
+    print(stats)
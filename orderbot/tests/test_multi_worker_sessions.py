@@ -0,0 +1,226 @@
+"""
+Cart continuity across orderbot instances.
+
+Starts WORKERS processes, each with its own OrderbotADKAgent and
+SessionStore on one shared backend (a temporary SQLite file, or
+SESSION_BACKEND_URL when it points at Postgres), and sends two customers'
+messages round-robin across them, as a load balancer without sticky
+sessions would, each message as soon as the previous reply arrived. Every
+turn must see the cart and history left by the turn before it, whichever
+worker served it. A turn that arrives while another instance is still
+running one of the conversation must wait for it, and a turn that outlived
+its lease and lost its write must fail instead of running again. Runs with
+the stub model and the in-memory Supabase from benchmarks/, so it needs no
+network.
+
+    uv run python tests/test_multi_worker_sessions.py
+    SESSION_BACKEND_URL=postgresql://... uv run pytest tests/test_multi_worker_sessions.py
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ["FAKE_SUPABASE_LATENCY"] = "0"
+warnings.filterwarnings("ignore")
+
+WORKERS = 3
+MESSAGES = 12
+CUSTOMERS = ["5215551110001", "5215551110002"]
+
+
+def worker(backend_url: str, write_interval: float, inbox, outbox):
+    import fake_supabase
+    import stub_model
+    from app.order_agent.agent import OrderbotADKAgent
+    from app.order_agent.session_store import SessionStore, create_backend
+
+    fake_supabase.install(fake_supabase.make_menu(50))
+    store = SessionStore(backend=create_backend(backend_url), write_interval=write_interval)
+    store.start()
+    bot = OrderbotADKAgent(store)
+    stub_model.install(bot)
+
+    for message, user_phone in iter(inbox.get, None):
+        reply = bot.process_message(message, user_phone, fake_supabase.BUSINESS_PHONE)
+        outbox.put((reply, len(store.get(f"{fake_supabase.BUSINESS_PHONE}:{user_phone}").items)))
+    store.stop()
+    outbox.put(store.stats())
+    store.backend.close()
+
+
+def run(backend_url: str, write_interval: float):
+    import fake_supabase
+    from app.order_agent.session_store import create_backend
+
+    names = [item["name"] for item in fake_supabase.make_menu(50) if item["is_available"]]
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for _ in range(WORKERS):
+        inbox, outbox = context.Queue(), context.Queue()
+        process = context.Process(target=worker, args=(backend_url, write_interval, inbox, outbox))
+        process.start()
+        workers.append((process, inbox, outbox))
+
+    try:
+        for i in range(MESSAGES):
+            for c, user_phone in enumerate(CUSTOMERS):
+                _, inbox, outbox = workers[(i + c) % WORKERS]
+                inbox.put((names[i], user_phone))
+                reply, cart_size = outbox.get(timeout=60)
+                assert reply.startswith("Added"), reply
+                # Each turn sees every item added before it, on whichever worker
+                assert cart_size == i + 1, f"{user_phone} turn {i + 1} on worker {(i + c) % WORKERS}: {cart_size} items"
+        stats = []
+        for process, inbox, outbox in workers:
+            inbox.put(None)
+            stats.append(outbox.get(timeout=60))
+            process.join(timeout=30)
+    finally:
+        for process, _, _ in workers:
+            if process.is_alive():
+                process.terminate()
+
+    backend = create_backend(backend_url)
+    try:
+        for user_phone in CUSTOMERS:
+            data, version = backend.load(f"{fake_supabase.BUSINESS_PHONE}:{user_phone}")
+            assert [item["name"] for item in data["state"]["items"]] == names[:MESSAGES]
+            user_turns = [e for e in data["adk_session"]["events"] if e.get("author") == "user"]
+            assert len(user_turns) == MESSAGES
+            assert version == MESSAGES
+    finally:
+        backend.close()
+    assert sum(s["conflicts"] for s in stats) == 0, stats
+    assert sum(s["refreshed"] for s in stats) > 0, stats
+    return stats
+
+
+def run_busy(backend_url: str):
+    """Sends the customer's next message to another instance in the middle of a turn: it waits for the lease."""
+    import fake_supabase
+    import stub_model
+    from app.order_agent.agent import OrderbotADKAgent
+    from app.order_agent.session_store import SessionStore, create_backend
+
+    fake_supabase.install(fake_supabase.make_menu(50))
+    names = [item["name"] for item in fake_supabase.make_menu(50) if item["is_available"]]
+    first, second = (OrderbotADKAgent(SessionStore(backend=create_backend(backend_url))) for _ in range(2))
+    for bot in (first, second):
+        stub_model.install(bot)
+    user_phone = CUSTOMERS[0]
+    session_id = first.session_id(user_phone, fake_supabase.BUSINESS_PHONE)
+    first.process_message(names[0], user_phone, fake_supabase.BUSINESS_PHONE)
+
+    acquire = first._sessions.acquire
+    replies = []
+    other = threading.Thread(target=lambda: replies.append(second.process_message(names[1], user_phone, fake_supabase.BUSINESS_PHONE)))
+
+    def acquire_then_race(sid, factory):
+        state = acquire(sid, factory)
+        if not other.is_alive():
+            other.start()
+            time.sleep(0.3)
+            assert not replies, "the other instance ran a turn while this one held the lease"
+        return state
+
+    first._sessions.acquire = acquire_then_race
+    reply = first.process_message(names[2], user_phone, fake_supabase.BUSINESS_PHONE)
+    other.join(timeout=30)
+    assert reply.startswith("Added") and replies and replies[0].startswith("Added"), (reply, replies)
+    assert second._sessions.lease_waits == 1, second._sessions.stats()
+    assert first._sessions.conflicts == second._sessions.conflicts == 0
+    data, version = first._sessions.backend.load(session_id)
+    # Both turns kept, in the order they got the lease
+    assert [item["name"] for item in data["state"]["items"]] == [names[0], names[2], names[1]]
+    assert version == 3
+    for bot in (first, second):
+        bot._sessions.backend.close()
+
+
+def run_lapsed(backend_url: str):
+    """A turn outlives its lease and another instance serves the customer meanwhile: the late turn fails, once."""
+    import fake_supabase
+    import stub_model
+    from app.order_agent.agent import OrderbotADKAgent
+    from app.order_agent.session_store import SessionConflict, SessionStore, create_backend
+
+    fake_supabase.install(fake_supabase.make_menu(50))
+    names = [item["name"] for item in fake_supabase.make_menu(50) if item["is_available"]]
+    first = OrderbotADKAgent(SessionStore(backend=create_backend(backend_url), lease_ttl=0.2))
+    second = OrderbotADKAgent(SessionStore(backend=create_backend(backend_url)))
+    for bot in (first, second):
+        stub_model.install(bot)
+    user_phone = CUSTOMERS[1]
+    session_id = first.session_id(user_phone, fake_supabase.BUSINESS_PHONE)
+    first.process_message(names[0], user_phone, fake_supabase.BUSINESS_PHONE)
+
+    acquire = first._sessions.acquire
+    acquired = []
+
+    def acquire_then_lapse(sid, factory):
+        state = acquire(sid, factory)
+        acquired.append(sid)
+        time.sleep(0.3)
+        second.process_message(names[1], user_phone, fake_supabase.BUSINESS_PHONE)
+        return state
+
+    first._sessions.acquire = acquire_then_lapse
+    try:
+        first.process_message(names[2], user_phone, fake_supabase.BUSINESS_PHONE)
+        raise AssertionError("the late turn was stored")
+    except SessionConflict:
+        pass
+    # Not run a second time, so its tools (add_order) didn't run twice
+    assert len(acquired) == 1 and first.turn_conflicts == 1 and first._sessions.conflicts == 1, first.stats()
+    data, version = first._sessions.backend.load(session_id)
+    assert [item["name"] for item in data["state"]["items"]] == names[:2]
+    assert version == 2
+    for bot in (first, second):
+        bot._sessions.backend.close()
+
+
+def run_all():
+    """Runs both write modes and the lease cases against SESSION_BACKEND_URL if it is Postgres, else against fresh SQLite files."""
+    import fake_supabase
+    from app.order_agent.session_store import create_backend
+
+    results = []
+    postgres_url = os.getenv("SESSION_BACKEND_URL", "")
+    with tempfile.TemporaryDirectory() as tmp:
+
+        def fresh(name: str) -> str:
+            if not postgres_url.startswith(("postgres://", "postgresql://")):
+                return f"sqlite:///{os.path.join(tmp, f'{name}.db')}"
+            backend = create_backend(postgres_url)
+            for user_phone in CUSTOMERS:
+                backend.delete(f"{fake_supabase.BUSINESS_PHONE}:{user_phone}")
+            backend.close()
+            return postgres_url
+
+        for write_interval in (0, 0.05):
+            url = fresh(f"sessions-{write_interval}")
+            results.append((url.split(":")[0], write_interval, run(url, write_interval)))
+        run_busy(fresh("busy"))
+        run_lapsed(fresh("lapsed"))
+    return results
+
+
+def test_cart_continuity_across_workers():
+    run_all()
+
+
+if __name__ == "__main__":
+    print("--- Multi-worker session continuity ---")
+    for backend, write_interval, stats in run_all():
+        print(f"{backend} write_interval={write_interval}s: OK; per worker: "
+              + ", ".join(f"rehydrated={s['rehydrated']} refreshed={s['refreshed']} writes={s['writes']}" for s in stats))